@@ -62,6 +62,20 @@ except ImportError as e:
 class AplicacionSensoresOnline:
     """Aplicación de gestión de sensores con MongoDB Atlas + Neo4j Aura"""
     
+    # Campos que usan las vistas de lista (proyección en las lecturas de MongoDB)
+    CAMPOS_LISTA_ALERTAS = ["alert_id", "categoria", "type", "sensor_id", "sensor_display", "location", "message",
+                            "severity", "status", "created_at", "resolved_by", "resolved_at"]
+    CAMPOS_LISTA_FACTURAS = ["invoice_id", "factura_id", "user_id", "usuario", "service", "tipo_servicio",
+                             "descripcion", "amount", "costo", "status", "estado", "created_at",
+                             "fecha_generacion", "due_date"]
+    TAMANO_PAGINA_ALERTAS = 100
+    CAMPOS_LISTA_PROCESOS = ["process_id", "nombre", "tipo", "tipo_proceso", "status", "progress", "agrupacion",
+                             "ubicacion", "user_id", "created_at"]
+    
+    # Texto de la columna Estado al refrescar el progreso de procesos en cola o en ejecución
+    ESTADOS_PROCESO = {"pending": "⏳ Pendiente", "queued": "🕒 En Cola", "running": "🔄 En Ejecución",
+                       "completed": "✅ Completado", "failed": "❌ Fallido", "cancelled": "⛔ Cancelado"}
+    
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Sistema de Gestión de Sensores")
@@ -111,17 +125,78 @@ class AplicacionSensoresOnline:
             config = config_mongodb_real.obtener_configuracion_completa()
             self.mongodb_service = ServicioMongoDBOptimizado(
                 connection_string=config["mongodb_url"],
-                database_name=config["mongodb_database"]
+                database_name=config["mongodb_database"],
+                opciones_cliente=config["mongodb_opciones_cliente"],
+                max_time_ms=config["mongodb_max_time_ms"],
+                lectura_analitica=config["mongodb_lectura_analitica"],
+                opciones_timeseries=config["mongodb_opciones_timeseries"],
+                politica_retencion=config["mongodb_politica_retencion"]
             )
             
             if self.mongodb_service.conectar():
                 print("OK MongoDB Atlas conectado")
+                self.iniciar_evaluador_alertas(config["mongodb_evaluador"])
             else:
                 print("ERROR Error conectando a MongoDB Atlas")
                 
         except Exception as e:
             print(f"ERROR Error inicializando MongoDB Atlas: {e}")
     
+    def configurar_procesos_segundo_plano(self):
+        """
+        Arrancar (después del login) el ejecutor de procesos, el cache de progreso en Redis y el
+        planificador de procesos periódicos
+        """
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            return
+        redis = self.redis_service if self.redis_service and self.redis_service.conectado else None
+        self.mongodb_service.cache_progreso = redis
+        
+        self.mongodb_service.iniciar_ejecutor_procesos({
+            # Las corridas del planificador traen su período en el payload del trabajo
+            "proceso_periodico": lambda proceso, control: self.ejecutar_proceso_periodico(
+                proceso["process_id"], dict(proceso, **proceso["job"]["payload"]), control),
+            # Usuario y rol que facturan viajan en el payload (no los de la sesión actual)
+            "servicio_premium": lambda proceso, control: self.ejecutar_servicio_background(
+                control=control, **proceso["job"]["payload"])
+        }, **config_mongodb_real.obtener_opciones_ejecutor())
+        
+        opciones = config_mongodb_real.obtener_opciones_planificador()
+        if not opciones.pop("activo", True):
+            return
+        self.mongodb_service.iniciar_planificador_procesos(
+            lease=redis,
+            callback_despacho=self.registrar_corrida_programada,
+            **opciones
+        )
+    
+    def detener_procesos_segundo_plano(self):
+        """Detener planificador y ejecutor al cerrar la sesión"""
+        if self.mongodb_service:
+            self.mongodb_service.detener_planificador_procesos()
+            self.mongodb_service.detener_ejecutor_procesos()
+    
+    def registrar_corrida_programada(self, corrida):
+        """Log de cada corrida que el planificador deja en la cola"""
+        mensaje = f"🗓️ Corrida programada de {corrida['process_id']}: {corrida['fecha_inicio']} a {corrida['fecha_fin']}"
+        if corrida["corridas_coalescidas"] > 1:
+            mensaje += f" ({corrida['corridas_coalescidas']} corridas atrasadas coalescidas)"
+        self.agregar_log(mensaje)
+    
+    def iniciar_evaluador_alertas(self, opciones):
+        """Arrancar la evaluación de umbrales en tiempo real sobre las mediciones que llegan"""
+        opciones = dict(opciones)
+        if not opciones.pop("activo", True):
+            return
+        self.mongodb_service.iniciar_evaluador_tiempo_real(
+            formatear_sensor=self.formatear_nombre_sensor,
+            # El evaluador corre en un hilo de fondo: el log (widget Tk) se escribe desde el hilo de Tk
+            callback_alertas=lambda r: self.root.after(
+                0, lambda: self.agregar_log(f"🌡️ {r['creadas']} alertas climáticas en tiempo real")
+            ),
+            **opciones
+        )
+    
     def obtener_valor_fecha(self, widget):
         """Obtener fecha de un widget DateEntry o Entry normal en formato YYYY-MM-DD."""
         try:
@@ -180,7 +255,7 @@ class AplicacionSensoresOnline:
         
         try:
             # Verificar si ya existen usuarios
-            usuarios_existentes = self.mongodb_service.obtener_usuarios()
+            usuarios_existentes = self.mongodb_service.obtener_usuarios(campos=["user_id"])
             
             # Asegurar que los roles existan antes de crear usuarios
             self.asegurar_roles_iniciales()
@@ -814,6 +889,10 @@ class AplicacionSensoresOnline:
                  command=self.cargar_sensores_para_alertas, 
                  bg='#16a085', fg='white', font=('Arial', 10)).grid(row=0, column=3, padx=5, pady=5, sticky='ew')
         
+        tk.Button(acciones_clima, text="♻️ Reevaluar Rango", 
+                 command=self.reevaluar_alertas_climaticas_rango, 
+                 bg='#d35400', fg='white', font=('Arial', 10)).grid(row=1, column=1, padx=5, pady=5, sticky='ew')
+        
         # --- Bloque: Alertas de Funcionamiento ---
         control_frame = tk.LabelFrame(top_frame, text="Alertas de Funcionamiento", 
                                    font=('Arial', 12, 'bold'), bg='white')
@@ -879,6 +958,20 @@ class AplicacionSensoresOnline:
                  command=self.aplicar_filtros_alertas, 
                  bg='#3498db', fg='white', font=('Arial', 9)).pack(side='left', padx=10)
         
+        # Paginación (las alertas se leen de a una página desde MongoDB)
+        self.pagina_alertas = 0
+        paginacion_frame = tk.Frame(lista_frame, bg='white')
+        paginacion_frame.pack(side='bottom', fill='x', padx=10, pady=5)
+        
+        tk.Button(paginacion_frame, text="◀ Anterior", 
+                 command=lambda: self.cambiar_pagina_alertas(-1), 
+                 bg='#95a5a6', fg='white', font=('Arial', 9)).pack(side='left', padx=5)
+        self.label_pagina_alertas = tk.Label(paginacion_frame, text="", bg='white', font=('Arial', 9))
+        self.label_pagina_alertas.pack(side='left', padx=10)
+        tk.Button(paginacion_frame, text="Siguiente ▶", 
+                 command=lambda: self.cambiar_pagina_alertas(1), 
+                 bg='#95a5a6', fg='white', font=('Arial', 9)).pack(side='left', padx=5)
+        
         # Treeview para alertas con columnas mejoradas
         columns = ("ID", "Tipo", "Ubicación/Sensor", "Descripción", "Severidad", "Estado", "Fecha", "Resuelto por", "Resuelto en")
         self.tree_alertas = ttk.Treeview(lista_frame, columns=columns, show="headings")
@@ -927,14 +1020,17 @@ class AplicacionSensoresOnline:
         except Exception as e:
             self.agregar_log(f"❌ Error configurando botones de alertas: {e}")
     
-    def detectar_alertas_climaticas_automaticas(self):
-        """Detectar alertas climáticas automáticamente basadas en TODAS las mediciones y umbrales"""
+    def detectar_alertas_climaticas_automaticas(self, reevaluar_desde=None, reevaluar_hasta=None):
+        """Detectar alertas climáticas en las mediciones nuevas desde la última corrida (o en un rango a re-evaluar)"""
         try:
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 messagebox.showerror("Error", "MongoDB no está disponible")
                 return
             
-            self.agregar_log("🔍 Iniciando detección automática de alertas climáticas en TODAS las mediciones...")
+            if reevaluar_desde or reevaluar_hasta:
+                self.agregar_log(f"♻️ Re-evaluando alertas climáticas entre {reevaluar_desde} y {reevaluar_hasta}...")
+            else:
+                self.agregar_log("🔍 Iniciando detección de alertas climáticas en las mediciones nuevas...")
             
             # Mostrar ventana de progreso
             progress_window = tk.Toplevel(self.root)
@@ -951,117 +1047,23 @@ class AplicacionSensoresOnline:
                                      bg='white')
             progress_label.pack(pady=10)
             
-            # Obtener todos los sensores
-            sensores = self.mongodb_service.obtener_sensores()
-            alertas_creadas = 0
-            sensores_procesados = 0
-            
-            progress_label.config(text=f"Procesando {len(sensores)} sensores...")
             progress_window.update()
             
-            for sensor in sensores:
-                sensor_id = sensor.get('sensor_id')
-                location = sensor.get('location', {})
-                
-                if not sensor_id or not location:
-                    continue
-                
-                sensores_procesados += 1
-                progress_label.config(text=f"Procesando sensor {sensores_procesados}/{len(sensores)}: {sensor_id}")
+            def progreso(resumen):
+                progress_label.config(text=f"Perfil de umbrales {resumen['perfiles']}/{resumen['total_perfiles']}: "
+                                           f"{resumen['violaciones']} violaciones")
                 progress_window.update()
-                
-                # Obtener ubicación
-                if isinstance(location, dict):
-                    ciudad = location.get('city', '')
-                    pais = location.get('country', '')
-                elif isinstance(location, str):
-                    # Parsear string de ubicación formato "Ciudad, Zona - País" o "Ciudad - País"
-                    if ' - ' in location:
-                        # Extraer país (después del guión)
-                        partes = location.split(' - ')
-                        pais = partes[-1].strip()
-                        
-                        # Extraer ciudad (antes del guión, puede tener zona)
-                        ciudad_zona = partes[0].strip()
-                        if ', ' in ciudad_zona:
-                            ciudad, _ = ciudad_zona.split(', ', 1)
-                            ciudad = ciudad.strip()
-                        else:
-                            ciudad = ciudad_zona
-                    else:
-                        continue
-                else:
-                    continue
-                
-                if not ciudad or not pais:
-                    continue
-                
-                # Obtener umbrales para esta ubicación
-                umbrales = self.mongodb_service.obtener_umbrales_efectivos_por_ubicacion(sensor_id)
-                
-                if not umbrales:
-                    self.agregar_log(f"⚠️ No hay umbrales configurados para {ciudad}, {pais}")
-                    continue
-                
-                # Obtener TODAS las mediciones del sensor (no solo la última)
-                mediciones = self.mongodb_service.obtener_mediciones_sensor(sensor_id)
-                
-                if not mediciones:
-                    self.agregar_log(f"⚠️ No hay mediciones para el sensor {sensor_id}")
-                    continue
-                
-                self.agregar_log(f"📊 Analizando {len(mediciones)} mediciones del sensor {sensor_id}")
-                
-                # Analizar cada medición
-                for medicion in mediciones:
-                    temperatura = medicion.get('temperature')
-                    humedad = medicion.get('humidity')
-                    timestamp = medicion.get('timestamp')
-                    
-                    if temperatura is None and humedad is None:
-                        continue
-                    
-                    # Verificar umbrales de temperatura
-                    if temperatura is not None:
-                        temp_min = umbrales.get('Temperatura', {}).get('min')
-                        temp_max = umbrales.get('Temperatura', {}).get('max')
-                        
-                        # Verificar si ya existe una alerta para esta medición específica
-                        if not self.existe_alerta_para_medicion(sensor_id, timestamp, "Temperatura"):
-                            if temp_min is not None and temperatura < temp_min:
-                                self.crear_alerta_climatica_automatica(
-                                    sensor_id, ciudad, pais, "Temperatura Baja", 
-                                    temperatura, temp_min, "Temperatura", timestamp
-                                )
-                                alertas_creadas += 1
-                            
-                            if temp_max is not None and temperatura > temp_max:
-                                self.crear_alerta_climatica_automatica(
-                                    sensor_id, ciudad, pais, "Temperatura Alta", 
-                                    temperatura, temp_max, "Temperatura", timestamp
-                                )
-                                alertas_creadas += 1
-                    
-                    # Verificar umbrales de humedad
-                    if humedad is not None:
-                        hum_min = umbrales.get('Humedad', {}).get('min')
-                        hum_max = umbrales.get('Humedad', {}).get('max')
-                        
-                        # Verificar si ya existe una alerta para esta medición específica
-                        if not self.existe_alerta_para_medicion(sensor_id, timestamp, "Humedad"):
-                            if hum_min is not None and humedad < hum_min:
-                                self.crear_alerta_climatica_automatica(
-                                    sensor_id, ciudad, pais, "Humedad Baja", 
-                                    humedad, hum_min, "Humedad", timestamp
-                                )
-                                alertas_creadas += 1
-                            
-                            if hum_max is not None and humedad > hum_max:
-                                self.crear_alerta_climatica_automatica(
-                                    sensor_id, ciudad, pais, "Humedad Alta", 
-                                    humedad, hum_max, "Humedad", timestamp
-                                )
-                                alertas_creadas += 1
+            
+            # Una agregación por perfil de umbrales y alertas escritas en bulk (idempotente)
+            resumen = self.mongodb_service.detectar_alertas_climaticas(
+                reevaluar_desde=reevaluar_desde,
+                reevaluar_hasta=reevaluar_hasta,
+                formatear_sensor=self.formatear_nombre_sensor,
+                callback_progreso=progreso
+            )
+            alertas_creadas = resumen["creadas"]
+            self.agregar_log(f"📊 {resumen['sensores']} sensores evaluados en {resumen['perfiles']} perfiles de umbrales: "
+                             f"{resumen['violaciones']} violaciones, {resumen['existentes']} alertas ya existían")
             
             # Cerrar ventana de progreso
             progress_window.destroy()
@@ -1079,93 +1081,61 @@ class AplicacionSensoresOnline:
             self.agregar_log(f"❌ Error en detección automática de alertas: {e}")
             messagebox.showerror("Error", f"Error detectando alertas: {e}")
     
+    def reevaluar_alertas_climaticas_rango(self):
+        """Elegir un rango de fechas y re-evaluarlo ignorando los watermarks (p. ej. tras cambiar umbrales)"""
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            messagebox.showerror("Error", "MongoDB no está disponible")
+            return
+        
+        ventana = tk.Toplevel(self.root)
+        ventana.title("Reevaluar Alertas")
+        ventana.configure(bg='white')
+        ventana.transient(self.root)
+        ventana.grab_set()
+        
+        tk.Label(ventana, text="Desde:", bg='white').grid(row=0, column=0, padx=10, pady=10, sticky='w')
+        entry_desde = DateEntry(ventana, width=15, date_pattern="yyyy-MM-dd", state="readonly")
+        entry_desde.set_date(datetime.now() - timedelta(days=30))
+        entry_desde.grid(row=0, column=1, padx=10, pady=10)
+        
+        tk.Label(ventana, text="Hasta:", bg='white').grid(row=1, column=0, padx=10, pady=10, sticky='w')
+        entry_hasta = DateEntry(ventana, width=15, date_pattern="yyyy-MM-dd", state="readonly")
+        entry_hasta.grid(row=1, column=1, padx=10, pady=10)
+        
+        def confirmar():
+            desde = datetime.strptime(self.obtener_valor_fecha(entry_desde), "%Y-%m-%d")
+            # Hasta incluye todo el día elegido
+            hasta = datetime.strptime(self.obtener_valor_fecha(entry_hasta), "%Y-%m-%d") + timedelta(days=1, microseconds=-1)
+            if desde > hasta:
+                messagebox.showerror("Error", "La fecha desde no puede ser posterior a la fecha hasta")
+                return
+            ventana.destroy()
+            self.detectar_alertas_climaticas_automaticas(reevaluar_desde=desde, reevaluar_hasta=hasta)
+        
+        tk.Button(ventana, text="♻️ Reevaluar", command=confirmar,
+                 bg='#d35400', fg='white', font=('Arial', 10)).grid(row=2, column=0, columnspan=2, pady=10)
+    
     def crear_alerta_climatica_automatica(self, sensor_id, ciudad, pais, tipo_alerta, valor_actual, umbral, parametro, timestamp=None):
         """Crear alerta climática automáticamente"""
         try:
-            # Generar ID único usando timestamp + sensor_id + número aleatorio
-            import time
-            import random
-            timestamp_str = str(int(time.time() * 1000))  # Usar milisegundos para mayor precisión
-            random_suffix = str(random.randint(1000, 9999))  # Número aleatorio adicional
-            alert_id = f"ALERT_CLIMATIC_{timestamp_str}_{sensor_id}_{random_suffix}"
-            
-            # Determinar severidad basada en qué tan lejos está del umbral
-            diferencia = abs(valor_actual - umbral)
-            if diferencia > 10:
-                severity = "crítica"
-            elif diferencia > 5:
-                severity = "alta"
-            elif diferencia > 2:
-                severity = "media"
-            else:
-                severity = "baja"
-            
-            # Crear mensaje descriptivo
-            if parametro == "Temperatura":
-                unidad = "°C"
-            else:
-                unidad = "%"
-            
-            mensaje = f"{tipo_alerta} en {ciudad}, {pais}: {valor_actual}{unidad} (umbral: {umbral}{unidad})"
-            
-            # Usar timestamp de la medición si está disponible
-            created_at = timestamp if timestamp else datetime.now().isoformat()
-            
-            alerta_data = {
-                "alert_id": alert_id,
-                "sensor_id": sensor_id,
-                "sensor_display": self.obtener_display_sensor(sensor_id),
-                "categoria": "Climática",
-                "type": tipo_alerta,
-                "severity": severity,
-                "status": "active",
-                "threshold": umbral,
-                "current_value": valor_actual,
-                "parameter": parametro,
-                "location": {
-                    "city": ciudad,
-                    "country": pais
-                },
-                "message": mensaje,
-                "created_at": created_at,
-                "created_by": "SYSTEM",
-                "automatic": True
-            }
+            alerta_data = self.construir_alerta_climatica_automatica(
+                sensor_id, ciudad, pais, tipo_alerta, valor_actual, umbral, parametro, timestamp
+            )
             
             # Guardar en MongoDB
             if self.mongodb_service.crear_alerta(alerta_data):
-                self.agregar_log(f"🌡️ Alerta climática automática creada: {mensaje}")
+                self.agregar_log(f"🌡️ Alerta climática automática creada: {alerta_data['message']}")
             
         except Exception as e:
             self.agregar_log(f"❌ Error creando alerta climática automática: {e}")
     
-    def existe_alerta_para_medicion(self, sensor_id, timestamp, parametro):
-        """Verificar si ya existe una alerta para una medición específica"""
-        try:
-            if not self.mongodb_service or not self.mongodb_service.conectado:
-                return False
-            
-            # Buscar alertas existentes para este sensor, timestamp y parámetro
-            query = {
-                "sensor_id": sensor_id,
-                "created_at": timestamp,
-                "categoria": "Climática",
-                "automatic": True
-            }
-            
-            # Agregar filtro por tipo de parámetro
-            if parametro == "Temperatura":
-                query["type"] = {"$in": ["Temperatura Alta", "Temperatura Baja"]}
-            elif parametro == "Humedad":
-                query["type"] = {"$in": ["Humedad Alta", "Humedad Baja"]}
-            
-            # Verificar si existe al menos una alerta
-            existing_alerts = list(self.mongodb_service.db.alerts.find(query).limit(1))
-            return len(existing_alerts) > 0
-            
-        except Exception as e:
-            self.agregar_log(f"❌ Error verificando alertas existentes: {e}")
-            return False
+    def construir_alerta_climatica_automatica(self, sensor_id, ciudad, pais, tipo_alerta, valor_actual, umbral,
+                                              parametro, timestamp=None, sensor_display=None):
+        """Armar el documento de una alerta climática automática (sin guardarlo)"""
+        return self.mongodb_service.construir_alerta_climatica(
+            sensor_id, sensor_display or self.obtener_display_sensor(sensor_id), ciudad, pais,
+            tipo_alerta, valor_actual, umbral, parametro, timestamp
+        )
     
     def mostrar_umbrales_por_ubicacion(self):
         """Mostrar umbrales por ubicación con interfaz simplificada"""
@@ -1288,7 +1258,7 @@ class AplicacionSensoresOnline:
                 ))
             
             # Obtener todas las ubicaciones únicas de los sensores
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             ubicaciones_sensores = set()
             
             for sensor in sensores:
@@ -1428,7 +1398,7 @@ class AplicacionSensoresOnline:
                 
                 # Cargar países y ciudades desde MongoDB
                 try:
-                    sensores = self.mongodb_service.obtener_sensores()
+                    sensores = self.mongodb_service.obtener_sensores(campos=["location"])
                     paises_set = set()
                     ciudades_por_pais = {}
                     
@@ -1609,7 +1579,7 @@ class AplicacionSensoresOnline:
                 return
             
             # Obtener todas las ubicaciones únicas de los sensores
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             ubicaciones = set()
             
             for sensor in sensores:
@@ -1668,7 +1638,7 @@ class AplicacionSensoresOnline:
                 ))
             
             # Obtener sensores y sus umbrales específicos
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["sensor_id", "location"])
             for sensor in sensores:
                 sensor_id = sensor.get('sensor_id')
                 location = sensor.get('location', {})
@@ -1747,21 +1717,17 @@ class AplicacionSensoresOnline:
                                       font=('Arial', 12, 'bold'), bg='white')
             stats_frame.pack(fill='x', padx=10, pady=10)
             
-            # Obtener todas las alertas
-            alertas = self.mongodb_service.obtener_alertas()
+            # Obtener contadores, desgloses y alertas recientes en una sola consulta
+            estadisticas = self.mongodb_service.obtener_estadisticas_alertas(
+                recientes=10, campos_recientes=self.CAMPOS_LISTA_ALERTAS
+            )
             
-            # Calcular estadísticas
-            total_alertas = len(alertas)
-            alertas_activas = len([a for a in alertas if a.get('status') == 'active'])
-            alertas_resueltas = len([a for a in alertas if a.get('status') == 'resolved'])
-            alertas_climaticas = len([a for a in alertas if a.get('categoria') == 'Climática'])
-            alertas_sensor = len([a for a in alertas if a.get('categoria') == 'Sensor'])
-            
-            # Contar por severidad
-            severidad_counts = {}
-            for alerta in alertas:
-                severity = alerta.get('severity', 'N/A')
-                severidad_counts[severity] = severidad_counts.get(severity, 0) + 1
+            total_alertas = estadisticas["total"]
+            alertas_activas = estadisticas["activas"]
+            alertas_resueltas = estadisticas["resueltas"]
+            alertas_climaticas = estadisticas["climaticas"]
+            alertas_sensor = estadisticas["sensor"]
+            severidad_counts = estadisticas["por_severidad"]
             
             # Crear grid de estadísticas
             stats_grid = tk.Frame(stats_frame, bg='white')
@@ -1802,6 +1768,18 @@ class AplicacionSensoresOnline:
                     col = 0
                     row += 1
             
+            # Estadísticas por ubicación
+            location_frame = tk.LabelFrame(scrollable_frame, text="📍 Ubicaciones con más Alertas", 
+                                        font=('Arial', 12, 'bold'), bg='white')
+            location_frame.pack(fill='x', padx=10, pady=10)
+            
+            location_grid = tk.Frame(location_frame, bg='white')
+            location_grid.pack(fill='x', padx=10, pady=10)
+            
+            for i, (ubicacion, count) in enumerate(estadisticas["por_ubicacion"]):
+                tk.Label(location_grid, text=f"{ubicacion}:", font=('Arial', 10, 'bold'), bg='white').grid(row=i // 2, column=(i % 2) * 2, sticky='w', padx=5)
+                tk.Label(location_grid, text=f"{count}", font=('Arial', 10), bg='white', fg='#2c3e50').grid(row=i // 2, column=(i % 2) * 2 + 1, sticky='w', padx=5)
+            
             # Alertas recientes
             recent_frame = tk.LabelFrame(scrollable_frame, text="🕒 Alertas Recientes (Últimas 10)", 
                                        font=('Arial', 12, 'bold'), bg='white')
@@ -1833,9 +1811,8 @@ class AplicacionSensoresOnline:
             tree_recent.pack(side="left", fill="both", expand=True)
             scrollbar_recent.pack(side="right", fill="y")
             
-            # Cargar alertas recientes
-            alertas_ordenadas = sorted(alertas, key=lambda x: x.get('created_at', ''), reverse=True)[:10]
-            self.cargar_alertas_recientes(tree_recent, alertas_ordenadas)
+            # Cargar alertas recientes (ya vienen ordenadas y limitadas desde MongoDB)
+            self.cargar_alertas_recientes(tree_recent, estadisticas["recientes"])
             
             # Pack canvas y scrollbar
             canvas.pack(side="left", fill="both", expand=True)
@@ -2035,7 +2012,7 @@ class AplicacionSensoresOnline:
                         return
                     
                     # Obtener alertas con filtros
-                    alertas = self.mongodb_service.obtener_alertas()
+                    alertas = self.mongodb_service.obtener_alertas(campos=self.CAMPOS_LISTA_ALERTAS)
                     
                     # Aplicar filtros
                     alertas_filtradas = []
@@ -2220,57 +2197,56 @@ class AplicacionSensoresOnline:
             raise e
     
     def aplicar_filtros_alertas(self):
-        """Aplicar filtros a la lista de alertas"""
+        """Aplicar filtros a la lista de alertas (vuelve a la primera página)"""
+        self.pagina_alertas = 0
+        self.cargar_pagina_alertas()
+    
+    def cambiar_pagina_alertas(self, desplazamiento):
+        """Avanzar o retroceder una página en la lista de alertas"""
+        self.pagina_alertas = max(0, self.pagina_alertas + desplazamiento)
+        self.cargar_pagina_alertas()
+    
+    def obtener_filtros_alertas(self):
+        """Traducir los combos de filtro del tab de alertas a criterios de consulta"""
+        filtro_tipo = self.combo_filtro_tipo.get()
+        filtro_estado = self.combo_filtro_estado.get()
+        filtro_severidad = self.combo_filtro_severidad.get()
+        
+        return {
+            "categoria": filtro_tipo if filtro_tipo in ("Climática", "Sensor") else None,
+            "status": {"Activa": "active", "Resuelta": "resolved"}.get(filtro_estado),
+            "severity": filtro_severidad.lower() if filtro_severidad and filtro_severidad != "Todas" else None
+        }
+    
+    def cargar_pagina_alertas(self):
+        """Cargar la página actual de alertas aplicando los filtros en el servidor"""
         try:
-            # Obtener valores de filtros
-            filtro_tipo = self.combo_filtro_tipo.get()
-            filtro_estado = self.combo_filtro_estado.get()
-            filtro_severidad = self.combo_filtro_severidad.get()
-            
             # Limpiar lista actual
             for item in self.tree_alertas.get_children():
                 self.tree_alertas.delete(item)
             
-            # Obtener todas las alertas
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return
             
-            alertas = self.mongodb_service.obtener_alertas()
+            filtros = self.obtener_filtros_alertas()
+            total = self.mongodb_service.contar_alertas_filtradas(**filtros)
+            total_paginas = max(1, -(-total // self.TAMANO_PAGINA_ALERTAS))
+            self.pagina_alertas = min(self.pagina_alertas, total_paginas - 1)
             
-            # Aplicar filtros
-            alertas_filtradas = []
-            for alerta in alertas:
-                # Filtro por tipo
-                if filtro_tipo != "Todas":
-                    categoria = alerta.get('categoria', 'Sensor')
-                    if filtro_tipo == "Climática" and categoria != "Climática":
-                        continue
-                    elif filtro_tipo == "Sensor" and categoria != "Sensor":
-                        continue
-                
-                # Filtro por estado
-                if filtro_estado != "Todas":
-                    estado = alerta.get('status', 'N/A')
-                    if filtro_estado == "Activa" and estado != "active":
-                        continue
-                    elif filtro_estado == "Resuelta" and estado != "resolved":
-                        continue
-                
-                # Filtro por severidad
-                if filtro_severidad != "Todas":
-                    severidad = alerta.get('severity', '').lower()
-                    if filtro_severidad.lower() != severidad:
-                        continue
-                
-                alertas_filtradas.append(alerta)
-            
-            # Mostrar alertas filtradas
-            self.mostrar_alertas_en_treeview(alertas_filtradas)
+            alertas = self.mongodb_service.obtener_alertas_filtradas(
+                **filtros,
+                skip=self.pagina_alertas * self.TAMANO_PAGINA_ALERTAS,
+                limit=self.TAMANO_PAGINA_ALERTAS,
+                campos=self.CAMPOS_LISTA_ALERTAS
+            )
             
-            self.agregar_log(f"🔍 Filtros aplicados: {len(alertas_filtradas)} alertas mostradas de {len(alertas)} totales")
+            self.mostrar_alertas_en_treeview(alertas)
+            self.label_pagina_alertas.config(
+                text=f"Página {self.pagina_alertas + 1} de {total_paginas} ({total} alertas)"
+            )
             
         except Exception as e:
-            self.agregar_log(f"❌ Error aplicando filtros: {e}")
+            self.agregar_log(f"❌ Error cargando alertas: {e}")
     
     def mostrar_alertas_en_treeview(self, alertas):
         """Mostrar alertas en el TreeView con formato mejorado"""
@@ -2387,7 +2363,7 @@ class AplicacionSensoresOnline:
                 return
             
             # Obtener sensores desde MongoDB
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["name", "location"])
             
             # Crear lista de nombres de sensores formateados
             nombres_sensores = []
@@ -2421,11 +2397,8 @@ class AplicacionSensoresOnline:
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return ciudad, pais
 
-            sensores = self.mongodb_service.obtener_sensores()
-            for sensor in sensores:
-                if sensor.get('sensor_id') != sensor_id:
-                    continue
-
+            sensor = self.mongodb_service.obtener_sensor_por_id(sensor_id, campos=["location"])
+            if sensor:
                 location = sensor.get('location', {})
                 if isinstance(location, dict):
                     ciudad = location.get('city', '') or ""
@@ -2439,7 +2412,6 @@ class AplicacionSensoresOnline:
                             ciudad = ciudad_zona.split(', ', 1)[0].strip()
                         else:
                             ciudad = ciudad_zona
-                break
         except Exception as exc:
             self.agregar_log(f"⚠️ No se pudo obtener ubicación del sensor {sensor_id}: {exc}")
 
@@ -2453,10 +2425,9 @@ class AplicacionSensoresOnline:
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return sensor_id
 
-            sensores = self.mongodb_service.obtener_sensores()
-            for sensor in sensores:
-                if sensor.get('sensor_id') == sensor_id:
-                    return self.formatear_nombre_sensor(sensor)
+            sensor = self.mongodb_service.obtener_sensor_por_id(sensor_id, campos=["name", "location"])
+            if sensor:
+                return self.formatear_nombre_sensor(sensor)
         except Exception as exc:
             self.agregar_log(f"⚠️ No se pudo obtener display del sensor {sensor_id}: {exc}")
         return sensor_id
@@ -2558,7 +2529,7 @@ class AplicacionSensoresOnline:
 
             # Mapear display a sensor_id intentando buscar por nombre
             sensor_id = None
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["sensor_id", "name", "location"])
             for s in sensores:
                 if self.formatear_nombre_sensor(s) == sensor_display:
                     sensor_id = s.get('sensor_id')
@@ -2822,7 +2793,7 @@ class AplicacionSensoresOnline:
         
         # Combo para filtrar por estado
         tk.Label(filtros_frame, text="Estado:", bg='white').grid(row=0, column=1, padx=5, pady=5, sticky='w')
-        self.combo_filtro_estado = ttk.Combobox(filtros_frame, values=["Todos", "⏳ Pendiente", "🔄 En Ejecución", "✅ Completado", "❌ Fallido"], 
+        self.combo_filtro_estado = ttk.Combobox(filtros_frame, values=["Todos", "⏳ Pendiente", "🕒 En Cola", "🔄 En Ejecución", "✅ Completado", "❌ Fallido", "⛔ Cancelado"], 
                                                width=20, state='readonly')
         self.combo_filtro_estado.grid(row=0, column=2, padx=5, pady=5)
         self.combo_filtro_estado.set("Todos")
@@ -2855,6 +2826,21 @@ class AplicacionSensoresOnline:
                   command=self.eliminar_proceso,
                   bg='#e74c3c', fg='white', font=('Arial', 10))
         self.btn_eliminar_proceso.pack(side='left', padx=5)
+        
+        # Cola del ejecutor de procesos (solo administradores y técnicos)
+        self.btn_encolar_proceso = tk.Button(botones_procesos_frame, text="▶️ Encolar Proceso",
+                  command=self.ejecutar_proceso,
+                  bg='#27ae60', fg='white', font=('Arial', 10))
+        self.btn_encolar_proceso.pack(side='left', padx=5)
+        
+        self.btn_cancelar_proceso = tk.Button(botones_procesos_frame, text="⛔ Cancelar Proceso",
+                  command=self.cancelar_proceso,
+                  bg='#e67e22', fg='white', font=('Arial', 10))
+        self.btn_cancelar_proceso.pack(side='left', padx=5)
+        
+        self.label_metricas_procesos = tk.Label(lista_frame, text="⚙️ Ejecutor de procesos: sin datos",
+                                                bg='white', fg='#2c3e50', font=('Arial', 9), anchor='w')
+        self.label_metricas_procesos.pack(fill='x', padx=10, pady=(0, 5))
 
         # Panel derecho: Creación y ejecución
         right_pane = tk.Frame(paned_window, bg='white')
@@ -2897,10 +2883,19 @@ class AplicacionSensoresOnline:
         self.combo_ciudad_proceso = ttk.Combobox(self.ejecucion_frame, width=37)
         self.combo_ciudad_proceso.grid(row=4, column=1, padx=5, pady=5)
 
+        tk.Label(self.ejecucion_frame, text="Desde:", bg='white').grid(row=5, column=0, padx=5, pady=5, sticky='w')
+        self.entry_fecha_desde_proceso = DateEntry(self.ejecucion_frame, width=15, date_pattern="yyyy-MM-dd", state="readonly")
+        self.entry_fecha_desde_proceso.set_date(datetime.now() - timedelta(days=365))
+        self.entry_fecha_desde_proceso.grid(row=5, column=1, padx=5, pady=5, sticky='w')
+
+        tk.Label(self.ejecucion_frame, text="Hasta:", bg='white').grid(row=6, column=0, padx=5, pady=5, sticky='w')
+        self.entry_fecha_hasta_proceso = DateEntry(self.ejecucion_frame, width=15, date_pattern="yyyy-MM-dd", state="readonly")
+        self.entry_fecha_hasta_proceso.grid(row=6, column=1, padx=5, pady=5, sticky='w')
+
         self.btn_ejecutar_proceso = tk.Button(self.ejecucion_frame, text="Ejecutar Proceso",
                                              command=self.ejecutar_proceso_analisis,
                                              bg='#27ae60', fg='white', font=('Arial', 10))
-        self.btn_ejecutar_proceso.grid(row=5, column=1, padx=5, pady=10, sticky='e')
+        self.btn_ejecutar_proceso.grid(row=7, column=1, padx=5, pady=10, sticky='e')
 
         # Frame para los resultados de los procesos
         resultados_frame = tk.LabelFrame(right_pane, text="Resultados del Proceso",
@@ -2921,6 +2916,7 @@ class AplicacionSensoresOnline:
         self.configurar_botones_procesos()
         self.configurar_botones_facturacion()
         self.actualizar_lista_procesos()
+        self.iniciar_actualizacion_metricas_procesos()
 
     def configurar_botones_procesos(self):
         """Configurar botones de procesos según el rol del usuario"""
@@ -2939,6 +2935,9 @@ class AplicacionSensoresOnline:
                     self.ejecucion_frame.pack(fill='x', padx=10, pady=10)
                 if hasattr(self, 'btn_ejecutar_proceso'):
                     self.btn_ejecutar_proceso.config(state='normal')
+                for boton in ('btn_encolar_proceso', 'btn_cancelar_proceso'):
+                    if hasattr(self, boton):
+                        getattr(self, boton).config(state='normal')
                 
                 # Habilitar botón de marcar como completado para admin/técnico
                 if hasattr(self, 'btn_marcar_completado'):
@@ -2957,6 +2956,9 @@ class AplicacionSensoresOnline:
                 # Ocultar botón de eliminar para usuarios comunes
                 if hasattr(self, 'btn_eliminar_proceso'):
                     self.btn_eliminar_proceso.config(state='disabled')
+                for boton in ('btn_encolar_proceso', 'btn_cancelar_proceso'):
+                    if hasattr(self, boton):
+                        getattr(self, boton).config(state='disabled')
                 
                 # Usuarios comunes: ocultar frame de ejecución
                 if hasattr(self, 'ejecucion_frame'):
@@ -2999,7 +3001,7 @@ class AplicacionSensoresOnline:
                 return
 
             # Obtener sensores de la base de datos
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             
             if not sensores:
                 self.agregar_log("⚠️ No hay sensores registrados, usando ubicaciones por defecto")
@@ -3152,13 +3154,14 @@ class AplicacionSensoresOnline:
 
             for item in self.tree_procesos.get_children():
                 self.tree_procesos.delete(item)
+            self._filas_procesos_activos = {}
 
             # Filtrar por rol: usuarios comunes solo ven sus procesos
             if hasattr(self, 'rol_usuario') and self.rol_usuario == "usuario":
-                procesos = self.mongodb_service.obtener_procesos(user_id=self.usuario_autenticado)
+                procesos = self.mongodb_service.obtener_procesos(user_id=self.usuario_autenticado, campos=self.CAMPOS_LISTA_PROCESOS)
             else:
                 # Administradores y técnicos ven todos
-                procesos = self.mongodb_service.obtener_procesos()
+                procesos = self.mongodb_service.obtener_procesos(campos=self.CAMPOS_LISTA_PROCESOS)
             
             # Obtener filtro de estado seleccionado
             filtro_estado = "Todos"
@@ -3168,9 +3171,11 @@ class AplicacionSensoresOnline:
             # Mapear emojis a estados reales
             estado_filtro_map = {
                 "⏳ Pendiente": "pending",
+                "🕒 En Cola": "queued",
                 "🔄 En Ejecución": "running",
                 "✅ Completado": "completed",
-                "❌ Fallido": "failed"
+                "❌ Fallido": "failed",
+                "⛔ Cancelado": "cancelled"
             }
             
             estado_filtro = estado_filtro_map.get(filtro_estado, None)
@@ -3205,6 +3210,10 @@ class AplicacionSensoresOnline:
                         estado_display = '✅ Completado'
                     elif estado_raw == 'failed':
                         estado_display = '❌ Fallido'
+                    elif estado_raw == 'queued':
+                        estado_display = '🕒 En Cola'
+                    elif estado_raw == 'cancelled':
+                        estado_display = '⛔ Cancelado'
                     else:
                         estado_display = str(estado_raw).capitalize()
                     
@@ -3232,7 +3241,7 @@ class AplicacionSensoresOnline:
                     tipo_proceso_norm = str(proceso.get('tipo_proceso', 'N/A'))
 
                     # Guardar el proceso completo en los tags del item
-                    self.tree_procesos.insert('' , 'end', values=(
+                    fila = self.tree_procesos.insert('' , 'end', values=(
                         process_id,          # Columna 0: ID
                         nombre,              # Columna 1: Nombre
                         tipo,                # Columna 2: Tipo
@@ -3241,6 +3250,8 @@ class AplicacionSensoresOnline:
                         agrupacion,          # Columna 5: Agrupación
                         estado_display       # Columna 6: Estado
                     ), tags=(process_id,))
+                    if estado_raw in ("queued", "running"):
+                        self._filas_procesos_activos[process_id] = fila
                     procesos_mostrados += 1
                     print(f"🔍 DEBUG: ✅ Agregando proceso '{nombre}' con estado '{estado_display}'")
                 except Exception as e:
@@ -3493,7 +3504,9 @@ class AplicacionSensoresOnline:
                 
                 # Ejecutar análisis usando el método del backend
                 resultados = self.mongodb_service.ejecutar_proceso_analisis(
-                    tipo_analisis, agrupacion, "Mensual", pais_filtro, ciudad_filtro
+                    tipo_analisis, agrupacion, "Mensual", pais_filtro, ciudad_filtro,
+                    fecha_inicio=proceso_seleccionado.get('fecha_inicio') or None,
+                    fecha_fin=proceso_seleccionado.get('fecha_fin') or None
                 )
                 
                 # Guardar resultados correctamente - convertir lista a diccionario
@@ -3744,6 +3757,9 @@ class AplicacionSensoresOnline:
             periodicidad = self.combo_periodicidad_proceso.get()
             pais = self.combo_pais_proceso.get()
             ciudad = self.combo_ciudad_proceso.get()
+            fecha_desde = self.obtener_valor_fecha(self.entry_fecha_desde_proceso)
+            # Incluir el día completo de la fecha final
+            fecha_hasta = datetime.strptime(self.obtener_valor_fecha(self.entry_fecha_hasta_proceso), "%Y-%m-%d") + timedelta(days=1, microseconds=-1)
             
             if not tipo_analisis or not agrupacion or not periodicidad:
                 messagebox.showwarning("Advertencia", "Por favor seleccione todos los parámetros")
@@ -3760,12 +3776,14 @@ class AplicacionSensoresOnline:
             self.texto_resultados_proceso.insert(tk.END, f"  - Agrupación: {agrupacion}\n")
             self.texto_resultados_proceso.insert(tk.END, f"  - Periodicidad: {periodicidad}\n")
             self.texto_resultados_proceso.insert(tk.END, f"  - País: {pais}\n")
-            self.texto_resultados_proceso.insert(tk.END, f"  - Ciudad: {ciudad}\n\n")
+            self.texto_resultados_proceso.insert(tk.END, f"  - Ciudad: {ciudad}\n")
+            self.texto_resultados_proceso.insert(tk.END, f"  - Período: {fecha_desde} a {fecha_hasta.strftime('%Y-%m-%d')}\n\n")
             self.texto_resultados_proceso.update()
             
             # Llamar al método del backend
             resultados = self.mongodb_service.ejecutar_proceso_analisis(
-                tipo_analisis, agrupacion, periodicidad, pais, ciudad, ""
+                tipo_analisis, agrupacion, periodicidad, pais, ciudad, "",
+                fecha_inicio=fecha_desde, fecha_fin=fecha_hasta
             )
             
             if resultados:
@@ -3887,7 +3905,7 @@ class AplicacionSensoresOnline:
                 return
             
             # Obtener estadísticas de procesos
-            todos_procesos = self.mongodb_service.obtener_procesos()
+            todos_procesos = self.mongodb_service.obtener_procesos(campos=["status"])
             
             if not todos_procesos:
                 self.label_estado_procesos.config(text="📊 No hay procesos registrados")
@@ -4052,7 +4070,7 @@ class AplicacionSensoresOnline:
                 return
             
             # Obtener todos los sensores para extraer países únicos
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             
             paises = set()
             
@@ -4093,7 +4111,7 @@ class AplicacionSensoresOnline:
                 return
             
             # Obtener todos los sensores
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             
             ciudades = set()
             zonas = set()
@@ -4279,43 +4297,18 @@ class AplicacionSensoresOnline:
 • Verifique que existan sensores del tipo seleccionado en esa ubicación
 • Los sensores encontrados fueron: {[s.get('name', 'N/A') for s in sensores_ubicacion]}"""
             
-            # Obtener mediciones de todos los sensores filtrados
-            todas_mediciones = []
-            for sensor in sensores_filtrados:
-                sensor_id = sensor.get('sensor_id', '')
-                sensor_name = sensor.get('name', '')
-                
-                # Obtener mediciones por sensor_id
-                mediciones = self.mongodb_service.obtener_mediciones_sensor_por_fechas(sensor_id, fecha_inicio, fecha_fin)
-                
-                # Si no hay mediciones por sensor_id, intentar por sensor_name
-                if not mediciones:
-                    mediciones = self.mongodb_service.obtener_mediciones_rango(
-                        sensor_name=sensor_name,
-                        fecha_inicio=fecha_inicio,
-                        fecha_fin=fecha_fin
-                    )
-                
-                # Filtrar mediciones según el tipo de sensor seleccionado
-                mediciones_filtradas = []
-                for medicion in mediciones:
-                    medicion['sensor_name'] = sensor_name
-                    medicion['sensor_id'] = sensor_id
-                    
-                    # Si es "Solo Temperatura", solo incluir mediciones con temperatura
-                    if tipo_sensor == "Solo Temperatura" and medicion.get('temperature') is None:
-                        continue
-                    
-                    # Si es "Solo Humedad", solo incluir mediciones con humedad
-                    if tipo_sensor == "Solo Humedad" and medicion.get('humidity') is None:
-                        continue
-                    
-                    mediciones_filtradas.append(medicion)
-                
-                debug_info += f"• Mediciones filtradas para {sensor_name}: {len(mediciones_filtradas)} de {len(mediciones)}\n"
-                todas_mediciones.extend(mediciones_filtradas)
+            # Calcular las estadísticas en el servidor (sin descargar mediciones crudas)
+            estadisticas = self.mongodb_service.obtener_estadisticas_mediciones(
+                [sensor.get('sensor_id', '') for sensor in sensores_filtrados],
+                fecha_inicio, fecha_fin, tipo_sensor,
+                sensor_names=[sensor.get('name', '') for sensor in sensores_filtrados if sensor.get('name')]
+            )
+            nombres_sensores = {sensor.get('sensor_id', ''): sensor.get('name', '') for sensor in sensores_filtrados}
+            
+            for sensor_id, stats in estadisticas["por_sensor"].items():
+                debug_info += f"• Mediciones para {nombres_sensores.get(sensor_id, sensor_id)}: {stats['count']}\n"
             
-            if not todas_mediciones:
+            if not estadisticas["total"]["count"]:
                 return f"""❌ No se encontraron mediciones en {ciudad}, {pais} para el período {fecha_inicio} - {fecha_fin}
 
 {debug_info}
@@ -4333,55 +4326,65 @@ class AplicacionSensoresOnline:
             progress_var.set("Generando reporte...")
             
             # Generar reporte simple
-            return self.generar_reporte_simple_ubicacion(ciudad, pais, todas_mediciones, tipo_sensor)
+            return self.generar_reporte_simple_ubicacion(ciudad, pais, estadisticas, tipo_sensor, nombres_sensores)
                 
         except Exception as e:
             return f"❌ Error procesando consulta: {e}"
     
-    def generar_reporte_simple_ubicacion(self, ciudad, pais, mediciones, tipo_sensor):
-        """Generar reporte simple por ubicación"""
+    def generar_reporte_simple_ubicacion(self, ciudad, pais, estadisticas, tipo_sensor, nombres_sensores=None):
+        """Generar reporte simple por ubicación a partir de las estadísticas calculadas en MongoDB"""
         try:
+            nombres_sensores = nombres_sensores or {}
+            total = estadisticas["total"]
+            por_sensor = estadisticas["por_sensor"]
+            
             resultado = f"""🌐 CONSULTA EN LÍNEA POR UBICACIÓN
 📍 Ubicación: {ciudad}, {pais}
-📅 Período: {len(mediciones)} mediciones
+📅 Período: {total['count']} mediciones
 🔧 Tipo de Sensor: {tipo_sensor}
 {'='*60}
 
 📈 RESUMEN GENERAL:
-• Total de mediciones: {len(mediciones)}
-• Sensores involucrados: {len(set(m.get('sensor_id', '') for m in mediciones))}
-• Período de datos: {min(m.get('timestamp', '') for m in mediciones if m.get('timestamp'))} - {max(m.get('timestamp', '') for m in mediciones if m.get('timestamp'))}
+• Total de mediciones: {total['count']}
+• Sensores involucrados: {len(por_sensor)}
+• Período de datos: {total.get('desde', '')} - {total.get('hasta', '')}
 
 """
             
             # Análisis de temperatura si corresponde
             if tipo_sensor == "Todos los Sensores" or tipo_sensor == "Solo Temperatura":
-                temperaturas = [m.get('temperature', 0) for m in mediciones if m.get('temperature') is not None]
-                if temperaturas:
+                if total.get('temp_count'):
                     resultado += f"""🌡️ ANÁLISIS DE TEMPERATURA:
-• Temperatura promedio: {sum(temperaturas)/len(temperaturas):.2f}°C
-• Temperatura mínima: {min(temperaturas):.2f}°C
-• Temperatura máxima: {max(temperaturas):.2f}°C
-• Rango de variación: {max(temperaturas) - min(temperaturas):.2f}°C
+• Temperatura promedio: {total['temp_avg']:.2f}°C
+• Temperatura mínima: {total['temp_min']:.2f}°C
+• Temperatura máxima: {total['temp_max']:.2f}°C
+• Rango de variación: {total['temp_max'] - total['temp_min']:.2f}°C
 
 """
             
             # Análisis de humedad si corresponde
             if tipo_sensor == "Todos los Sensores" or tipo_sensor == "Solo Humedad":
-                humedades = [m.get('humidity', 0) for m in mediciones if m.get('humidity') is not None]
-                if humedades:
+                if total.get('hum_count'):
                     resultado += f"""💧 ANÁLISIS DE HUMEDAD:
-• Humedad promedio: {sum(humedades)/len(humedades):.2f}%
-• Humedad mínima: {min(humedades):.2f}%
-• Humedad máxima: {max(humedades):.2f}%
-• Rango de variación: {max(humedades) - min(humedades):.2f}%
+• Humedad promedio: {total['hum_avg']:.2f}%
+• Humedad mínima: {total['hum_min']:.2f}%
+• Humedad máxima: {total['hum_max']:.2f}%
+• Rango de variación: {total['hum_max'] - total['hum_min']:.2f}%
 
 """
             
-            # Lista de sensores involucrados
-            sensores_unicos = list(set(m.get('sensor_name', 'N/A') for m in mediciones))
+            # Lista de sensores involucrados con sus cifras
+            lineas_sensores = []
+            for sensor_id, stats in por_sensor.items():
+                linea = f"• {nombres_sensores.get(sensor_id, sensor_id)}: {stats['count']} mediciones"
+                if stats.get('temp_count'):
+                    linea += f", temp. prom. {stats['temp_avg']:.2f}°C ({stats['temp_min']:.2f} / {stats['temp_max']:.2f})"
+                if stats.get('hum_count'):
+                    linea += f", hum. prom. {stats['hum_avg']:.2f}% ({stats['hum_min']:.2f} / {stats['hum_max']:.2f})"
+                lineas_sensores.append(linea)
+            
             resultado += f"""📊 SENSORES INVOLUCRADOS:
-{chr(10).join(f"• {sensor}" for sensor in sensores_unicos)}
+{chr(10).join(lineas_sensores)}
 
 """
             
@@ -4470,7 +4473,7 @@ class AplicacionSensoresOnline:
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return "MongoDB no disponible"
             
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             ubicaciones = set()
             
             for sensor in sensores:
@@ -4736,7 +4739,7 @@ class AplicacionSensoresOnline:
                     medicion = {
                         "sensor_id": sensor_id,
                         "sensor_name": sensor_name,
-                        "timestamp": timestamp.isoformat(),
+                        "timestamp": timestamp,
                         "temperature": round(temperatura, 2),
                         "humidity": round(humedad, 2),
                         "location": {
@@ -4752,7 +4755,7 @@ class AplicacionSensoresOnline:
             
             # Guardar mediciones en MongoDB
             if mediciones_generadas and self.mongodb_service.conectado:
-                self.mongodb_service.db.measurements.insert_many(mediciones_generadas)
+                self.mongodb_service.insertar_mediciones_lote(mediciones_generadas)
             
             return mediciones_generadas
             
@@ -5209,7 +5212,7 @@ class AplicacionSensoresOnline:
                 self.agregar_log("⚠️ MongoDB no disponible para cargar sensores de servicios")
                 return
             
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["name", "location"])
             nombres_sensores = []
             
             for sensor in sensores:
@@ -5272,10 +5275,23 @@ class AplicacionSensoresOnline:
             self.texto_resultados_servicio.insert(tk.END, f"Usuario: {self.usuario_autenticado}\n")
             self.texto_resultados_servicio.insert(tk.END, f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
             
-            # Ejecutar servicio en hilo separado
-            threading.Thread(target=self.ejecutar_servicio_background, 
-                           args=(sensor_seleccionado, fecha_inicio, fecha_fin, tipo_servicio, costo_estimado), 
-                           daemon=True).start()
+            # Encolar en el ejecutor de procesos (prioridad sobre los procesos periódicos)
+            servicio_id = f"SERV_{int(time.time())}"
+            encolado = self.mongodb_service and self.mongodb_service.encolar_proceso(
+                servicio_id, "servicio_premium",
+                payload={"sensor_seleccionado": sensor_seleccionado, "fecha_inicio": fecha_inicio,
+                         "fecha_fin": fecha_fin, "tipo_servicio": tipo_servicio,
+                         "costo_estimado": costo_estimado, "servicio_id": servicio_id,
+                         "usuario": self.usuario_autenticado, "rol": self.rol_usuario},
+                prioridad=1,
+                local=True,
+                datos={"nombre": f"Servicio premium: {tipo_servicio}", "tipo": tipo_servicio,
+                       "tipo_proceso": "servicio_premium", "user_id": self.usuario_autenticado}
+            )
+            if not encolado:
+                self.texto_resultados_servicio.insert(tk.END, "❌ No se pudo encolar el servicio\n")
+                return
+            self.texto_resultados_servicio.insert(tk.END, f"🕒 Servicio en cola: {servicio_id}\n")
             
         except Exception as e:
             self.agregar_log(f"❌ Error ejecutando servicio premium: {e}")
@@ -5342,38 +5358,69 @@ class AplicacionSensoresOnline:
             self.agregar_log(f"❌ Error calculando costo de proceso: {e}")
             return 50.00  # Costo por defecto
     
-    def ejecutar_servicio_background(self, sensor_seleccionado, fecha_inicio, fecha_fin, tipo_servicio, costo_estimado):
-        """Ejecutar servicio en segundo plano"""
+    def ejecutar_servicio_background(self, sensor_seleccionado, fecha_inicio, fecha_fin, tipo_servicio, costo_estimado,
+                                     servicio_id=None, control=None, usuario=None, rol=None):
+        """
+        Ejecutar servicio en segundo plano (`control` permite cancelarlo entre lotes).
+        Se factura a `usuario`/`rol` (quien lo pidió); por defecto, la sesión actual.
+        """
         try:
-            servicio_id = f"SERV_{int(time.time())}"
+            servicio_id = servicio_id or f"SERV_{int(time.time())}"
+            usuario = usuario or self.usuario_autenticado
+            rol = rol or self.rol_usuario
             inicio_ejecucion = datetime.now()
+            progreso = control.progreso if control else None
+            if progreso:
+                progreso.reportar(10)
             
             self.texto_resultados_servicio.insert(tk.END, f"📊 Obteniendo datos del sensor...\n")
             
-            # Obtener datos del sensor
-            sensor_name = sensor_seleccionado.split(" - ")[0]
-            mediciones = self.mongodb_service.obtener_mediciones_sensor_periodo(
-                sensor_name, fecha_inicio, fecha_fin
-            )
+            # Obtener datos del sensor (solo los campos que usan los análisis)
+            sensor_name = sensor_seleccionado.split(" (")[0]
+            sensor = next((s for s in self.mongodb_service.obtener_sensores(campos=["sensor_id", "name", "location"])
+                           if self.formatear_nombre_sensor(s) == sensor_seleccionado), None)
+            mediciones = []
+            if sensor:
+                lotes = self.mongodb_service.iterar_mediciones_sensor_por_fechas(
+                    sensor.get('sensor_id', ''), fecha_inicio, fecha_fin,
+                    campos=["timestamp", "temperature", "humidity"]
+                )
+                for numero, lote in enumerate(control.lotes(lotes) if control else lotes, 1):
+                    mediciones.extend(lote)
+                    if progreso:
+                        # Se desconoce el total: la lectura avanza hasta 45% de a un lote
+                        progreso.reportar(min(45, 10 + 5 * numero))
+            
+            # Cancelado antes de facturar: no se genera factura
+            if control and control.cancelado():
+                self.texto_resultados_servicio.insert(tk.END, f"⛔ Servicio cancelado\n")
+                self.agregar_log(f"⛔ Servicio premium cancelado: {servicio_id}")
+                return
             
             if not mediciones:
                 self.texto_resultados_servicio.insert(tk.END, f"❌ No se encontraron datos para el período especificado\n")
                 return
             
             self.texto_resultados_servicio.insert(tk.END, f"✅ Datos obtenidos: {len(mediciones)} mediciones\n")
+            if progreso:
+                progreso.reportar(50)
             
             # Ejecutar análisis según el tipo de servicio
             resultado = self.ejecutar_analisis_premium(mediciones, tipo_servicio, sensor_name)
+            if progreso:
+                progreso.reportar(70)
             
             # Calcular costo final
-            costo_final = self.calcular_costo_final(costo_estimado, len(mediciones))
+            costo_final = self.calcular_costo_final(costo_estimado, len(mediciones), rol)
             
             # Generar factura
-            factura_id = self.generar_factura_servicio(servicio_id, tipo_servicio, costo_final)
+            factura_id = self.generar_factura_servicio(servicio_id, tipo_servicio, costo_final, usuario, rol)
+            if progreso:
+                progreso.reportar(90)
             
             # Guardar en historial
             self.guardar_historial_servicio(servicio_id, tipo_servicio, sensor_name, 
-                                          fecha_inicio, fecha_fin, costo_final, factura_id)
+                                          fecha_inicio, fecha_fin, costo_final, factura_id, usuario)
             
             # Mostrar resultados
             self.texto_resultados_servicio.insert(tk.END, f"\n{'='*50}\n")
@@ -5392,7 +5439,7 @@ class AplicacionSensoresOnline:
                 self.texto_resultados_servicio.insert(tk.END, f"Estado: Facturado automáticamente\n")
             else:
                 self.texto_resultados_servicio.insert(tk.END, f"🆓 SERVICIO GRATUITO\n")
-                self.texto_resultados_servicio.insert(tk.END, f"Rol: {self.rol_usuario.title()}\n")
+                self.texto_resultados_servicio.insert(tk.END, f"Rol: {rol.title()}\n")
                 self.texto_resultados_servicio.insert(tk.END, f"Estado: Sin cargo por rol privilegiado\n")
             
             fin_ejecucion = datetime.now()
@@ -5400,6 +5447,8 @@ class AplicacionSensoresOnline:
             
             self.texto_resultados_servicio.insert(tk.END, f"\n⏱️ Tiempo de ejecución: {duracion:.2f} segundos\n")
             self.texto_resultados_servicio.insert(tk.END, f"✅ Servicio completado exitosamente\n")
+            if progreso:
+                progreso.reportar(100, "completed", result={"factura_id": factura_id, "costo_final": costo_final})
             
             self.agregar_log(f"✅ Servicio premium completado: {servicio_id} - ${costo_final:.2f}")
             
@@ -5611,11 +5660,11 @@ Datos históricos: {len(mediciones)} mediciones
         
         return resultado
     
-    def calcular_costo_final(self, costo_estimado, cantidad_datos):
-        """Calcular costo final basado en cantidad de datos y rol del usuario"""
+    def calcular_costo_final(self, costo_estimado, cantidad_datos, rol=None):
+        """Calcular costo final basado en cantidad de datos y rol del usuario (por defecto, el de la sesión)"""
         try:
             # Técnicos y administradores no pagan por servicios premium
-            if self.rol_usuario in ["técnico", "administrador"]:
+            if (rol or self.rol_usuario) in ["técnico", "administrador"]:
                 return 0.00
             
             # Factor de ajuste basado en cantidad de datos
@@ -5634,12 +5683,15 @@ Datos históricos: {len(mediciones)} mediciones
         except Exception as e:
             return costo_estimado
     
-    def generar_factura_servicio(self, servicio_id, tipo_servicio, costo_final):
-        """Generar factura automática para el servicio"""
+    def generar_factura_servicio(self, servicio_id, tipo_servicio, costo_final, usuario=None, rol=None):
+        """Generar factura automática para el servicio (a `usuario`/`rol`; por defecto, la sesión actual)"""
         try:
+            usuario = usuario or self.usuario_autenticado
+            rol = rol or self.rol_usuario
+            
             # Verificar si el usuario debe pagar (no es admin ni técnico)
-            if self.rol_usuario in ["administrador", "técnico"]:
-                self.agregar_log(f"✅ Usuario {self.rol_usuario} - Sin cargo por servicio: {tipo_servicio}")
+            if rol in ["administrador", "técnico"]:
+                self.agregar_log(f"✅ Usuario {rol} - Sin cargo por servicio: {tipo_servicio}")
                 return "SERVICIO_GRATUITO"
             
             # No generar factura si el costo es 0
@@ -5652,7 +5704,7 @@ Datos históricos: {len(mediciones)} mediciones
             factura_data = {
                 "factura_id": factura_id,
                 "servicio_id": servicio_id,
-                "usuario": self.usuario_autenticado,
+                "usuario": usuario,
                 "tipo_servicio": tipo_servicio,
                 "costo": costo_final,
                 "fecha_generacion": datetime.now().isoformat(),
@@ -5671,12 +5723,13 @@ Datos históricos: {len(mediciones)} mediciones
             self.agregar_log(f"❌ Error generando factura: {e}")
             return f"ERROR_{int(time.time())}"
     
-    def guardar_historial_servicio(self, servicio_id, tipo_servicio, sensor_name, fecha_inicio, fecha_fin, costo_final, factura_id):
+    def guardar_historial_servicio(self, servicio_id, tipo_servicio, sensor_name, fecha_inicio, fecha_fin, costo_final, factura_id,
+                                   usuario=None):
         """Guardar historial de ejecución del servicio"""
         try:
             historial_data = {
                 "servicio_id": servicio_id,
-                "usuario": self.usuario_autenticado,
+                "usuario": usuario or self.usuario_autenticado,
                 "tipo_servicio": tipo_servicio,
                 "sensor": sensor_name,
                 "fecha_inicio": fecha_inicio,
@@ -5846,6 +5899,22 @@ Datos históricos: {len(mediciones)} mediciones
         tk.Button(db_inner, text="📊 Estadísticas del Sistema", 
                  command=self.mostrar_estadisticas_sistema, 
                  bg='#27ae60', fg='white', font=('Arial', 10)).grid(row=2, column=1, padx=5, pady=10)
+        
+        tk.Button(db_inner, text="🧮 Reconstruir Rollups", 
+                 command=self.reconstruir_rollups_mediciones, 
+                 bg='#8e44ad', fg='white', font=('Arial', 10)).grid(row=2, column=2, padx=5, pady=10)
+        
+        tk.Button(db_inner, text="🕒 Migrar Timestamps", 
+                 command=self.migrar_timestamps_mediciones, 
+                 bg='#e67e22', fg='white', font=('Arial', 10)).grid(row=2, column=3, padx=5, pady=10)
+        
+        tk.Button(db_inner, text="⏱️ Migrar a Time Series", 
+                 command=self.migrar_mediciones_timeseries, 
+                 bg='#16a085', fg='white', font=('Arial', 10)).grid(row=3, column=0, padx=5, pady=10)
+        
+        tk.Button(db_inner, text="🗄️ Archivar Mediciones", 
+                 command=self.archivar_mediciones_antiguas, 
+                 bg='#7f8c8d', fg='white', font=('Arial', 10)).grid(row=3, column=1, padx=5, pady=10)
     
     def cargar_datos_iniciales(self):
         """Cargar datos iniciales desde MongoDB Atlas"""
@@ -5918,7 +5987,7 @@ Datos históricos: {len(mediciones)} mediciones
                 self.agregar_log("⚠️ Usando sensores por defecto (MongoDB no disponible)")
                 return
             
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["sensor_id", "name", "location"])
             
             if sensores:
                 # Crear lista de sensores con formato más descriptivo usando la función existente
@@ -6330,23 +6399,11 @@ Datos históricos: {len(mediciones)} mediciones
             for ubicacion in ubicaciones:
                 ciudad = ubicacion.split(',')[0].strip() if ',' in ubicacion else ubicacion
                 
-                # Obtener datos de temperatura
-                datos_temp = self.mongodb_service.obtener_datos_temperatura_por_ubicacion(ubicacion, None, None)
-                datos_hum = self.mongodb_service.obtener_datos_humedad_por_ubicacion(ubicacion, None, None)
+                # Máximos y mínimos calculados en el servidor (sin descargar mediciones)
+                extremos = self.mongodb_service.obtener_extremos_por_ubicacion(ubicacion)
                 
-                if datos_temp and datos_hum:
-                    # Calcular estadísticas
-                    temp_max = max(d['temp_max'] for d in datos_temp)
-                    temp_min = min(d['temp_min'] for d in datos_temp)
-                    hum_max = max(d['humedad'] for d in datos_hum)
-                    hum_min = min(d['humedad'] for d in datos_hum)
-                    
-                    ciudades_data[ciudad] = {
-                        'temp_max': temp_max,
-                        'temp_min': temp_min,
-                        'hum_max': hum_max,
-                        'hum_min': hum_min
-                    }
+                if all(clave in extremos for clave in ('temp_max', 'temp_min', 'hum_max', 'hum_min')):
+                    ciudades_data[ciudad] = extremos
             
             if ciudades_data:
                 ciudades_data['fuente'] = 'mongodb'
@@ -6402,17 +6459,16 @@ Datos históricos: {len(mediciones)} mediciones
                     ubicaciones_zona = [u for u in ubicaciones if ciudad.lower() in u.lower()]
                     
                     for ubicacion in ubicaciones_zona:
-                        # Obtener datos de temperatura y humedad
-                        datos_temp = self.mongodb_service.obtener_datos_temperatura_por_ubicacion(ubicacion, None, None)
-                        datos_hum = self.mongodb_service.obtener_datos_humedad_por_ubicacion(ubicacion, None, None)
+                        # Máximos y mínimos calculados en el servidor (sin descargar mediciones)
+                        extremos = self.mongodb_service.obtener_extremos_por_ubicacion(ubicacion)
                         
-                        if datos_temp:
-                            temp_max_values.extend([d['temp_max'] for d in datos_temp])
-                            temp_min_values.extend([d['temp_min'] for d in datos_temp])
+                        if 'temp_max' in extremos and 'temp_min' in extremos:
+                            temp_max_values.append(extremos['temp_max'])
+                            temp_min_values.append(extremos['temp_min'])
                         
-                        if datos_hum:
-                            hum_max_values.extend([d['humedad'] for d in datos_hum])
-                            hum_min_values.extend([d['humedad'] for d in datos_hum])
+                        if 'hum_max' in extremos and 'hum_min' in extremos:
+                            hum_max_values.append(extremos['hum_max'])
+                            hum_min_values.append(extremos['hum_min'])
                 
                 if temp_max_values and temp_min_values and hum_max_values and hum_min_values:
                     zonas_data[zona] = {
@@ -6476,17 +6532,16 @@ Datos históricos: {len(mediciones)} mediciones
                     ubicaciones_pais = [u for u in ubicaciones if ciudad.lower() in u.lower()]
                     
                     for ubicacion in ubicaciones_pais:
-                        # Obtener datos de temperatura y humedad
-                        datos_temp = self.mongodb_service.obtener_datos_temperatura_por_ubicacion(ubicacion, None, None)
-                        datos_hum = self.mongodb_service.obtener_datos_humedad_por_ubicacion(ubicacion, None, None)
+                        # Máximos y mínimos calculados en el servidor (sin descargar mediciones)
+                        extremos = self.mongodb_service.obtener_extremos_por_ubicacion(ubicacion)
                         
-                        if datos_temp:
-                            temp_max_values.extend([d['temp_max'] for d in datos_temp])
-                            temp_min_values.extend([d['temp_min'] for d in datos_temp])
+                        if 'temp_max' in extremos and 'temp_min' in extremos:
+                            temp_max_values.append(extremos['temp_max'])
+                            temp_min_values.append(extremos['temp_min'])
                         
-                        if datos_hum:
-                            hum_max_values.extend([d['humedad'] for d in datos_hum])
-                            hum_min_values.extend([d['humedad'] for d in datos_hum])
+                        if 'hum_max' in extremos and 'hum_min' in extremos:
+                            hum_max_values.append(extremos['hum_max'])
+                            hum_min_values.append(extremos['hum_min'])
                 
                 if temp_max_values and temp_min_values and hum_max_values and hum_min_values:
                     paises_data[pais] = {
@@ -6523,7 +6578,7 @@ Datos históricos: {len(mediciones)} mediciones
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return
             
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["username"])
             usuario_nombres = [u.get('username', '') for u in usuarios if u.get('username')]
             
             # Solo cargar usuarios en combos si existen (técnicos y administradores)
@@ -6668,6 +6723,9 @@ Datos históricos: {len(mediciones)} mediciones
                 # Cargar alertas y facturas después del login
                 self.cargar_datos_despues_login()
                 
+                # Procesos en segundo plano recién con una sesión iniciada
+                self.configurar_procesos_segundo_plano()
+                
                 # self.agregar_log(f"✅ Usuario {usuario} autenticado como {rol} desde MongoDB")
                 
                 # Cerrar la ventana de login
@@ -6711,6 +6769,9 @@ Datos históricos: {len(mediciones)} mediciones
             if self.usuario_autenticado and self.tiempo_inicio_sesion:
                 self.procesar_facturacion_sesion()
             
+            # Los trabajos locales en cola se cancelan: no deben correr en la sesión de otro usuario
+            self.detener_procesos_segundo_plano()
+            
             if self.usuario_autenticado and self.redis_service:
                 # Eliminar sesión de Redis
                 self.redis_service.delete(f"session:{self.usuario_autenticado}")
@@ -7041,13 +7102,13 @@ Datos históricos: {len(mediciones)} mediciones
             
             # Verificar que cada etiqueta existe antes de configurarla
             if "Sensores Activos" in self.etiquetas_estadisticas:
-                self.etiquetas_estadisticas["Sensores Activos"].config(text=str(stats.get('sensores', 0)))
+                self.etiquetas_estadisticas["Sensores Activos"].config(text=str(stats.get('sensores_activos', 0)))
             if "Mediciones Hoy" in self.etiquetas_estadisticas:
-                self.etiquetas_estadisticas["Mediciones Hoy"].config(text=str(stats.get('mediciones', 0)))
+                self.etiquetas_estadisticas["Mediciones Hoy"].config(text=str(stats.get('mediciones_hoy', 0)))
             if "Alertas Activas" in self.etiquetas_estadisticas:
-                self.etiquetas_estadisticas["Alertas Activas"].config(text=str(stats.get('alertas', 0)))
+                self.etiquetas_estadisticas["Alertas Activas"].config(text=str(stats.get('alertas_activas', 0)))
             if "Procesos en Cola" in self.etiquetas_estadisticas:
-                self.etiquetas_estadisticas["Procesos en Cola"].config(text=str(stats.get('procesos', 0)))
+                self.etiquetas_estadisticas["Procesos en Cola"].config(text=str(stats.get('procesos_en_cola', 0)))
             
             self.agregar_log("✅ Estadísticas del dashboard actualizadas")
             
@@ -7087,7 +7148,7 @@ Datos históricos: {len(mediciones)} mediciones
             if zona and zona.lower() != "n/a":
                 ubicacion_datos["zone"] = zona
             
-            sensores_existentes = list(self.mongodb_service.obtener_sensores() or [])
+            sensores_existentes = list(self.mongodb_service.obtener_sensores(campos=["sensor_id", "location", "type"]) or [])
             ids_existentes = {
                 sensor.get('sensor_id') for sensor in sensores_existentes if sensor.get('sensor_id')
             }
@@ -7178,7 +7239,7 @@ Datos históricos: {len(mediciones)} mediciones
                 self.tree_sensores.delete(item)
             
             # PASO 2: Obtener sensores desde MongoDB
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["sensor_id", "name", "location", "type", "status"])
             
             if not sensores:
                 return
@@ -7280,20 +7341,11 @@ Datos históricos: {len(mediciones)} mediciones
             datos_generados = self.crear_datos_prueba_sensor(sensor_id, sensor_tipo)
             
             if self.mongodb_service and self.mongodb_service.conectado:
-                mediciones_creadas = 0
-                mediciones_fallidas = 0
-                
                 self.agregar_log(f"📊 Generando {len(datos_generados)} mediciones para sensor '{sensor_nombre}'")
                 
-                for i, dato in enumerate(datos_generados):
-                    self.agregar_log(f"📊 Procesando medición {i+1}/{len(datos_generados)}: {dato.get('measurement_id', 'Sin ID')}")
-                    
-                    if self.mongodb_service.crear_medicion(dato):
-                        mediciones_creadas += 1
-                        self.agregar_log(f"✅ Medición {i+1} creada exitosamente")
-                    else:
-                        mediciones_fallidas += 1
-                        self.agregar_log(f"❌ Medición {i+1} falló")
+                resumen = self.mongodb_service.insertar_mediciones_lote(datos_generados)
+                mediciones_creadas = resumen["aceptadas"]
+                mediciones_fallidas = resumen["rechazadas"]
                 
                 self.agregar_log(f"📊 Resultado: {mediciones_creadas} exitosas, {mediciones_fallidas} fallidas")
                 
@@ -7539,7 +7591,7 @@ Datos históricos: {len(mediciones)} mediciones
         """Generar datos de prueba desde la ventana de información"""
         try:
             # Obtener tipo del sensor desde la base de datos
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["sensor_id", "type"])
             sensor_info = next((s for s in sensores if s.get('sensor_id') == sensor_id), None)
             
             if not sensor_info:
@@ -7552,20 +7604,11 @@ Datos históricos: {len(mediciones)} mediciones
             datos_generados = self.crear_datos_prueba_sensor(sensor_id, sensor_tipo)
             
             if self.mongodb_service and self.mongodb_service.conectado:
-                mediciones_creadas = 0
-                mediciones_fallidas = 0
-                
                 self.agregar_log(f"📊 Generando {len(datos_generados)} mediciones para sensor '{sensor_nombre}'")
                 
-                for i, dato in enumerate(datos_generados):
-                    self.agregar_log(f"📊 Procesando medición {i+1}/{len(datos_generados)}: {dato.get('measurement_id', 'Sin ID')}")
-                    
-                    if self.mongodb_service.crear_medicion(dato):
-                        mediciones_creadas += 1
-                        self.agregar_log(f"✅ Medición {i+1} creada exitosamente")
-                    else:
-                        mediciones_fallidas += 1
-                        self.agregar_log(f"❌ Medición {i+1} falló")
+                resumen = self.mongodb_service.insertar_mediciones_lote(datos_generados)
+                mediciones_creadas = resumen["aceptadas"]
+                mediciones_fallidas = resumen["rechazadas"]
                 
                 self.agregar_log(f"📊 Resultado: {mediciones_creadas} exitosas, {mediciones_fallidas} fallidas")
                 
@@ -8060,28 +8103,36 @@ Datos históricos: {len(mediciones)} mediciones
                 messagebox.showerror("Error", "Formato de fecha inválido. Use YYYY-MM-DD")
                 return
             
-            # Obtener datos de temperatura
-            datos_temperatura = self.obtener_datos_temperatura_ciudad(ciudad, fecha_inicio, fecha_fin)
+            if not self.mongodb_service or not self.mongodb_service.conectado:
+                messagebox.showerror("Error", "MongoDB no disponible para consultar datos de temperatura")
+                return
             
-            if not datos_temperatura:
+            # Primer recorrido en streaming: media y desviación estándar (muestral) sin guardar mediciones
+            # (las fechas van como 'YYYY-MM-DD' para que el día final se incluya completo)
+            cantidad = 0
+            sumas = {"temp_max": 0.0, "temp_min": 0.0}
+            cuadrados = {"temp_max": 0.0, "temp_min": 0.0}
+            for dato in self.mongodb_service.iterar_datos_por_ubicacion(ciudad, fecha_desde, fecha_hasta, "temperatura"):
+                cantidad += 1
+                for campo in sumas:
+                    sumas[campo] += dato[campo]
+                    cuadrados[campo] += dato[campo] ** 2
+            
+            if not cantidad:
                 messagebox.showerror("Error", f"No se encontraron datos de temperatura para {ciudad} en el período especificado.")
                 return
             
-            # Calcular umbrales para detectar anomalías
-            temperaturas_max = [d["temp_max"] for d in datos_temperatura]
-            temperaturas_min = [d["temp_min"] for d in datos_temperatura]
+            import math
+            media_max = sumas["temp_max"] / cantidad
+            media_min = sumas["temp_min"] / cantidad
             
-            # Calcular media y desviación estándar
-            import statistics
-            media_max = statistics.mean(temperaturas_max)
-            media_min = statistics.mean(temperaturas_min)
+            def desviacion(campo, media):
+                if cantidad < 2:
+                    return 0
+                return math.sqrt(max(0.0, (cuadrados[campo] - cantidad * media ** 2) / (cantidad - 1)))
             
-            try:
-                desv_max = statistics.stdev(temperaturas_max)
-                desv_min = statistics.stdev(temperaturas_min)
-            except statistics.StatisticsError:
-                desv_max = 0
-                desv_min = 0
+            desv_max = desviacion("temp_max", media_max)
+            desv_min = desviacion("temp_min", media_min)
             
             # Umbrales (2 desviaciones estándar)
             umbral_max_alto = media_max + (2 * desv_max)
@@ -8092,7 +8143,8 @@ Datos históricos: {len(mediciones)} mediciones
             # Detectar anomalías
             anomalias = []
             
-            for dato in datos_temperatura:
+            # Segundo recorrido en streaming: marcar las mediciones fuera de los umbrales
+            for dato in self.mongodb_service.iterar_datos_por_ubicacion(ciudad, fecha_desde, fecha_hasta, "temperatura"):
                 anomalias_dia = []
                 
                 if dato['temp_max'] > umbral_max_alto:
@@ -8500,7 +8552,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             # Obtener sensores desde MongoDB
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["name", "location"])
             
             # Crear lista de nombres de sensores formateados
             nombres_sensores = []
@@ -8825,20 +8877,11 @@ Datos históricos: {len(mediciones)} mediciones
     def actualizar_lista_alertas(self):
         """Actualizar lista de alertas con formato de log mejorado"""
         try:
-            if not self.mongodb_service or not self.mongodb_service.conectado:
+            if not hasattr(self, 'tree_alertas'):
                 return
             
-            # Limpiar lista
-            for item in self.tree_alertas.get_children():
-                self.tree_alertas.delete(item)
-            
-            # Obtener alertas desde MongoDB Atlas
-            alertas = self.mongodb_service.obtener_alertas()
-            
-            # Mostrar todas las alertas sin filtros
-            self.mostrar_alertas_en_treeview(alertas)
-            
-            # self.agregar_log(f"✅ {len(alertas)} alertas cargadas desde MongoDB Atlas")
+            # Recargar la página actual con los filtros seleccionados
+            self.cargar_pagina_alertas()
             
         except Exception as e:
             self.agregar_log(f"❌ Error actualizando alertas: {e}")
@@ -9095,7 +9138,7 @@ Datos históricos: {len(mediciones)} mediciones
                 self.tree_facturas.delete(item)
             
             # Obtener facturas desde MongoDB Atlas
-            facturas = self.mongodb_service.obtener_facturas()
+            facturas = self.mongodb_service.obtener_facturas(campos=self.CAMPOS_LISTA_FACTURAS)
             
             # Filtrar facturas según el rol del usuario
             facturas_filtradas = []
@@ -9335,7 +9378,7 @@ Datos históricos: {len(mediciones)} mediciones
             texto_resumen.pack(fill='both', expand=True)
             
             # Obtener datos financieros según permisos de rol
-            facturas = self.mongodb_service.obtener_facturas()
+            facturas = self.mongodb_service.obtener_facturas(campos=["user_id", "status", "amount"])
             pagos = self.mongodb_service.obtener_pagos()
             cuentas = self.mongodb_service.obtener_cuentas_corrientes()
             
@@ -9765,7 +9808,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             # Obtener usuarios desde MongoDB
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["username", "status"])
             # self.agregar_log(f"📊 Usuarios encontrados en MongoDB: {len(usuarios)}")
             
             # Filtrar usuarios activos y excluir el usuario actual
@@ -10143,7 +10186,7 @@ Datos históricos: {len(mediciones)} mediciones
                     self.agregar_log(f"❌ Error cargando usuarios desde Neo4j: {e}")
                     # Fallback a MongoDB si Neo4j falla
                     if self.mongodb_service and self.mongodb_service.conectado:
-                        usuarios = self.mongodb_service.obtener_usuarios()
+                        usuarios = self.mongodb_service.obtener_usuarios(campos=["username"])
                         nombres_usuarios = []
                         for usuario in usuarios:
                             username = usuario.get('username', '')
@@ -10246,7 +10289,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             # Obtener usuarios desde MongoDB
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["username", "status"])
             # self.agregar_log(f"📊 Usuarios encontrados para facturación: {len(usuarios)}")
             
             # Filtrar usuarios según el rol del usuario actual
@@ -10303,7 +10346,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             # Obtener sensores desde MongoDB
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["name", "location"])
             
             # Crear lista de nombres de sensores
             nombres_sensores = []
@@ -10487,7 +10530,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             # Obtener todos los sensores para extraer países únicos
-            sensores = self.mongodb_service.obtener_sensores()
+            sensores = self.mongodb_service.obtener_sensores(campos=["location"])
             
             paises = set()
             
@@ -10886,14 +10929,18 @@ Datos históricos: {len(mediciones)} mediciones
             # Limpiar área de informe
             self.texto_informe.delete("1.0", tk.END)
             
-            # Obtener datos por ubicación desde el servicio MongoDB
-            datos_temperatura = self.mongodb_service.obtener_datos_temperatura_por_ubicacion(
-                ubicacion=pais_ciudad,
-                fecha_inicio=fecha_inicio,
-                fecha_fin=fecha_fin
-            )
+            # Primer recorrido en streaming: estadísticas sin guardar las mediciones
+            cantidad, suma, temp_min, temp_max = 0, 0.0, None, None
+            for d in self.mongodb_service.iterar_datos_por_ubicacion(pais_ciudad, fecha_inicio, fecha_fin, "temperatura"):
+                temp = d.get('temperatura')
+                if temp is None:
+                    continue
+                cantidad += 1
+                suma += temp
+                temp_min = temp if temp_min is None else min(temp_min, temp)
+                temp_max = temp if temp_max is None else max(temp_max, temp)
             
-            if not datos_temperatura:
+            if not cantidad:
                 self.texto_informe.insert(tk.END, "❌ No se encontraron datos para el período seleccionado\n")
                 return
             
@@ -10905,32 +10952,22 @@ Datos históricos: {len(mediciones)} mediciones
             self.texto_informe.insert(tk.END, "=" * 60 + "\n\n")
             
             # Estadísticas básicas
-            temperaturas = [d.get('temperatura') for d in datos_temperatura if d.get('temperatura') is not None]
-            
-            if temperaturas:
-                temp_min = min(temperaturas)
-                temp_max = max(temperaturas)
-                temp_promedio = sum(temperaturas) / len(temperaturas)
+            if cantidad:
+                temp_promedio = suma / cantidad
                 
                 self.texto_informe.insert(tk.END, f"📊 ESTADÍSTICAS DE TEMPERATURA:\n")
                 self.texto_informe.insert(tk.END, f"• Temperatura Mínima: {temp_min:.2f}°C\n")
                 self.texto_informe.insert(tk.END, f"• Temperatura Máxima: {temp_max:.2f}°C\n")
                 self.texto_informe.insert(tk.END, f"• Temperatura Promedio: {temp_promedio:.2f}°C\n")
-                self.texto_informe.insert(tk.END, f"• Total de Mediciones: {len(temperaturas)}\n\n")
+                self.texto_informe.insert(tk.END, f"• Total de Mediciones: {cantidad}\n\n")
                 
-                # Preparar datos para reutilizar funciones de agrupación
+                # Segundo recorrido en streaming para reutilizar las funciones de agrupación
                 from datetime import datetime as _dt
-                mediciones_normalizadas = []
-                for d in datos_temperatura:
-                    fecha_str = d.get('fecha')
-                    temp = d.get('temperatura')
-                    if not fecha_str or temp is None:
-                        continue
-                    try:
-                        ts = _dt.strptime(fecha_str, "%Y-%m-%d")
-                        mediciones_normalizadas.append({"timestamp": ts, "temperature": temp})
-                    except Exception:
-                        continue
+                mediciones_normalizadas = (
+                    {"timestamp": _dt.strptime(d['fecha'], "%Y-%m-%d"), "temperature": d['temperatura']}
+                    for d in self.mongodb_service.iterar_datos_por_ubicacion(pais_ciudad, fecha_inicio, fecha_fin, "temperatura")
+                    if d.get('fecha') and d.get('temperatura') is not None
+                )
                 
                 # Análisis por agrupación temporal
                 self.texto_informe.insert(tk.END, f"📅 ANÁLISIS TEMPORAL ({agrupacion}):\n")
@@ -11275,7 +11312,7 @@ Datos históricos: {len(mediciones)} mediciones
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return None
             
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["user_id", "username"])
             for usuario in usuarios:
                 if usuario.get('username') == username:
                     return usuario.get('user_id')
@@ -11300,7 +11337,7 @@ Datos históricos: {len(mediciones)} mediciones
                 return user_id
             
             # Buscar el usuario por user_id
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["user_id", "username"])
             for usuario in usuarios:
                 # Comparar user_id
                 if usuario.get('user_id') == user_id:
@@ -11685,13 +11722,14 @@ Datos históricos: {len(mediciones)} mediciones
             self.agregar_log(f"❌ Error asignando proceso específico: {e}")
             return False
     
-    def ejecutar_proceso_periodico(self, proceso_id, proceso_data):
-        """Ejecutar proceso periódico con agrupación temporal"""
+    def ejecutar_proceso_periodico(self, proceso_id, proceso_data, control=None):
+        """Ejecutar proceso periódico con agrupación temporal (`control` permite cancelarlo entre lotes)"""
         try:
             self.agregar_log(f"🔄 Iniciando ejecución del proceso: {proceso_data.get('nombre', 'N/A')}")
             
-            # Actualizar estado a "running"
-            self.mongodb_service.actualizar_estado_proceso(proceso_id, "running", progress=10)
+            # Progreso con escrituras coalescidas (los estados finales se escriben en el momento)
+            progreso = control.progreso if control else self.mongodb_service.crear_reportador_progreso(proceso_id)
+            progreso.reportar(10)
             
             # Extraer parámetros del proceso
             tipo_proceso = proceso_data.get('tipo', '')
@@ -11704,7 +11742,7 @@ Datos históricos: {len(mediciones)} mediciones
             self.agregar_log(f"📊 Parámetros: Ubicación={ubicacion}, Período={fecha_inicio} a {fecha_fin}, Agrupación={agrupacion}")
             
             # Actualizar progreso
-            self.mongodb_service.actualizar_estado_proceso(proceso_id, "running", progress=30)
+            progreso.reportar(30)
             
             # Obtener sensores por ubicación
             if "Ciudades" in tipo_proceso:
@@ -11720,113 +11758,224 @@ Datos históricos: {len(mediciones)} mediciones
             
             if not sensores:
                 error_msg = f"No se encontraron sensores para la ubicación: {ubicacion}"
-                self.mongodb_service.actualizar_estado_proceso(proceso_id, "failed", error=error_msg)
+                progreso.reportar(status="failed", error=error_msg)
                 self.agregar_log(f"❌ {error_msg}")
                 return
             
             self.agregar_log(f"📡 Encontrados {len(sensores)} sensores")
             
             # Actualizar progreso
-            self.mongodb_service.actualizar_estado_proceso(proceso_id, "running", progress=50)
-            
-            # Obtener mediciones para todos los sensores
-            todas_mediciones = []
-            for sensor in sensores:
-                sensor_id = sensor.get('sensor_id', '')
-                mediciones = self.mongodb_service.obtener_mediciones_sensor_por_fechas(
-                    sensor_id, fecha_inicio, fecha_fin
+            progreso.reportar(50)
+            
+            # Leer los buckets diarios pre-agregados de los sensores con rollups reconstruidos;
+            # el resto (o todos, si los rollups no devuelven nada) se recorre en crudo por lotes
+            sensor_ids = [sensor.get('sensor_id', '') for sensor in sensores]
+            cubiertos = self.mongodb_service.sensores_con_rollups(sensor_ids)
+            con_rollups = [s for s in sensor_ids if s in cubiertos]
+            acumulado = self.acumular_rollups_por_periodo(con_rollups, fecha_inicio, fecha_fin, agrupacion)
+            sin_rollups = [s for s in sensor_ids if s not in con_rollups] if acumulado["total"] else sensor_ids
+            
+            if sin_rollups:
+                lotes = (
+                    lote
+                    for sensor_id in sin_rollups
+                    for lote in self.mongodb_service.iterar_mediciones_sensor_por_fechas(
+                        sensor_id, fecha_inicio, fecha_fin,
+                        campos=["sensor_id", "timestamp", "temperature", "humidity"]
+                    )
                 )
-                todas_mediciones.extend(mediciones)
+                crudo = self.acumular_mediciones_por_periodo(control.lotes(lotes) if control else lotes, agrupacion)
+                acumulado = self.combinar_acumulados(acumulado, crudo) if acumulado["total"] else crudo
             
-            if not todas_mediciones:
+            # Cancelado entre lotes: el ejecutor marca el proceso como cancelled
+            if control and control.cancelado():
+                self.agregar_log(f"⛔ Proceso cancelado: {proceso_data.get('nombre', 'N/A')}")
+                return
+            
+            if not acumulado["total"]:
                 error_msg = f"No se encontraron mediciones para el período {fecha_inicio} a {fecha_fin}"
-                self.mongodb_service.actualizar_estado_proceso(proceso_id, "failed", error=error_msg)
+                progreso.reportar(status="failed", error=error_msg)
                 self.agregar_log(f"❌ {error_msg}")
                 return
             
-            self.agregar_log(f"📈 Procesando {len(todas_mediciones)} mediciones")
+            self.agregar_log(f"📈 Procesadas {acumulado['total']} mediciones")
             
             # Actualizar progreso
-            self.mongodb_service.actualizar_estado_proceso(proceso_id, "running", progress=70)
+            progreso.reportar(70)
             
             # Generar reporte según el tipo de proceso
             resultado = self.generar_reporte_periodico(
-                tipo_proceso, ubicacion, todas_mediciones, agrupacion, parametros
+                tipo_proceso, ubicacion, acumulado, agrupacion, parametros
             )
             
             # Actualizar progreso
-            self.mongodb_service.actualizar_estado_proceso(proceso_id, "running", progress=90)
+            progreso.reportar(90)
             
             # Guardar resultado y completar proceso
-            self.mongodb_service.actualizar_estado_proceso(
-                proceso_id, "completed", progress=100, 
-                result={"reporte": resultado, "mediciones_procesadas": len(todas_mediciones)}
+            progreso.reportar(
+                100, "completed",
+                result={"reporte": resultado, "mediciones_procesadas": acumulado["total"]}
             )
             
             self.agregar_log(f"✅ Proceso completado: {proceso_data.get('nombre', 'N/A')}")
             
-            # Mostrar resultado en ventana
-            self.mostrar_resultado_proceso(resultado, proceso_data.get('nombre', 'Proceso'))
+            # Mostrar resultado en ventana solo en ejecuciones manuales (las corridas programadas
+            # quedan en el historial); la ventana se crea en el hilo de Tk
+            if "corrida" not in proceso_data:
+                nombre = proceso_data.get('nombre', 'Proceso')
+                self.root.after(0, lambda: self.mostrar_resultado_proceso(resultado, nombre))
             
         except Exception as e:
             error_msg = f"Error ejecutando proceso: {e}"
             self.mongodb_service.actualizar_estado_proceso(proceso_id, "failed", error=error_msg)
             self.agregar_log(f"❌ {error_msg}")
     
-    def generar_reporte_periodico(self, tipo_proceso, ubicacion, mediciones, agrupacion, parametros):
-        """Generar reporte periódico con agrupación temporal"""
+    def acumular_mediciones_por_periodo(self, lotes, agrupacion):
+        """Acumular count/suma/min/max por período recorriendo lotes de mediciones una sola vez"""
+        formatos = {"diaria": "%Y-%m-%d", "semanal": "%Y-W%U", "mensual": "%Y-%m", "anual": "%Y"}
+        formato = formatos.get(agrupacion)
+        
+        acumulado = {"total": 0, "sensores": set(), "desde": None, "hasta": None, "grupos": {}}
+        
+        for lote in lotes:
+            for medicion in lote:
+                timestamp = medicion.get('timestamp')
+                if isinstance(timestamp, str):
+                    try:
+                        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                    except ValueError:
+                        continue
+                if not isinstance(timestamp, datetime):
+                    continue
+                
+                acumulado["total"] += 1
+                acumulado["sensores"].add(medicion.get('sensor_id', ''))
+                if acumulado["desde"] is None or timestamp < acumulado["desde"]:
+                    acumulado["desde"] = timestamp
+                if acumulado["hasta"] is None or timestamp > acumulado["hasta"]:
+                    acumulado["hasta"] = timestamp
+                
+                periodo = timestamp.strftime(formato) if formato else "Sin agrupación"
+                grupo = acumulado["grupos"].setdefault(periodo, {"count": 0})
+                grupo["count"] += 1
+                
+                for campo in ("temperature", "humidity"):
+                    valor = medicion.get(campo)
+                    if valor is None:
+                        continue
+                    stats = grupo.setdefault(campo, {"count": 0, "sum": 0.0, "min": valor, "max": valor})
+                    stats["count"] += 1
+                    stats["sum"] += valor
+                    stats["min"] = min(stats["min"], valor)
+                    stats["max"] = max(stats["max"], valor)
+        
+        return acumulado
+    
+    def acumular_rollups_por_periodo(self, sensor_ids, fecha_inicio, fecha_fin, agrupacion):
+        """Construir el mismo acumulado que acumular_mediciones_por_periodo a partir de rollups diarios"""
+        formatos = {"diaria": "%Y-%m-%d", "semanal": "%Y-W%U", "mensual": "%Y-%m", "anual": "%Y"}
+        formato = formatos.get(agrupacion)
+        
+        acumulado = {"total": 0, "sensores": set(), "desde": None, "hasta": None, "grupos": {}}
+        
+        # Un fecha_fin 'YYYY-MM-DD' incluye el día completo, igual que el recorrido crudo
+        buckets = self.mongodb_service.obtener_rollups(
+            sensor_ids, "dia", fecha_inicio or None, fecha_fin or None
+        )
+        
+        # Mediciones por día: cada medición aporta a uno o ambos parámetros
+        mediciones_por_dia = {}
+        for bucket in buckets:
+            dia = bucket["bucket"]
+            mediciones_por_dia[dia] = max(mediciones_por_dia.get(dia, 0), bucket["count"])
+            acumulado["sensores"].update(bucket.get("sensores", []))
+            
+            periodo = dia.strftime(formato) if formato else "Sin agrupación"
+            grupo = acumulado["grupos"].setdefault(periodo, {"count": 0})
+            stats = grupo.setdefault(bucket["parametro"], {"count": 0, "sum": 0.0, "min": bucket["min"], "max": bucket["max"]})
+            stats["count"] += bucket["count"]
+            stats["sum"] += bucket["sum"]
+            stats["min"] = min(stats["min"], bucket["min"])
+            stats["max"] = max(stats["max"], bucket["max"])
+        
+        for dia, cantidad in mediciones_por_dia.items():
+            periodo = dia.strftime(formato) if formato else "Sin agrupación"
+            acumulado["grupos"][periodo]["count"] += cantidad
+            acumulado["total"] += cantidad
+        
+        if mediciones_por_dia:
+            acumulado["desde"] = min(mediciones_por_dia)
+            acumulado["hasta"] = max(mediciones_por_dia)
+        
+        return acumulado
+    
+    def combinar_acumulados(self, acumulado, otro):
+        """Sumar dos acumulados por período (rollups y recorrido crudo de sensores distintos)"""
+        acumulado["total"] += otro["total"]
+        acumulado["sensores"] |= otro["sensores"]
+        for extremo, elegir in (("desde", min), ("hasta", max)):
+            valores = [v for v in (acumulado[extremo], otro[extremo]) if v is not None]
+            acumulado[extremo] = elegir(valores) if valores else None
+        
+        for periodo, grupo_otro in otro["grupos"].items():
+            grupo = acumulado["grupos"].setdefault(periodo, {"count": 0})
+            grupo["count"] += grupo_otro["count"]
+            for campo in ("temperature", "humidity"):
+                stats_otro = grupo_otro.get(campo)
+                if not stats_otro:
+                    continue
+                stats = grupo.setdefault(campo, {"count": 0, "sum": 0.0, "min": stats_otro["min"], "max": stats_otro["max"]})
+                stats["count"] += stats_otro["count"]
+                stats["sum"] += stats_otro["sum"]
+                stats["min"] = min(stats["min"], stats_otro["min"])
+                stats["max"] = max(stats["max"], stats_otro["max"])
+        
+        return acumulado
+    
+    def generar_reporte_periodico(self, tipo_proceso, ubicacion, acumulado, agrupacion, parametros):
+        """Generar reporte periódico a partir de las estadísticas acumuladas por período"""
         try:
+            desde = acumulado["desde"].isoformat() if acumulado["desde"] else ''
+            hasta = acumulado["hasta"].isoformat() if acumulado["hasta"] else ''
             resultado = f"""📊 REPORTE PERIÓDICO DE SENSORES
 📍 Ubicación: {ubicacion}
-📅 Período: {len(mediciones)} mediciones
+📅 Período: {acumulado['total']} mediciones
 🔄 Agrupación: {agrupacion.title()}
 📈 Parámetros: {parametros.replace('_', ' y ').title()}
 {'='*60}
 
 📋 RESUMEN GENERAL:
-• Total de mediciones: {len(mediciones)}
-• Sensores involucrados: {len(set(m.get('sensor_id', '') for m in mediciones))}
-• Período de datos: {min(m.get('timestamp', '') for m in mediciones if m.get('timestamp'))} - {max(m.get('timestamp', '') for m in mediciones if m.get('timestamp'))}
+• Total de mediciones: {acumulado['total']}
+• Sensores involucrados: {len(acumulado['sensores'])}
+• Período de datos: {desde} - {hasta}
 
 """
-
-            # Agrupar mediciones según el tipo seleccionado
-            if agrupacion == "diaria":
-                grupos = self.agrupar_mediciones_diarias(mediciones, 'timestamp')
-            elif agrupacion == "semanal":
-                grupos = self.agrupar_mediciones_semanales(mediciones, 'timestamp')
-            elif agrupacion == "mensual":
-                grupos = self.agrupar_mediciones_mensuales(mediciones, 'timestamp')
-            elif agrupacion == "anual":
-                grupos = self.agrupar_mediciones_anuales(mediciones, 'timestamp')
-            else:
-                grupos = {"Sin agrupación": mediciones}
+            grupos = acumulado["grupos"]
             
             # Generar análisis por grupos
             resultado += f"📅 ANÁLISIS POR {agrupacion.upper()}:\n"
             
-            for periodo, mediciones_grupo in grupos.items():
-                if not mediciones_grupo:
+            for periodo in sorted(grupos.keys()):
+                grupo = grupos[periodo]
+                if not grupo["count"]:
                     continue
                     
                 resultado += f"\n📆 {periodo}:\n"
-                resultado += f"  • Mediciones: {len(mediciones_grupo)}\n"
+                resultado += f"  • Mediciones: {grupo['count']}\n"
                 
                 # Análisis de temperatura si corresponde
-                if "temperatura" in parametros.lower():
-                    temperaturas = [m.get('temperature', 0) for m in mediciones_grupo if m.get('temperature') is not None]
-                    if temperaturas:
-                        resultado += f"  • Temperatura promedio: {sum(temperaturas)/len(temperaturas):.2f}°C\n"
-                        resultado += f"  • Temperatura mínima: {min(temperaturas):.2f}°C\n"
-                        resultado += f"  • Temperatura máxima: {max(temperaturas):.2f}°C\n"
+                temperatura = grupo.get("temperature")
+                if "temperatura" in parametros.lower() and temperatura:
+                    resultado += f"  • Temperatura promedio: {temperatura['sum']/temperatura['count']:.2f}°C\n"
+                    resultado += f"  • Temperatura mínima: {temperatura['min']:.2f}°C\n"
+                    resultado += f"  • Temperatura máxima: {temperatura['max']:.2f}°C\n"
                 
                 # Análisis de humedad si corresponde
-                if "humedad" in parametros.lower():
-                    humedades = [m.get('humidity', 0) for m in mediciones_grupo if m.get('humidity') is not None]
-                    if humedades:
-                        resultado += f"  • Humedad promedio: {sum(humedades)/len(humedades):.2f}%\n"
-                        resultado += f"  • Humedad mínima: {min(humedades):.2f}%\n"
-                        resultado += f"  • Humedad máxima: {max(humedades):.2f}%\n"
+                humedad = grupo.get("humidity")
+                if "humedad" in parametros.lower() and humedad:
+                    resultado += f"  • Humedad promedio: {humedad['sum']/humedad['count']:.2f}%\n"
+                    resultado += f"  • Humedad mínima: {humedad['min']:.2f}%\n"
+                    resultado += f"  • Humedad máxima: {humedad['max']:.2f}%\n"
             
             # Resumen final
             resultado += f"\n📊 RESUMEN FINAL:\n"
@@ -11916,12 +12065,17 @@ Datos históricos: {len(mediciones)} mediciones
                 return
             
             item = self.tree_procesos.item(seleccion[0])
-            proceso_id = item['values'][0]
+            proceso_id = str(item['values'][0])
             nombre_proceso = item['values'][1]
             tipo_proceso = item['values'][2]
-            estado = item['values'][4]
             
-            if estado == "completado":
+            # Obtener datos del proceso desde MongoDB
+            proceso_data = self.mongodb_service.obtener_proceso_por_id(proceso_id)
+            if not proceso_data:
+                messagebox.showerror("Error", "No se encontró el proceso en la base de datos")
+                return
+            
+            if proceso_data.get('status') == "completed":
                 messagebox.showinfo("Información", "Este proceso ya está completado")
                 return
             
@@ -11930,25 +12084,15 @@ Datos históricos: {len(mediciones)} mediciones
             if not respuesta:
                 return
             
-            # Obtener datos del proceso desde MongoDB
-            proceso_data = self.mongodb_service.obtener_proceso_por_id(proceso_id)
-            if not proceso_data:
-                messagebox.showerror("Error", "No se encontró el proceso en la base de datos")
+            # Encolar en el ejecutor de procesos (pool acotado, cola persistida en MongoDB)
+            if not self.mongodb_service.encolar_proceso(proceso_id, "proceso_periodico", local=True):
+                messagebox.showwarning("Advertencia", f"El proceso '{nombre_proceso}' ya está en cola o en ejecución")
                 return
             
-            # Ejecutar proceso periódico en hilo separado
-            import threading
-            thread = threading.Thread(
-                target=self.ejecutar_proceso_periodico,
-                args=(proceso_id, proceso_data)
-            )
-            thread.daemon = True
-            thread.start()
-            
             # Actualizar lista de procesos
             self.actualizar_lista_procesos()
             
-            messagebox.showinfo("Éxito", f"Proceso '{nombre_proceso}' iniciado en segundo plano")
+            messagebox.showinfo("Éxito", f"Proceso '{nombre_proceso}' encolado para ejecución en segundo plano")
             
         except Exception as e:
             self.agregar_log(f"❌ Error ejecutando proceso: {e}")
@@ -13029,34 +13173,91 @@ Sensor analizado: {sensor_name}
             texto_progreso.insert(tk.END, f"❌ Error procesando facturación: {e}\n")
             return f"Error procesando facturación: {e}"
     
-    def pausar_proceso(self):
-        """Pausar proceso seleccionado"""
+    def cancelar_proceso(self):
+        """Cancelar proceso seleccionado (en cola se descarta; en ejecución se detiene entre lotes)"""
         try:
             # Verificar permisos según el rol
             if self.rol_usuario == "usuario":
-                messagebox.showwarning("Permisos", "Solo técnicos y administradores pueden pausar procesos")
+                messagebox.showwarning("Permisos", "Solo técnicos y administradores pueden cancelar procesos")
                 return
             
             seleccion = self.tree_procesos.selection()
             if not seleccion:
-                messagebox.showwarning("Advertencia", "Seleccione un proceso para pausar")
+                messagebox.showwarning("Advertencia", "Seleccione un proceso para cancelar")
                 return
             
             item = self.tree_procesos.item(seleccion[0])
-            proceso_id = item['values'][0]
+            proceso_id = str(item['values'][0])
             nombre_proceso = item['values'][1]
             
-            if self.mongodb_service and self.mongodb_service.conectado:
-                self.mongodb_service.actualizar_proceso(proceso_id, {"status": "pausado"})
-                self.actualizar_lista_procesos()
-                self.agregar_log(f"⏸️ Proceso '{nombre_proceso}' pausado")
-                messagebox.showinfo("Éxito", f"Proceso '{nombre_proceso}' pausado")
-            else:
+            if not self.mongodb_service or not self.mongodb_service.conectado:
                 messagebox.showerror("Error", "MongoDB no disponible")
-                
-        except Exception as e:
-            self.agregar_log(f"❌ Error pausando proceso: {e}")
-            messagebox.showerror("Error", f"Error pausando proceso: {e}")
+                return
+            
+            resultado = self.mongodb_service.cancelar_proceso(proceso_id)
+            if resultado == "cancelled":
+                mensaje = f"Proceso '{nombre_proceso}' cancelado"
+            elif resultado == "cancelando":
+                mensaje = f"Proceso '{nombre_proceso}' se detendrá al terminar el lote actual"
+            else:
+                messagebox.showinfo("Información", f"El proceso '{nombre_proceso}' no está en cola ni en ejecución")
+                return
+            
+            self.actualizar_lista_procesos()
+            self.agregar_log(f"⛔ {mensaje}")
+            messagebox.showinfo("Éxito", mensaje)
+                
+        except Exception as e:
+            self.agregar_log(f"❌ Error cancelando proceso: {e}")
+            messagebox.showerror("Error", f"Error cancelando proceso: {e}")
+    
+    def iniciar_actualizacion_metricas_procesos(self):
+        """Refrescar cada 5 segundos las métricas del ejecutor y el progreso de los procesos activos"""
+        filas = dict(getattr(self, '_filas_procesos_activos', {}))
+        
+        def consultar():
+            if not self.mongodb_service:
+                return
+            metricas = self.mongodb_service.obtener_metricas_procesos()
+            # Lectura liviana por proceso en lugar de recargar toda la lista
+            progresos = {pid: self.mongodb_service.obtener_progreso_proceso(pid) for pid in filas}
+            self.root.after(0, lambda: self.mostrar_metricas_procesos(metricas))
+            self.root.after(0, lambda: self.mostrar_progreso_procesos(filas, progresos))
+        
+        threading.Thread(target=consultar, daemon=True).start()
+        self.root.after(5000, self.iniciar_actualizacion_metricas_procesos)
+    
+    def mostrar_progreso_procesos(self, filas, progresos):
+        """Actualizar en la lista la columna Estado de los procesos en cola o en ejecución"""
+        for process_id, progreso in progresos.items():
+            fila = filas[process_id]
+            if not progreso or not self.tree_procesos.exists(fila):
+                continue
+            estado = progreso.get("status")
+            texto = self.ESTADOS_PROCESO.get(estado, str(estado).capitalize())
+            if estado in ("queued", "running") and progreso.get("progress") is not None:
+                texto += f" ({progreso['progress']}%)"
+            else:
+                self._filas_procesos_activos.pop(process_id, None)
+            self.tree_procesos.set(fila, "Estado", texto)
+    
+    def mostrar_metricas_procesos(self, metricas):
+        """Mostrar profundidad de cola y tiempos de ejecución del ejecutor"""
+        if not hasattr(self, 'label_metricas_procesos'):
+            return
+        if not metricas:
+            self.label_metricas_procesos.config(text="⚙️ Ejecutor de procesos: sin datos")
+            return
+        
+        def segundos(valor):
+            return f"{valor:.1f}s" if valor is not None else "N/A"
+        
+        self.label_metricas_procesos.config(text=(
+            f"⚙️ Cola: {metricas['en_cola']} | Corriendo: {metricas['corriendo']}/{metricas['trabajadores']} | "
+            f"Espera media: {segundos(metricas['espera_media_s'])} | "
+            f"Duración media: {segundos(metricas['duracion_media_s'])} (máx {segundos(metricas['duracion_max_s'])}) | "
+            f"✅ {metricas['completados']} ❌ {metricas['fallidos']} ⛔ {metricas['cancelados']}"
+        ))
     
     def actualizar_lista_procesos(self):
         """Actualizar lista de procesos según el rol del usuario"""
@@ -13068,6 +13269,7 @@ Sensor analizado: {sensor_name}
             # Limpiar lista actual
             for item in self.tree_procesos.get_children():
                 self.tree_procesos.delete(item)
+            self._filas_procesos_activos = {}
             
             # Obtener filtro de estado seleccionado
             filtro_estado = "Todos"
@@ -13077,9 +13279,11 @@ Sensor analizado: {sensor_name}
             # Mapear emojis a estados reales
             estado_filtro_map = {
                 "⏳ Pendiente": "pending",
+                "🕒 En Cola": "queued",
                 "🔄 En Ejecución": "running",
                 "✅ Completado": "completed",
-                "❌ Fallido": "failed"
+                "❌ Fallido": "failed",
+                "⛔ Cancelado": "cancelled"
             }
             
             estado_filtro = estado_filtro_map.get(filtro_estado, None)
@@ -13091,7 +13295,7 @@ Sensor analizado: {sensor_name}
                 # self.agregar_log(f"📋 Cargando procesos del usuario {self.usuario_autenticado}")
             elif self.rol_usuario in ["técnico", "administrador"]:
                 # Técnicos y administradores: pueden ver todos los procesos
-                procesos = self.mongodb_service.obtener_procesos()
+                procesos = self.mongodb_service.obtener_procesos(campos=self.CAMPOS_LISTA_PROCESOS)
                 # self.agregar_log(f"📋 Cargando todos los procesos (rol: {self.rol_usuario})")
             else:
                     # self.agregar_log("⚠️ Rol de usuario no reconocido")
@@ -13126,6 +13330,12 @@ Sensor analizado: {sensor_name}
                     elif estado == "paused":
                         estado_emoji = "⏸️"
                         estado_texto = "Pausado"
+                    elif estado == "queued":
+                        estado_emoji = "🕒"
+                        estado_texto = "En Cola"
+                    elif estado == "cancelled":
+                        estado_emoji = "⛔"
+                        estado_texto = "Cancelado"
                     else:
                         estado_emoji = "❓"
                         estado_texto = estado.title()
@@ -13157,7 +13367,7 @@ Sensor analizado: {sensor_name}
                     progreso = proceso.get('progress', '0%')
                     
                     # Insertar en la tabla con las nuevas columnas
-                    self.tree_procesos.insert("", "end", values=(
+                    fila = self.tree_procesos.insert("", "end", values=(
                         process_id,
                         nombre,
                         tipo,
@@ -13168,6 +13378,8 @@ Sensor analizado: {sensor_name}
                         usuario_nombre,
                         fecha_formateada
                     ))
+                    if estado in ("queued", "running"):
+                        self._filas_procesos_activos[process_id] = fila
                     procesos_mostrados += 1
                 
                 # self.agregar_log(f"✅ {len(procesos)} procesos cargados, {procesos_mostrados} mostrados (filtro: {filtro_estado})")
@@ -13607,6 +13819,7 @@ Sensor analizado: {sensor_name}
                 return
             
             stats = self.mongodb_service.obtener_estadisticas()
+            opciones = self.mongodb_service.obtener_estado_conexion().get('opciones_cliente', {})
             
             # Información de Redis
             redis_info = ""
@@ -13630,13 +13843,14 @@ Sensor analizado: {sensor_name}
             mensaje = f"""📊 ESTADÍSTICAS DEL SISTEMA
             
 🗂️ MongoDB Atlas:
-   Sensores: {stats.get('sensores', 0)}
+   Sensores: {stats.get('sensores', 0)} ({stats.get('sensores_activos', 0)} activos)
    Usuarios: {stats.get('usuarios', 0)}
-   Alertas: {stats.get('alertas', 0)}
-   Mediciones: {stats.get('mediciones', 0)}
+   Alertas: {stats.get('alertas', 0)} ({stats.get('alertas_activas', 0)} activas)
+   Mediciones: ~{stats.get('mediciones', 0)} ({stats.get('mediciones_hoy', 0)} hoy)
    Facturas: {stats.get('facturas', 0)}
    Pagos: {stats.get('pagos', 0)}
    Procesos: {stats.get('procesos', 0)}
+   Pool: {opciones.get('minPoolSize', 'N/A')}-{opciones.get('maxPoolSize', 'N/A')} conexiones | Compresión: {opciones.get('compressors', 'ninguna')}
 
 🔗 Neo4j Aura: {'✅ Conectado' if self.neo4j_service and self.neo4j_service.conectado else '⚠️ No disponible'}
 
@@ -13650,6 +13864,110 @@ Sensor analizado: {sensor_name}
         except Exception as e:
             messagebox.showerror("Error", f"Error obteniendo estadísticas: {e}")
     
+    def reconstruir_rollups_mediciones(self):
+        """Reconstruir en segundo plano los rollups de mediciones desde los datos históricos"""
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            messagebox.showerror("Error", "MongoDB Atlas no está conectado")
+            return
+        
+        if not messagebox.askyesno("Reconstruir Rollups",
+                                   "Se recalcularán los agregados por hora/día/mes de todas las mediciones.\n¿Continuar?"):
+            return
+        
+        def reconstruir():
+            self.agregar_log("🧮 Reconstruyendo rollups de mediciones...")
+            resumen = self.mongodb_service.reconstruir_rollups()
+            self.agregar_log(f"✅ Rollups reconstruidos: {resumen.get('hora', 0)} horarios, "
+                             f"{resumen.get('dia', 0)} diarios, {resumen.get('mes', 0)} mensuales")
+        
+        threading.Thread(target=reconstruir, daemon=True).start()
+    
+    def migrar_timestamps_mediciones(self):
+        """Convertir en segundo plano los timestamps string de las mediciones a fechas"""
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            messagebox.showerror("Error", "MongoDB Atlas no está conectado")
+            return
+        
+        def migrar():
+            self.agregar_log("🕒 Migrando timestamps de mediciones a fechas...")
+            resumen = self.mongodb_service.migrar_timestamps_mediciones(
+                callback_lote=lambda r: self.agregar_log(
+                    f"   Lote {r['lotes']}: {r['convertidas']} convertidas, {r['invalidas']} inválidas")
+            )
+            if resumen.get("completada"):
+                self.agregar_log(f"✅ Migración completada: {resumen['convertidas']} timestamps convertidos")
+            else:
+                self.agregar_log("⚠️ Migración interrumpida, se retomará desde el último lote al reintentar")
+        
+        threading.Thread(target=migrar, daemon=True).start()
+    
+    def migrar_mediciones_timeseries(self):
+        """Copiar en segundo plano measurements a una Time Series Collection y verificar el resultado"""
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            messagebox.showerror("Error", "MongoDB Atlas no está conectado")
+            return
+        
+        reemplazar = messagebox.askyesnocancel(
+            "Migrar a Time Series",
+            "Se copiarán las mediciones a 'measurements_ts' (Time Series con meta por sensor).\n\n"
+            "¿Reemplazar 'measurements' al terminar si la verificación es correcta?\n"
+            "(la colección actual se conserva como respaldo)")
+        if reemplazar is None:
+            return
+        
+        def migrar():
+            self.agregar_log("⏱️ Migrando mediciones a Time Series...")
+            resumen = self.mongodb_service.migrar_mediciones_a_timeseries(
+                reemplazar=reemplazar,
+                callback_lote=lambda r: self.agregar_log(f"   Lote {r['lotes']}: {r['copiadas']} copiadas")
+            )
+            if not resumen.get("completada"):
+                self.agregar_log("⚠️ Migración interrumpida, se retomará desde el último lote al reintentar")
+                return
+            
+            informe = resumen.get("verificacion") or {}
+            for clave in ("origen", "destino"):
+                datos = informe.get(clave)
+                if datos:
+                    latencias = ", ".join(f"{k} {v} ms" for k, v in datos["latencia_ms"].items())
+                    self.agregar_log(f"   {datos['coleccion']}: {datos['documentos']} docs, "
+                                     f"{datos['storage_bytes'] / 1024 / 1024:.1f} MB en disco, {latencias}")
+            if informe:
+                self.agregar_log(f"   Conteos coinciden: {'sí' if informe['conteos_coinciden'] else 'no'} | "
+                                 f"Reducción de almacenamiento: {informe['reduccion_storage_pct']}%")
+            self.agregar_log("✅ Migración a Time Series completada"
+                             + (" y 'measurements' reemplazada" if resumen.get("reemplazada") else ""))
+        
+        threading.Thread(target=migrar, daemon=True).start()
+    
+    def archivar_mediciones_antiguas(self):
+        """Mover en segundo plano las mediciones fuera de retención al archivo frío"""
+        if not self.mongodb_service or not self.mongodb_service.conectado:
+            messagebox.showerror("Error", "MongoDB Atlas no está conectado")
+            return
+        
+        politica = self.mongodb_service.politica_retencion
+        por_tipo = ", ".join(f"{tipo}: {dias} días" for tipo, dias in politica["dias_por_tipo"].items())
+        if not messagebox.askyesno("Archivar Mediciones",
+                                   f"Se moverán al archivo las mediciones con más de {politica['dias_por_defecto']} días"
+                                   + (f" ({por_tipo})" if por_tipo else "") + ".\n"
+                                   "Las consultas por rango las seguirán leyendo desde el archivo.\n¿Continuar?"):
+            return
+        
+        def archivar():
+            self.agregar_log("🗄️ Archivando mediciones antiguas...")
+            resumen = self.mongodb_service.archivar_mediciones_antiguas(
+                callback_lote=lambda r: self.agregar_log(
+                    f"   {r['sensor_id']}: {r['archivadas']} archivadas en {r['buckets']} buckets")
+            )
+            if resumen.get("completada"):
+                self.agregar_log(f"✅ Archivo completado: {resumen['archivadas']} mediciones de "
+                                 f"{resumen['sensores']} sensores")
+            else:
+                self.agregar_log("⚠️ Archivo interrumpido, se puede volver a ejecutar sin duplicar")
+        
+        threading.Thread(target=archivar, daemon=True).start()
+    
     def limpiar_cache(self):
         """Limpiar cache del sistema"""
         if not self.redis_service or not self.redis_service.conectado:
@@ -13986,7 +14304,7 @@ Sensor analizado: {sensor_name}
                 self.agregar_log("⚠️ Neo4j no disponible para sincronización")
                 return False
             
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["user_id", "username", "email", "rol"])
             sincronizados = 0
             errores = 0
             
@@ -14027,6 +14345,9 @@ Sensor analizado: {sensor_name}
         try:
             # Configurar colecciones (esto crea los roles iniciales si no existen)
             self.mongodb_service.configurar_colecciones_optimizadas()
+            if self.mongodb_service.error_indice_dedup_alertas:
+                self.agregar_log(f"⚠️ Sin índice de deduplicación de alertas: "
+                                 f"{self.mongodb_service.error_indice_dedup_alertas}")
         except Exception as e:
             self.agregar_log(f"⚠️ Error asegurando roles iniciales: {e}")
     
@@ -14068,7 +14389,7 @@ Sensor analizado: {sensor_name}
                 self.tree_usuarios.delete(item)
             
             # Obtener usuarios desde MongoDB Atlas
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["user_id", "username", "email", "rol", "status", "created_at", "last_login"])
             
             for usuario in usuarios:
                 self.tree_usuarios.insert('', 'end', values=(
@@ -14231,7 +14552,7 @@ Sensor analizado: {sensor_name}
             if not self.mongodb_service or not self.mongodb_service.conectado:
                 return
             
-            usuarios = self.mongodb_service.obtener_usuarios()
+            usuarios = self.mongodb_service.obtener_usuarios(campos=["status", "rol"])
             
             total_usuarios = len(usuarios)
             usuarios_activos = len([u for u in usuarios if u.get('status') == 'activo'])
@@ -9,31 +9,956 @@ ARQUITECTURA OPTIMIZADA:
 """
 
 import pymongo
-from pymongo import MongoClient
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from pymongo import MongoClient, InsertOne, UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from bson.decimal128 import Decimal128
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Callable
 import math
+import os
 import random
+import socket
+import threading
+import time
+
+from sensor_setup import normalize_location
+
+class ResolvedorUmbrales:
+    """
+    Umbrales efectivos servidos desde memoria.
+    
+    Carga en una pasada los umbrales globales, por ubicación y por sensor junto con la
+    ubicación de cada sensor; después cada consulta es un acceso a diccionario. Los métodos
+    que guardan umbrales o cambian sensores llaman a invalidar(), que además incrementa un
+    sello en system_config; cada `intervalo_verificacion` segundos se compara ese sello, así
+    que los cambios hechos desde otra instancia también recargan. Los diccionarios devueltos
+    son compartidos: no modificarlos.
+    """
+    
+    # Valores usados cuando no hay umbrales configurados (mismos que antes en el servicio)
+    POR_DEFECTO_SENSOR = {"Temperatura": {"min": 15, "max": 35}, "Humedad": {"min": 30, "max": 80}}
+    POR_DEFECTO_UBICACION = {"Temperatura": {"min": 5, "max": 35}, "Humedad": {"min": 30, "max": 80}}
+    
+    def __init__(self, db, intervalo_verificacion: float = 10.0):
+        self.db = db
+        self.intervalo_verificacion = intervalo_verificacion
+        self._lock = threading.Lock()
+        # Último sello leído de system_config (versión compartida entre instancias)
+        self._sello = None
+        self._ultima_verificacion = 0.0
+        # Cada invalidación incrementa la versión; una carga que se pisó con una invalidación no se marca válida
+        self._version = 0
+        self._version_cargada = None
+        self._globales = {}
+        self._por_sensor = {}
+        self._por_ubicacion = {}
+        self._ubicacion_sensor = {}
+    
+    @staticmethod
+    def ciudad_pais(location):
+        """Ciudad y país de un sensor (location como dict o string "Ciudad, Zona - País")"""
+        if isinstance(location, dict):
+            return location.get("city", ""), location.get("country", "")
+        if isinstance(location, str) and ' - ' in location:
+            partes = location.split(' - ')
+            ciudad = partes[0].strip().split(', ', 1)[0].strip()
+            return ciudad, partes[-1].strip()
+        return "", ""
+    
+    def invalidar(self):
+        """Descartar lo cargado y avisar a las otras instancias; se recarga en la próxima consulta"""
+        with self._lock:
+            self._version += 1
+        try:
+            self.db.system_config.update_one({"type": "thresholds_version"},
+                                             {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now()}},
+                                             upsert=True)
+        except Exception as e:
+            print(f"⚠️ No se pudo publicar el cambio de umbrales: {e}")
+    
+    def _verificar_sello(self):
+        """Recargar si otra instancia cambió umbrales (como mucho una lectura cada `intervalo_verificacion` s)"""
+        if time.monotonic() - self._ultima_verificacion < self.intervalo_verificacion:
+            return
+        self._ultima_verificacion = time.monotonic()
+        try:
+            sello = (self.db.system_config.find_one({"type": "thresholds_version"}, {"version": 1}) or {}).get("version")
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el sello de umbrales: {e}")
+            return
+        with self._lock:
+            if sello != self._sello:
+                self._sello = sello
+                self._version += 1
+    
+    def _asegurar_cargado(self):
+        self._verificar_sello()
+        if self._version_cargada == self._version:
+            return
+        with self._lock:
+            if self._version_cargada == self._version:
+                return
+            version = self._version
+        
+        globales_doc = self.db.system_config.find_one({"type": "global_thresholds"}, {"thresholds": 1})
+        por_sensor = {
+            doc["sensor_id"]: doc["thresholds"]
+            for doc in self.db.sensor_thresholds.find({}, {"sensor_id": 1, "thresholds": 1, "_id": 0})
+            if doc.get("sensor_id") and doc.get("thresholds")
+        }
+        por_ubicacion = {
+            (doc.get("ciudad"), doc.get("pais")): doc["thresholds"]
+            for doc in self.db.location_thresholds.find({}, {"ciudad": 1, "pais": 1, "thresholds": 1, "_id": 0})
+            if doc.get("thresholds")
+        }
+        ubicacion_sensor = {
+            sensor["sensor_id"]: self.ciudad_pais(sensor.get("location"))
+            for sensor in self.db.sensors.find({}, {"sensor_id": 1, "location": 1, "_id": 0})
+            if sensor.get("sensor_id")
+        }
+        
+        with self._lock:
+            self._globales = (globales_doc or {}).get("thresholds") or {}
+            self._por_sensor = por_sensor
+            self._por_ubicacion = por_ubicacion
+            self._ubicacion_sensor = ubicacion_sensor
+            if version == self._version:
+                self._version_cargada = version
+        print(f"🎚️ Umbrales cargados: {len(por_sensor)} sensores, {len(por_ubicacion)} ubicaciones")
+    
+    def globales(self) -> Dict[str, Any]:
+        self._asegurar_cargado()
+        return self._globales
+    
+    def de_sensor(self, sensor_id: str) -> Optional[Dict[str, Any]]:
+        self._asegurar_cargado()
+        return self._por_sensor.get(sensor_id)
+    
+    def de_ubicacion(self, ciudad: str, pais: str) -> Optional[Dict[str, Any]]:
+        self._asegurar_cargado()
+        return self._por_ubicacion.get((ciudad, pais))
+    
+    def efectivos(self, sensor_id: str) -> Dict[str, Any]:
+        """Umbrales del sensor, si no los globales, si no los valores por defecto"""
+        self._asegurar_cargado()
+        return self._por_sensor.get(sensor_id) or self._globales or self.POR_DEFECTO_SENSOR
+    
+    def ubicacion(self, sensor_id: str):
+        """(ciudad, país) del sensor según la última carga"""
+        self._asegurar_cargado()
+        return self._ubicacion_sensor.get(sensor_id, ("", ""))
+    
+    def por_ubicacion(self, sensor_id: str) -> Dict[str, Any]:
+        """Umbrales de la ubicación del sensor, si no los globales, si no los valores por defecto"""
+        self._asegurar_cargado()
+        ciudad, pais = self._ubicacion_sensor.get(sensor_id, ("", ""))
+        if not ciudad or not pais:
+            return {}
+        return self._por_ubicacion.get((ciudad, pais)) or self._globales or self.POR_DEFECTO_UBICACION
+
+
+class EvaluadorAlertasTiempoReal:
+    """
+    Evaluación de umbrales en tiempo real sobre las mediciones que se insertan.
+    
+    Corre en un hilo de fondo: con replica set usa un change stream de inserts sobre
+    measurements; si el servidor no lo admite (standalone, Time Series) cae a un poller
+    que sigue la colección por (timestamp, _id). Cada medición se compara contra los
+    umbrales efectivos cacheados en el ResolvedorUmbrales y las alertas se escriben en
+    micro-lotes con crear_alertas_idempotentes (cada `espera_lote` segundos o al llegar a
+    `tamano_lote`). Mediciones que llegan con timestamps anteriores a lo ya seguido por el
+    poller quedan para la detección incremental. Si el change stream ya no se puede reanudar
+    (el token salió del oplog) también se pasa al poller.
+    """
+    
+    # Errores tras los que el token ya no sirve: ChangeStreamFatalError, ChangeStreamHistoryLost
+    CODIGOS_NO_REANUDABLES = (280, 286)
+    
+    def __init__(self, servicio, intervalo_poll: float = 5.0, tamano_lote: int = 200, espera_lote: float = 1.0,
+                 formatear_sensor: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 callback_alertas: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.servicio = servicio
+        self.intervalo_poll = max(0.5, float(intervalo_poll))
+        self.tamano_lote = max(1, int(tamano_lote))
+        self.espera_lote = max(0.1, float(espera_lote))
+        self.formatear_sensor = formatear_sensor
+        self.callback_alertas = callback_alertas
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pendientes = []
+        self._ultimo_vaciado = time.monotonic()
+        self._display_sensor = {}
+        self._estado = {"activo": False, "modo": None, "evaluadas": 0, "alertas_creadas": 0, "ultimo_error": None}
+    
+    def iniciar(self) -> bool:
+        if self._hilo and self._hilo.is_alive():
+            return False
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self._hilo.start()
+        return True
+    
+    def detener(self, timeout: float = 5.0):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+    
+    def estado(self) -> Dict[str, Any]:
+        return dict(self._estado)
+    
+    def _ejecutar(self):
+        self._estado["activo"] = True
+        try:
+            if not self._seguir_change_stream():
+                self._seguir_poller()
+        finally:
+            self._vaciar()
+            self._estado["activo"] = False
+            print(f"⏹️ Evaluador de alertas en tiempo real detenido ({self._estado['evaluadas']} mediciones evaluadas)")
+    
+    def _seguir_change_stream(self) -> bool:
+        """Seguir inserts por change stream. False si el servidor no lo admite (se usa el poller)."""
+        token = None
+        while not self._detener.is_set():
+            try:
+                with self.servicio.db.measurements.watch(
+                    [{"$match": {"operationType": "insert"}}], max_await_time_ms=int(self.espera_lote * 1000),
+                    resume_after=token
+                ) as stream:
+                    self._estado["modo"] = "change_stream"
+                    print("📡 Evaluador de alertas en tiempo real: change stream sobre 'measurements'")
+                    while not self._detener.is_set():
+                        cambio = stream.try_next()
+                        if cambio is not None:
+                            token = stream.resume_token
+                            self._evaluar(cambio["fullDocument"])
+                        self._vaciar_si_corresponde()
+            except OperationFailure as e:
+                if self._estado["modo"] is None:
+                    print(f"ℹ️ Change stream no disponible ({e}); se usa el poller por timestamp")
+                    return False
+                self._estado["ultimo_error"] = str(e)
+                if e.code in self.CODIGOS_NO_REANUDABLES or e.has_error_label("NonResumableChangeStreamError"):
+                    # Reintentar con el mismo token fallaría siempre: lo perdido queda para la detección incremental
+                    print(f"⚠️ Change stream no reanudable ({e}); se usa el poller por timestamp")
+                    return False
+                print(f"⚠️ Change stream interrumpido, se reanuda: {e}")
+                self._detener.wait(self.intervalo_poll)
+            except PyMongoError as e:
+                # Error transitorio de red: se reanuda desde el último token
+                self._estado["ultimo_error"] = str(e)
+                print(f"⚠️ Change stream interrumpido, se reanuda: {e}")
+                self._detener.wait(self.intervalo_poll)
+        return True
+    
+    def _seguir_poller(self):
+        """Seguir la colección por (timestamp, _id) desde el momento en que arranca el evaluador"""
+        self._estado["modo"] = "poller"
+        print(f"🔁 Evaluador de alertas en tiempo real: poller cada {self.intervalo_poll}s")
+        ultimo_ts, ultimo_id = datetime.now(), None
+        while not self._detener.is_set():
+            try:
+                if ultimo_id is None:
+                    query = {"timestamp": {"$gt": ultimo_ts}}
+                else:
+                    query = {"$or": [{"timestamp": {"$gt": ultimo_ts}},
+                                     {"timestamp": ultimo_ts, "_id": {"$gt": ultimo_id}}]}
+                lote = list(self.servicio.db.measurements.find(query)
+                            .sort([("timestamp", 1), ("_id", 1)]).limit(self.tamano_lote))
+                for medicion in lote:
+                    self._evaluar(medicion)
+                    ultimo_ts, ultimo_id = medicion["timestamp"], medicion["_id"]
+                self._vaciar()
+                if len(lote) < self.tamano_lote:
+                    self._detener.wait(self.intervalo_poll)
+            except Exception as e:
+                self._estado["ultimo_error"] = str(e)
+                print(f"⚠️ Error en el poller de alertas: {e}")
+                self._detener.wait(self.intervalo_poll)
+    
+    def _display(self, sensor_id: str) -> str:
+        if sensor_id not in self._display_sensor:
+            sensor = self.servicio.obtener_sensor_por_id(sensor_id, campos=["name", "location"]) or {}
+            self._display_sensor[sensor_id] = (
+                self.formatear_sensor(sensor) if self.formatear_sensor and sensor else sensor.get("name", sensor_id)
+            )
+        return self._display_sensor[sensor_id]
+    
+    def _evaluar(self, medicion: Dict[str, Any]):
+        """Comparar una medición con los umbrales efectivos de su ubicación (en memoria)"""
+        sensor_id = medicion.get("sensor_id")
+        timestamp = medicion.get("timestamp")
+        if not sensor_id or not isinstance(timestamp, datetime):
+            return
+        self._estado["evaluadas"] += 1
+        
+        umbrales = self.servicio.umbrales.por_ubicacion(sensor_id)
+        if not umbrales:
+            return
+        ciudad, pais = self.servicio.umbrales.ubicacion(sensor_id)
+        
+        for parametro, campo in (("Temperatura", "temperature"), ("Humedad", "humidity")):
+            valor = medicion.get(campo)
+            if not isinstance(valor, (int, float)) or isinstance(valor, bool):
+                continue
+            minimo = self.servicio._valor_umbral(umbrales.get(parametro, {}).get("min"))
+            maximo = self.servicio._valor_umbral(umbrales.get(parametro, {}).get("max"))
+            for tipo_alerta, umbral, viola in ((f"{parametro} Baja", minimo, minimo is not None and valor < minimo),
+                                               (f"{parametro} Alta", maximo, maximo is not None and valor > maximo)):
+                if viola:
+                    self._pendientes.append(self.servicio.construir_alerta_climatica(
+                        sensor_id, self._display(sensor_id), ciudad, pais, tipo_alerta,
+                        valor, umbral, parametro, timestamp
+                    ))
+        
+        if len(self._pendientes) >= self.tamano_lote:
+            self._vaciar()
+    
+    def _vaciar_si_corresponde(self):
+        if self._pendientes and time.monotonic() - self._ultimo_vaciado >= self.espera_lote:
+            self._vaciar()
+    
+    def _vaciar(self):
+        """Escribir el micro-lote pendiente de alertas"""
+        self._ultimo_vaciado = time.monotonic()
+        if not self._pendientes:
+            return
+        lote, self._pendientes = self._pendientes, []
+        resultado = self.servicio.crear_alertas_idempotentes(lote, self.tamano_lote)
+        self._estado["alertas_creadas"] += resultado["creadas"]
+        if self.callback_alertas and resultado["creadas"]:
+            self.callback_alertas(resultado)
+
+
+class ReportadorProgreso:
+    """
+    Progreso de un proceso con escrituras coalescidas.
+    
+    Cada reporte se combina con el pendiente (el último progreso/estado gana) y va a
+    processes como mucho una vez cada `intervalo` segundos; los estados finales se escriben
+    en el momento. Con `cache` (Redis) cada reporte se publica también en un hash con TTL,
+    para lecturas de progreso que no tocan MongoDB; el hash solo vive mientras el proceso
+    corre (liberar_reportador_progreso lo borra al cerrarlo o reencolarlo).
+    """
+    
+    ESTADOS_FINALES = ("completed", "failed", "cancelled")
+    
+    def __init__(self, servicio, process_id: str, intervalo: float = 2.0, cache=None, ttl_cache: int = 3600):
+        self.servicio = servicio
+        self.process_id = process_id
+        self.intervalo = max(0.0, float(intervalo))
+        self.cache = cache
+        self.ttl_cache = ttl_cache
+        self._pendiente = {}
+        self._ultima_escritura = 0.0
+        self._lock = threading.Lock()
+        self.actual = {"process_id": process_id, "status": None, "progress": None, "updated_at": None}
+    
+    def reportar(self, progress: Optional[int] = None, status: str = "running",
+                 result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            self._pendiente["status"] = status
+            for campo, valor in (("progress", progress), ("result", result), ("error", error)):
+                if valor is not None:
+                    self._pendiente[campo] = valor
+            self.actual.update(status=status, updated_at=datetime.now())
+            if progress is not None:
+                self.actual["progress"] = progress
+            urgente = status in self.ESTADOS_FINALES or time.monotonic() - self._ultima_escritura >= self.intervalo
+        
+        if self.cache is not None:
+            self.cache.hset(f"progress:process:{self.process_id}",
+                            {k: v for k, v in self.actual.items() if v is not None}, ttl=self.ttl_cache)
+        if urgente:
+            self.vaciar()
+    
+    def vaciar(self):
+        """Escribir lo pendiente en processes"""
+        with self._lock:
+            pendiente, self._pendiente = self._pendiente, {}
+            self._ultima_escritura = time.monotonic()
+        if pendiente:
+            self.servicio.actualizar_estado_proceso(self.process_id, **pendiente)
+
+
+class ControlProceso:
+    """Cancelación cooperativa de un trabajo: los handlers consultan `cancelado()` entre lotes"""
+    
+    def __init__(self, ejecutor, process_id: str):
+        self.ejecutor = ejecutor
+        self.process_id = process_id
+        self.progreso = ejecutor.servicio.crear_reportador_progreso(process_id)
+        self._ultima_consulta = 0.0
+        self._cancelado = False
+    
+    def cancelado(self) -> bool:
+        """True si se pidió cancelar (la base se consulta como mucho cada `intervalo_cancelacion` s)"""
+        if self._cancelado or self.process_id in self.ejecutor._cancelaciones:
+            self._cancelado = True
+            return True
+        if time.monotonic() - self._ultima_consulta < self.ejecutor.intervalo_cancelacion:
+            return False
+        self._ultima_consulta = time.monotonic()
+        try:
+            # La consulta también sirve de heartbeat para recuperar trabajos huérfanos
+            doc = self.ejecutor.servicio.db.processes.find_one_and_update(
+                {"process_id": self.process_id},
+                {"$set": {"heartbeat_at": datetime.now()}},
+                projection={"cancel_requested": 1}
+            ) or {}
+            self._cancelado = bool(doc.get("cancel_requested"))
+        except Exception as e:
+            print(f"⚠️ No se pudo consultar la cancelación de {self.process_id}: {e}")
+        return self._cancelado
+    
+    def lotes(self, lotes: Iterable[Any]) -> Iterable[Any]:
+        """Recorrer lotes cortando en cuanto se pide cancelar"""
+        for lote in lotes:
+            if self.cancelado():
+                return
+            yield lote
+
+
+class EjecutorProcesos:
+    """
+    Ejecución acotada de procesos y servicios en segundo plano.
+    
+    La cola vive en la colección processes (status "queued", priority, enqueued_at), así
+    sobrevive a reinicios y la ven todas las instancias. Un pool fijo de `max_trabajadores`
+    hilos toma trabajos con find_one_and_update (mayor prioridad primero, FIFO dentro de la
+    misma) y llama al handler registrado para `job.tipo` con (proceso, control). La
+    cancelación es cooperativa: cancelar marca cancel_requested y el handler la consulta
+    entre lotes con ControlProceso. Trabajos "running" sin heartbeat por más de
+    `timeout_huerfano` segundos (instancia caída) vuelven a la cola al arrancar.
+    
+    Los trabajos encolados con `local=True` (servicios facturados, procesos lanzados a mano)
+    quedan atados a la instancia que los encoló (`job.instancia`): solo ella los toma, porque
+    escriben en su interfaz. Si esa instancia desaparece (sin latido en process_runners) se
+    marcan fallidos en lugar de reencolarse, y al detenerse cancela los suyos en cola.
+    """
+    
+    def __init__(self, servicio, max_trabajadores: int = 2, intervalo_poll: float = 2.0,
+                 intervalo_cancelacion: float = 1.0, timeout_huerfano: float = 600.0):
+        self.servicio = servicio
+        self.max_trabajadores = max(1, int(max_trabajadores))
+        self.intervalo_poll = max(0.2, float(intervalo_poll))
+        self.intervalo_cancelacion = max(0.0, float(intervalo_cancelacion))
+        self.timeout_huerfano = float(timeout_huerfano)
+        self.instancia = f"{socket.gethostname()}:{os.getpid()}"
+        self._ultimo_latido = 0.0
+        self._handlers = {}
+        self._cancelaciones = set()
+        self._detener = threading.Event()
+        self._hay_trabajo = threading.Event()
+        self._hilos = []
+        self._lock = threading.Lock()
+        self._estado = {"activo": False, "en_curso": 0, "completados": 0, "fallidos": 0, "cancelados": 0,
+                        "ultimo_error": None}
+    
+    def registrar(self, tipo: str, handler: Callable[[Dict[str, Any], ControlProceso], Any]):
+        self._handlers[tipo] = handler
+    
+    def iniciar(self) -> bool:
+        if any(hilo.is_alive() for hilo in self._hilos):
+            return False
+        self._detener.clear()
+        self._recuperar_huerfanos()
+        self._hilos = [threading.Thread(target=self._trabajar, name=f"ejecutor-procesos-{i}", daemon=True)
+                       for i in range(self.max_trabajadores)]
+        # El latido de la instancia va en su propio hilo: con todos los trabajadores ocupados sigue vivo
+        self._hilos.append(threading.Thread(target=self._latir_periodicamente, name="ejecutor-procesos-latido",
+                                            daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+        self._estado["activo"] = True
+        print(f"⚙️ Ejecutor de procesos iniciado ({self.max_trabajadores} trabajadores)")
+        return True
+    
+    def detener(self, timeout: float = 5.0):
+        """Dejar de tomar trabajos; los que están corriendo terminan su lote actual"""
+        self._detener.set()
+        self._hay_trabajo.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._estado["activo"] = False
+        try:
+            ahora = datetime.now()
+            # Lo encolado para esta instancia no lo puede correr otra
+            self.servicio.db.processes.update_many(
+                {"status": "queued", "job.instancia": self.instancia},
+                {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": ahora, "updated_at": ahora}}
+            )
+            self.servicio.db.process_runners.delete_one({"_id": self.instancia})
+        except Exception as e:
+            print(f"⚠️ No se pudieron cerrar los trabajos locales en cola: {e}")
+    
+    def estado(self) -> Dict[str, Any]:
+        return dict(self._estado, trabajadores=self.max_trabajadores)
+    
+    def encolar(self, process_id: str, tipo: str, payload: Optional[Dict[str, Any]] = None,
+                prioridad: int = 0, datos: Optional[Dict[str, Any]] = None, local: bool = False) -> bool:
+        """
+        Encolar un trabajo. Con `datos` se crea el documento del proceso; sin ellos se reencola uno
+        existente. `local` lo reserva para esta instancia.
+        """
+        if tipo not in self._handlers:
+            print(f"❌ No hay handler registrado para trabajos '{tipo}'")
+            return False
+        ahora = datetime.now()
+        job = {"tipo": tipo, "payload": payload or {}}
+        if local:
+            job["instancia"] = self.instancia
+        trabajo = {"status": "queued", "job": job,
+                   "priority": int(prioridad), "enqueued_at": ahora, "updated_at": ahora,
+                   "cancel_requested": False, "progress": 0}
+        if datos is not None:
+            self.servicio.db.processes.insert_one(dict(datos, process_id=process_id, created_at=ahora, **trabajo))
+        elif not self.servicio.db.processes.update_one(
+            # Un proceso que ya está en cola o corriendo no se encola dos veces
+            {"process_id": process_id, "status": {"$nin": ["queued", "running"]}},
+            {"$set": trabajo,
+             "$unset": {"started_at": "", "finished_at": "", "duration_s": "", "wait_s": "", "error": ""}}
+        ).modified_count:
+            return False
+        self.servicio.liberar_reportador_progreso(process_id)
+        self._cancelaciones.discard(process_id)
+        self._hay_trabajo.set()
+        return True
+    
+    def cancelar(self, process_id: str) -> Optional[str]:
+        """Cancelar un trabajo: en cola se descarta; corriendo se pide parar. Devuelve el estado resultante."""
+        ahora = datetime.now()
+        if self.servicio.db.processes.update_one(
+            {"process_id": process_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": ahora, "updated_at": ahora}}
+        ).modified_count:
+            self.servicio.liberar_reportador_progreso(process_id)
+            return "cancelled"
+        if self.servicio.db.processes.update_one(
+            {"process_id": process_id, "status": "running"},
+            {"$set": {"cancel_requested": True, "updated_at": ahora}}
+        ).matched_count:
+            self._cancelaciones.add(process_id)
+            return "cancelando"
+        return None
+    
+    def metricas(self) -> Dict[str, Any]:
+        """Profundidad de la cola y tiempos de espera/ejecución de los últimos 100 trabajos"""
+        procesos = self.servicio.db.processes
+        metricas = self.estado()
+        metricas["en_cola"] = procesos.count_documents({"status": "queued"})
+        metricas["corriendo"] = procesos.count_documents({"status": "running", "job": {"$exists": True}})
+        tiempos = next(procesos.aggregate([
+            {"$match": {"duration_s": {"$exists": True}}},
+            {"$sort": {"finished_at": -1}},
+            {"$limit": 100},
+            {"$group": {"_id": None, "duracion_media_s": {"$avg": "$duration_s"},
+                        "duracion_max_s": {"$max": "$duration_s"}, "espera_media_s": {"$avg": "$wait_s"}}}
+        ]), {})
+        for clave in ("duracion_media_s", "duracion_max_s", "espera_media_s"):
+            metricas[clave] = tiempos.get(clave)
+        return metricas
+    
+    def _latir(self, forzar: bool = False):
+        """Registrar que esta instancia sigue viva (como mucho cada 30 s)"""
+        with self._lock:
+            if not forzar and time.monotonic() - self._ultimo_latido < 30:
+                return
+            self._ultimo_latido = time.monotonic()
+        self.servicio.db.process_runners.update_one(
+            {"_id": self.instancia}, {"$set": {"heartbeat_at": datetime.now()}}, upsert=True
+        )
+    
+    def _latir_periodicamente(self):
+        while not self._detener.wait(30):
+            try:
+                self._latir(forzar=True)
+            except Exception as e:
+                print(f"⚠️ No se pudo registrar el latido del ejecutor: {e}")
+    
+    def _recuperar_huerfanos(self):
+        ahora = datetime.now()
+        limite = ahora - timedelta(seconds=self.timeout_huerfano)
+        try:
+            self._latir(forzar=True)
+            vivas = self.servicio.db.process_runners.distinct("_id", {"heartbeat_at": {"$gte": limite}})
+            # Trabajos locales de instancias que ya no están: nadie más puede correrlos
+            # (salvo que el propio trabajo haya latido hace poco: sigue corriendo)
+            perdidos = self.servicio.db.processes.update_many(
+                {"status": {"$in": ["queued", "running"]}, "job.instancia": {"$exists": True, "$nin": vivas},
+                 "$nor": [{"heartbeat_at": {"$gte": limite}}]},
+                {"$set": {"status": "failed", "error": "La instancia que encoló el trabajo ya no está activa",
+                          "finished_at": ahora, "updated_at": ahora}}
+            ).modified_count
+            recuperados = self.servicio.db.processes.update_many(
+                {"status": "running", "job": {"$exists": True}, "job.instancia": {"$exists": False},
+                 "$or": [{"heartbeat_at": {"$lt": limite}},
+                         {"heartbeat_at": {"$exists": False}, "started_at": {"$lt": limite}}]},
+                {"$set": {"status": "queued", "updated_at": ahora}}
+            ).modified_count
+            if recuperados or perdidos:
+                print(f"♻️ Procesos huérfanos: {recuperados} devueltos a la cola, {perdidos} marcados fallidos")
+        except Exception as e:
+            print(f"⚠️ No se pudieron recuperar procesos huérfanos: {e}")
+    
+    def _tomar(self) -> Optional[Dict[str, Any]]:
+        ahora = datetime.now()
+        return self.servicio.db.processes.find_one_and_update(
+            {"status": "queued", "job.tipo": {"$in": list(self._handlers)},
+             "job.instancia": {"$in": [None, self.instancia]}},
+            {"$set": {"status": "running", "started_at": ahora, "heartbeat_at": ahora, "updated_at": ahora}},
+            sort=[("priority", -1), ("enqueued_at", 1)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+    
+    def _trabajar(self):
+        while not self._detener.is_set():
+            try:
+                proceso = self._tomar()
+            except Exception as e:
+                self._estado["ultimo_error"] = str(e)
+                print(f"⚠️ Error tomando trabajo de la cola: {e}")
+                self._detener.wait(self.intervalo_poll)
+                continue
+            if proceso is None:
+                self._hay_trabajo.wait(self.intervalo_poll)
+                self._hay_trabajo.clear()
+                continue
+            try:
+                self._ejecutar(proceso)
+            except Exception as e:
+                self._estado["ultimo_error"] = str(e)
+                print(f"⚠️ Error cerrando el proceso {proceso.get('process_id')}: {e}")
+    
+    def _ejecutar(self, proceso: Dict[str, Any]):
+        process_id = proceso["process_id"]
+        control = ControlProceso(self, process_id)
+        with self._lock:
+            self._estado["en_curso"] += 1
+        error = None
+        try:
+            self._handlers[proceso["job"]["tipo"]](proceso, control)
+        except Exception as e:
+            error = str(e)
+            self._estado["ultimo_error"] = error
+            print(f"❌ Error ejecutando proceso {process_id}: {e}")
+        finally:
+            with self._lock:
+                self._estado["en_curso"] -= 1
+            control.progreso.vaciar()
+        
+        fin = datetime.now()
+        cierre = {"finished_at": fin, "updated_at": fin,
+                  "duration_s": (fin - proceso["started_at"]).total_seconds(),
+                  "wait_s": (proceso["started_at"] - proceso.get("enqueued_at", proceso["started_at"])).total_seconds()}
+        if control.cancelado():
+            estado = "cancelled"
+        elif error:
+            estado, cierre["error"] = "failed", error
+        else:
+            estado = "completed"
+        procesos = self.servicio.db.processes
+        if procesos.update_one({"process_id": process_id, "status": "running"},
+                               {"$set": dict(cierre, status=estado)}).modified_count == 0:
+            # El handler ya cerró el proceso (completed/failed con resultado): se respeta su estado
+            doc = procesos.find_one_and_update({"process_id": process_id}, {"$set": cierre},
+                                               projection={"status": 1}) or {}
+            estado = doc.get("status", estado)
+        # Cerrado en processes: desde acá el progreso se lee de la base
+        self.servicio.liberar_reportador_progreso(process_id)
+        self._cancelaciones.discard(process_id)
+        clave = {"completed": "completados", "cancelled": "cancelados"}.get(estado, "fallidos")
+        self._estado[clave] += 1
+
+
+class PlanificadorProcesos:
+    """
+    Corridas recurrentes de los "Procesos Periódicos" a partir de su periodicidad.
+    
+    Cada proceso periódico guarda en `schedule` la próxima corrida (alineada al inicio del
+    día, semana, mes o año) y cada corrida reporta el período completo anterior. Un hilo
+    revisa cada `intervalo` segundos las corridas vencidas y las encola en el
+    EjecutorProcesos, solo dentro de la ventana horaria configurada (horas valle). Tras una
+    caída se recuperan las últimas `max_atrasadas` corridas: con `coalescer` se despachan como
+    una sola corrida que cubre todo el atraso, sin él de a una por vez. Con Redis cada
+    corrida se toma con un lease para que despache una sola instancia; el avance de
+    next_run_at es además condicional, así que sin Redis tampoco se duplica.
+    """
+    
+    PERIODICIDADES = ("diaria", "semanal", "mensual", "anual")
+    
+    def __init__(self, servicio, lease=None, intervalo: float = 60.0, coalescer: bool = True,
+                 max_atrasadas: int = 30, ventana_horas: Optional[tuple] = None, lease_ttl: int = 300,
+                 callback_despacho: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.servicio = servicio
+        self.lease = lease
+        self.intervalo = max(1.0, float(intervalo))
+        self.coalescer = coalescer
+        self.max_atrasadas = max(1, int(max_atrasadas))
+        self.ventana_horas = ventana_horas
+        self.lease_ttl = int(lease_ttl)
+        self.callback_despacho = callback_despacho
+        self.propietario = f"{socket.gethostname()}:{os.getpid()}"
+        self._detener = threading.Event()
+        self._hilo = None
+        self._estado = {"activo": False, "despachadas": 0, "atrasadas_coalescidas": 0, "ultimo_tick": None,
+                        "ultimo_error": None}
+    
+    def iniciar(self) -> bool:
+        if self._hilo and self._hilo.is_alive():
+            return False
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self._hilo.start()
+        return True
+    
+    def detener(self, timeout: float = 5.0):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+    
+    def estado(self) -> Dict[str, Any]:
+        return dict(self._estado)
+    
+    @classmethod
+    def normalizar_periodicidad(cls, valor: Optional[str]) -> Optional[str]:
+        """'Diario', 'mensual', 'Anual'... a una de PERIODICIDADES (None si no es recurrente)"""
+        valor = (valor or "").strip().lower()
+        return next((p for p in cls.PERIODICIDADES if valor[:4] and p.startswith(valor[:4])), None)
+    
+    @staticmethod
+    def inicio_periodo(ts: datetime, periodicidad: str) -> datetime:
+        dia = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        if periodicidad == "semanal":
+            return dia - timedelta(days=dia.weekday())
+        if periodicidad == "mensual":
+            return dia.replace(day=1)
+        if periodicidad == "anual":
+            return dia.replace(month=1, day=1)
+        return dia
+    
+    @staticmethod
+    def sumar_periodo(ts: datetime, periodicidad: str, n: int = 1) -> datetime:
+        if periodicidad == "semanal":
+            return ts + timedelta(weeks=n)
+        if periodicidad == "mensual":
+            meses = ts.year * 12 + ts.month - 1 + n
+            return ts.replace(year=meses // 12, month=meses % 12 + 1)
+        if periodicidad == "anual":
+            return ts.replace(year=ts.year + n)
+        return ts + timedelta(days=n)
+    
+    def en_ventana(self, ahora: datetime) -> bool:
+        if not self.ventana_horas:
+            return True
+        desde, hasta = self.ventana_horas
+        # Ventanas que cruzan la medianoche, p. ej. (22, 6)
+        return desde <= ahora.hour < hasta if desde <= hasta else (ahora.hour >= desde or ahora.hour < hasta)
+    
+    def _ejecutar(self):
+        self._estado["activo"] = True
+        print(f"🗓️ Planificador de procesos periódicos cada {self.intervalo}s"
+              f"{f' (ventana {self.ventana_horas[0]}-{self.ventana_horas[1]} h)' if self.ventana_horas else ''}")
+        while not self._detener.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                self._estado["ultimo_error"] = str(e)
+                print(f"⚠️ Error en el planificador de procesos: {e}")
+            self._detener.wait(self.intervalo)
+        self._estado["activo"] = False
+    
+    def tick(self, ahora: Optional[datetime] = None):
+        """Programar procesos nuevos y despachar las corridas vencidas"""
+        ahora = ahora or datetime.now()
+        self._estado["ultimo_tick"] = ahora
+        procesos = self.servicio.db.processes
+        
+        # Procesos periódicos sin schedule: la primera corrida es el próximo inicio de período
+        for proceso in procesos.find({"tipo_proceso": "periodico_consulta", "schedule": {"$exists": False}},
+                                     {"process_id": 1, "agrupacion": 1, "periodicidad": 1}):
+            periodicidad = self.normalizar_periodicidad(proceso.get("periodicidad") or proceso.get("agrupacion"))
+            if not periodicidad:
+                continue
+            procesos.update_one({"_id": proceso["_id"], "schedule": {"$exists": False}}, {"$set": {"schedule": {
+                "activo": True, "periodicidad": periodicidad,
+                "next_run_at": self.sumar_periodo(self.inicio_periodo(ahora, periodicidad), periodicidad),
+                "last_run_at": None
+            }}})
+        
+        if not self.en_ventana(ahora):
+            return
+        
+        vencidos = procesos.find(
+            {"schedule.activo": True, "schedule.next_run_at": {"$lte": ahora},
+             "status": {"$nin": ["queued", "running"]}},
+            {"process_id": 1, "schedule": 1}
+        ).sort("schedule.next_run_at", 1)
+        for proceso in vencidos:
+            if self._detener.is_set():
+                break
+            self._despachar(proceso, ahora)
+    
+    def _despachar(self, proceso: Dict[str, Any], ahora: datetime):
+        process_id = proceso["process_id"]
+        schedule = proceso["schedule"]
+        periodicidad = schedule["periodicidad"]
+        corrida = schedule["next_run_at"]
+        
+        # Corridas vencidas desde next_run_at; se conservan las últimas max_atrasadas
+        vencidas = [corrida]
+        while self.sumar_periodo(vencidas[-1], periodicidad) <= ahora:
+            vencidas.append(self.sumar_periodo(vencidas[-1], periodicidad))
+        vencidas = vencidas[-self.max_atrasadas:]
+        cubiertas = vencidas if self.coalescer else vencidas[:1]
+        
+        clave = f"planificador:{process_id}:{corrida.isoformat()}"
+        if self.lease is not None and self.lease.adquirir_lease(clave, self.propietario, self.lease_ttl) is False:
+            return  # Otra instancia está despachando esta corrida
+        try:
+            self._despachar_corrida(proceso, corrida, cubiertas)
+        finally:
+            if self.lease is not None:
+                self.lease.liberar_lease(clave, self.propietario)
+    
+    def _despachar_corrida(self, proceso: Dict[str, Any], corrida: datetime, cubiertas: List[datetime]):
+        process_id = proceso["process_id"]
+        schedule = proceso["schedule"]
+        periodicidad = schedule["periodicidad"]
+        procesos = self.servicio.db.processes
+        
+        # Avance condicional: solo una instancia mueve next_run_at desde este valor
+        nueva = self.sumar_periodo(cubiertas[-1], periodicidad)
+        if not procesos.update_one(
+            {"process_id": process_id, "schedule.next_run_at": corrida},
+            {"$set": {"schedule.next_run_at": nueva, "schedule.last_run_at": cubiertas[-1]}}
+        ).modified_count:
+            return
+        
+        payload = {
+            "fecha_inicio": self.sumar_periodo(cubiertas[0], periodicidad, -1).strftime("%Y-%m-%d"),
+            "fecha_fin": (cubiertas[-1] - timedelta(days=1)).strftime("%Y-%m-%d"),
+            "corrida": cubiertas[-1].isoformat(),
+            "corridas_coalescidas": len(cubiertas)
+        }
+        encolado = False
+        try:
+            encolado = self.servicio.encolar_proceso(process_id, "proceso_periodico", payload, prioridad=-1)
+        finally:
+            if not encolado:
+                # Sin encolar (p. ej. ya estaba en cola a mano): se devuelve next_run_at para reintentar
+                procesos.update_one(
+                    {"process_id": process_id, "schedule.next_run_at": nueva},
+                    {"$set": {"schedule.next_run_at": corrida, "schedule.last_run_at": schedule.get("last_run_at")}}
+                )
+                print(f"⚠️ No se pudo encolar la corrida {payload['corrida']} de {process_id}; se reintenta")
+        if not encolado:
+            return
+        
+        self._estado["despachadas"] += 1
+        self._estado["atrasadas_coalescidas"] += len(cubiertas) - 1
+        if self.callback_despacho:
+            self.callback_despacho(dict(payload, process_id=process_id))
+
 
 class ServicioMongoDBOptimizado:
     """Servicio optimizado para MongoDB Atlas con arquitectura especializada"""
     
-    def __init__(self, connection_string: str, database_name: str):
+    # Parámetros y granularidades mantenidos en la colección measurement_rollups
+    PARAMETROS_ROLLUP = ("temperature", "humidity")
+    GRANULARIDADES_ROLLUP = {"hora": "hour", "dia": "day", "mes": "month"}
+    
+    # Segundos que se reutiliza el snapshot de obtener_estadisticas
+    TTL_CACHE_ESTADISTICAS = 30
+    
+    # Segundos que se reutiliza el corte archivado leído de migrations (otra instancia puede avanzarlo)
+    TTL_CORTE_ARCHIVO = 5
+    
+    # metaField de measurements como time series: sensor_id, claves de ubicación y tipo
+    META_FIELD_MEDICIONES = "meta"
+    
+    # Clave única de alertas automáticas (índice parcial sobre automatic=True)
+    CLAVE_DEDUP_ALERTAS = (("sensor_id", 1), ("measurement_ts", 1), ("parameter", 1), ("direction", 1))
+    
+    # El watermark de alertas nunca pasa del inicio de la corrida menos estos segundos:
+    # mediciones que entran con algo de demora todavía caen en la próxima corrida
+    MARGEN_INGESTA_ALERTAS_S = 300
+    
+    # Archivo frío de mediciones: buckets por sensor/mes con compresión zstd a nivel de bloque
+    COLECCION_ARCHIVO = "measurements_archive"
+    # Puntos por bucket del archivo (un mes entero de un sensor frecuente no entra en 16 MB)
+    PUNTOS_POR_BUCKET_ARCHIVO = 1000
+    
+    # Modos de read preference admitidos para el handle analítico
+    MODOS_LECTURA = {
+        "primary": Primary,
+        "primaryPreferred": PrimaryPreferred,
+        "secondary": Secondary,
+        "secondaryPreferred": SecondaryPreferred,
+        "nearest": Nearest
+    }
+    
+    def __init__(self, connection_string: str, database_name: str,
+                 opciones_cliente: Optional[Dict[str, Any]] = None,
+                 max_time_ms: Optional[Dict[str, int]] = None,
+                 lectura_analitica: Optional[Dict[str, Any]] = None,
+                 opciones_timeseries: Optional[Dict[str, Any]] = None,
+                 politica_retencion: Optional[Dict[str, Any]] = None):
         self.connection_string = connection_string
         self.database_name = database_name
+        # Pool, compresión y timeouts del MongoClient (ver ConfiguracionMongoDBReal)
+        self.opciones_cliente = {"serverSelectionTimeoutMS": 5000}
+        self.opciones_cliente.update(opciones_cliente or {})
+        # maxTimeMS por clase de operación: "lectura", "conteo", "agregacion"
+        self.max_time_ms = dict(max_time_ms or {})
+        # Reportes y procesos leen por db_analitica: read_preference, max_staleness (s) y read_concern
+        self.lectura_analitica = {"read_preference": "primary", "max_staleness": -1, "read_concern": "local"}
+        self.lectura_analitica.update(lectura_analitica or {})
+        # Bucketing de measurements: granularity o bucket_span_s (segundos, MongoDB 6.3+)
+        self.opciones_timeseries = {"granularity": "minutes", "bucket_span_s": 0}
+        self.opciones_timeseries.update(opciones_timeseries or {})
+        # Días que las mediciones crudas quedan en measurements antes de pasar al archivo
+        self.politica_retencion = {"dias_por_defecto": 365, "dias_por_tipo": {}}
+        self.politica_retencion.update(politica_retencion or {})
         self.client = None
         self.db = None
+        self.db_analitica = None
+        self.umbrales = None
+        self.evaluador = None
+        self.ejecutor = None
+        self.planificador = None
+        # Reportadores de progreso de los procesos en curso y cache opcional (Redis)
+        self.intervalo_progreso = 2.0
+        self.cache_progreso = None
+        self._reportadores_progreso = {}
+        # Opciones timeseries actuales de measurements (None = colección normal) y meta por sensor
+        self._timeseries_mediciones = None
+        self._cache_meta_sensores = {}
+        # Corte más reciente archivado: rangos que empiezan antes también leen el archivo
+        self._archivado_hasta = None
+        self._archivado_leido = 0.0
+        # Motivo por el que no se pudo crear el índice único de alertas automáticas (None = creado)
+        self.error_indice_dedup_alertas = None
         self.conectado = False
+        self._cache_estadisticas = None
+        # Registro de colecciones existentes (se consulta al conectar/configurar, no en cada lectura)
+        self._colecciones_existentes = None
         
     def conectar(self) -> bool:
         """Conectar a MongoDB Atlas"""
         try:
-            self.client = MongoClient(self.connection_string, serverSelectionTimeoutMS=5000)
+            self.client = MongoClient(self.connection_string, **self.opciones_cliente)
             self.db = self.client[self.database_name]
+            self.db_analitica = self._crear_db_analitica()
+            self.umbrales = ResolvedorUmbrales(self.db)
             
             # Probar conexión
             self.client.admin.command('ping')
             self.conectado = True
+            self.actualizar_registro_colecciones()
             return True
             
         except Exception as e:
@@ -41,8 +966,86 @@ class ServicioMongoDBOptimizado:
             self.conectado = False
             return False
     
+    def _crear_db_analitica(self):
+        """Handle de la base para lecturas analíticas (escrituras y transacciones siguen en self.db)"""
+        modo = self.lectura_analitica.get("read_preference") or "primary"
+        clase = self.MODOS_LECTURA.get(modo)
+        if clase is None:
+            print(f"⚠️ Read preference '{modo}' no reconocida, se usa primary")
+            clase = Primary
+        
+        if clase is Primary:
+            read_preference = Primary()
+        else:
+            read_preference = clase(max_staleness=int(self.lectura_analitica.get("max_staleness", -1)))
+        
+        return self.client.get_database(
+            self.database_name,
+            read_preference=read_preference,
+            read_concern=ReadConcern(self.lectura_analitica.get("read_concern") or None)
+        )
+    
+    def _limite_tiempo(self, clase: str) -> Optional[int]:
+        """maxTimeMS configurado para una clase de operación (None = sin límite)"""
+        return self.max_time_ms.get(clase) or None
+    
+    def _opciones_tiempo(self, clase: str) -> Dict[str, int]:
+        """kwargs maxTimeMS para aggregate/count_documents según la clase de operación"""
+        limite = self._limite_tiempo(clase)
+        return {"maxTimeMS": limite} if limite else {}
+    
+    def actualizar_registro_colecciones(self):
+        """Leer una vez las colecciones existentes y guardarlas en el registro"""
+        try:
+            self._colecciones_existentes = set(self.db.list_collection_names())
+            self._timeseries_mediciones = self._leer_opciones_timeseries("measurements")
+            estado_archivo = self.db.migrations.find_one({"_id": "measurements_archive"}) or {}
+            self._archivado_hasta = estado_archivo.get("archivado_hasta")
+            self._archivado_leido = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el listado de colecciones: {e}")
+            self._colecciones_existentes = None
+    
+    def _leer_opciones_timeseries(self, nombre: str) -> Optional[Dict[str, Any]]:
+        """Opciones timeseries de una colección (None si no existe o es una colección normal)"""
+        info = next(self.db.list_collections(filter={"name": nombre}), None)
+        if not info:
+            return None
+        return info.get("options", {}).get("timeseries")
+    
+    def _especificacion_timeseries(self, granularidad: Optional[str] = None,
+                                   bucket_span_s: Optional[int] = None) -> Dict[str, Any]:
+        """Opciones timeseries para create_collection según la configuración de bucketing"""
+        granularidad = granularidad or self.opciones_timeseries.get("granularity") or "minutes"
+        if bucket_span_s is None:
+            bucket_span_s = self.opciones_timeseries.get("bucket_span_s") or 0
+        
+        especificacion = {"timeField": "timestamp", "metaField": self.META_FIELD_MEDICIONES}
+        if bucket_span_s:
+            # Bucket fijo: el servidor exige el mismo valor para span y rounding
+            especificacion["bucketMaxSpanSeconds"] = int(bucket_span_s)
+            especificacion["bucketRoundingSeconds"] = int(bucket_span_s)
+        else:
+            especificacion["granularity"] = granularidad
+        return especificacion
+    
+    def _coleccion_existe(self, nombre: str) -> bool:
+        """Consultar el registro de colecciones (se carga la primera vez que hace falta)"""
+        if self._colecciones_existentes is None:
+            self.actualizar_registro_colecciones()
+        # Sin registro disponible se asume que existe: la consulta devuelve vacío si no
+        return self._colecciones_existentes is None or nombre in self._colecciones_existentes
+    
+    def _registrar_coleccion(self, nombre: str):
+        """Marcar una colección como existente después de escribir en ella"""
+        if self._colecciones_existentes is not None:
+            self._colecciones_existentes.add(nombre)
+    
     def desconectar(self):
         """Desconectar de MongoDB Atlas"""
+        self.detener_evaluador_tiempo_real()
+        self.detener_planificador_procesos()
+        self.detener_ejecutor_procesos()
         if self.client:
             self.client.close()
             self.conectado = False
@@ -69,30 +1072,33 @@ class ServicioMongoDBOptimizado:
             sensors_collection.create_index("location.country")
             sensors_collection.create_index("status")
             sensors_collection.create_index([("location.latitude", 1), ("location.longitude", 1)])
+            # Claves de ubicación normalizadas: búsquedas exactas por país/ciudad/zona
+            sensors_collection.create_index([("country_key", 1), ("city_key", 1), ("zone_key", 1)])
+            sensors_collection.create_index([("city_key", 1), ("zone_key", 1)])
+            self.backfill_claves_ubicacion_sensores()
             
             print("   ✅ Colección 'sensors' configurada con índices geográficos")
             
             # 2. MEASUREMENTS - Time Series Collection optimizada
-            try:
-                # Intentar crear Time Series Collection (MongoDB 5.0+)
-                self.db.create_collection(
-                    "measurements",
-                    timeseries={
-                        "timeField": "timestamp",
-                        "metaField": "sensor_id",
-                        "granularity": "minutes"
-                    }
-                )
-                print("   ✅ Time Series Collection 'measurements' creada")
-                print("   🚀 Optimizada para alta ingesta y consultas temporales")
-                
-            except Exception as e:
-                # Fallback a colección normal con índices optimizados
-                measurements_collection = self.db.measurements
-                measurements_collection.create_index([("sensor_id", 1), ("timestamp", -1)])
-                measurements_collection.create_index("timestamp")
-                measurements_collection.create_index("sensor_id")
-                print(f"   ⚠️ Time Series no disponible, usando colección normal: {e}")
+            if "measurements" in self.db.list_collection_names():
+                if self._leer_opciones_timeseries("measurements"):
+                    print("   ✅ Time Series Collection 'measurements' ya existe")
+                else:
+                    # Colección normal existente: se mantiene hasta correr migrar_mediciones_a_timeseries
+                    self._crear_indices_mediciones(self.db.measurements)
+                    print("   ⚠️ 'measurements' es una colección normal; usar la migración a Time Series")
+            else:
+                try:
+                    # Intentar crear Time Series Collection (MongoDB 5.0+)
+                    self.db.create_collection("measurements", timeseries=self._especificacion_timeseries())
+                    self._crear_indices_mediciones(self.db.measurements, timeseries=True)
+                    print("   ✅ Time Series Collection 'measurements' creada")
+                    print("   🚀 Optimizada para alta ingesta y consultas temporales")
+                    
+                except Exception as e:
+                    # Fallback a colección normal con índices optimizados
+                    self._crear_indices_mediciones(self.db.measurements)
+                    print(f"   ⚠️ Time Series no disponible, usando colección normal: {e}")
             
             # 3. ROLES - Colección de roles del sistema
             roles_collection = self.db.roles
@@ -173,8 +1179,65 @@ class ServicioMongoDBOptimizado:
             alerts_collection.create_index("severity")
             alerts_collection.create_index("status")
             alerts_collection.create_index("created_at")
+            # Listado filtrado del tab de alertas: igualdades primero, orden por fecha al final
+            alerts_collection.create_index([("categoria", 1), ("status", 1), ("severity", 1), ("created_at", -1)])
+            alerts_collection.create_index([("status", 1), ("created_at", -1)])
+            # Deduplicación de alertas automáticas: una por medición, parámetro y dirección.
+            # La migración (backfill y colapso de duplicados) corre solo mientras falte el índice.
+            try:
+                filtro_parcial = {"automatic": True, "measurement_ts": {"$type": "date"}}
+                previo = alerts_collection.index_information().get("dedup_alertas_automaticas")
+                if not previo or previo.get("partialFilterExpression") != filtro_parcial:
+                    # Alertas automáticas previas: la clave sale de created_at (era el timestamp de la medición)
+                    alerts_collection.update_many(
+                        {"automatic": True, "measurement_ts": {"$exists": False}, "created_at": {"$ne": None}},
+                        [{"$set": {
+                            "measurement_ts": {"$convert": {"input": "$created_at", "to": "date",
+                                                            "onError": "$created_at", "onNull": None}},
+                            "direction": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$type", ""]}, "regex": "Alta$"}},
+                                                    "alta", "baja"]}
+                        }}]
+                    )
+                    eliminadas = self._colapsar_alertas_duplicadas()
+                    if eliminadas:
+                        print(f"   🧹 {eliminadas} alertas automáticas duplicadas eliminadas (se conserva la más antigua)")
+                    if previo:
+                        # Versión anterior del índice ($exists también indexaba measurement_ts nulos)
+                        alerts_collection.drop_index("dedup_alertas_automaticas")
+                    alerts_collection.create_index(
+                        list(self.CLAVE_DEDUP_ALERTAS),
+                        unique=True,
+                        name="dedup_alertas_automaticas",
+                        partialFilterExpression=filtro_parcial
+                    )
+                self.error_indice_dedup_alertas = None
+            except Exception as e:
+                self.error_indice_dedup_alertas = str(e)
+                print(f"   ⚠️ No se pudo crear el índice de deduplicación de alertas: {e}")
             print("   ✅ Colección 'alerts' configurada")
             
+            # Watermarks de detección incremental: _id = "<sensor_id>:<parámetro>"
+            self.db.alert_watermarks.create_index("sensor_id")
+            
+            # 9. MEASUREMENT_ROLLUPS - Agregados incrementales por sensor/parámetro/bucket
+            rollups_collection = self.db.measurement_rollups
+            rollups_collection.create_index([("sensor_id", 1), ("granularidad", 1), ("parametro", 1), ("bucket", 1)])
+            rollups_collection.create_index([("granularidad", 1), ("bucket", 1)])
+            print("   ✅ Colección 'measurement_rollups' configurada")
+            
+            # 10. MEASUREMENTS_ARCHIVE - Mediciones viejas en buckets por sensor/mes
+            self._asegurar_coleccion_archivo()
+            print(f"   ✅ Colección '{self.COLECCION_ARCHIVO}' configurada")
+            
+            # 11. PROCESSES - Cola persistente del EjecutorProcesos
+            processes_collection = self.db.processes
+            processes_collection.create_index("process_id")
+            processes_collection.create_index([("status", 1), ("priority", -1), ("enqueued_at", 1)])
+            processes_collection.create_index([("status", 1), ("finished_at", -1)])
+            processes_collection.create_index([("schedule.activo", 1), ("schedule.next_run_at", 1)])
+            print("   ✅ Colección 'processes' configurada")
+            
+            self.actualizar_registro_colecciones()
             return True
             
         except Exception as e:
@@ -693,6 +1756,8 @@ class ServicioMongoDBOptimizado:
             print("✅ Índices optimizados para consultas rápidas")
             print("✅ Documentos flexibles para evolución")
             
+            self.actualizar_registro_colecciones()
+            self.umbrales.invalidar()
             return True
             
         except Exception as e:
@@ -701,28 +1766,61 @@ class ServicioMongoDBOptimizado:
             traceback.print_exc()
             return False
     
-    def obtener_estadisticas(self) -> Dict[str, Any]:
-        """Obtener estadísticas de la base de datos"""
+    def obtener_estadisticas(self, usar_cache: bool = True) -> Dict[str, Any]:
+        """
+        Obtener estadísticas de la base de datos.
+        
+        Los totales por colección usan estimated_document_count (metadatos, sin recorrer la
+        colección). Las cifras del día y los estados activos usan conteos exactos sobre campos
+        indexados. El resultado se guarda en memoria durante TTL_CACHE_ESTADISTICAS segundos.
+        """
         if not self.conectado:
-            return {"error": "No conectado"}
+            return {}
+        
+        ahora = time.monotonic()
+        if usar_cache and self._cache_estadisticas and ahora - self._cache_estadisticas[0] < self.TTL_CACHE_ESTADISTICAS:
+            return dict(self._cache_estadisticas[1])
         
         try:
+            inicio_dia = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
             stats = {
                 "database": self.database_name,
-                "sensores": self.db.sensors.count_documents({}),
-                "mediciones": self.db.measurements.count_documents({}),
-                "usuarios": self.db.users.count_documents({}),
-                "cuentas": self.db.accounts.count_documents({}),
-                "facturas": self.db.invoices.count_documents({}),
-                "pagos": self.db.payments.count_documents({}),
-                "alertas": self.db.alerts.count_documents({}),
+                # Totales aproximados (metadatos de la colección)
+                "sensores": self._conteo_estimado(self.db.sensors),
+                "mediciones": self._conteo_estimado(self.db.measurements),
+                "usuarios": self._conteo_estimado(self.db.users),
+                "cuentas": self._conteo_estimado(self.db.accounts),
+                "facturas": self._conteo_estimado(self.db.invoices),
+                "pagos": self._conteo_estimado(self.db.payments),
+                "alertas": self._conteo_estimado(self.db.alerts),
+                "procesos": self._conteo_estimado(self.db.processes),
+                "notificaciones": self._conteo_estimado(self.db.notifications),
+                # Conteos exactos sobre índices
+                "sensores_activos": self.db.sensors.count_documents({"status": {"$in": ["activo", "active"]}}, **self._opciones_tiempo("conteo")),
+                "mediciones_hoy": self.db.measurements.count_documents({"timestamp": {"$gte": inicio_dia}}, **self._opciones_tiempo("conteo")),
+                "alertas_activas": self.db.alerts.count_documents({"status": "active"}, **self._opciones_tiempo("conteo")),
+                "procesos_en_cola": self.db.processes.count_documents({"status": {"$in": ["pending", "queued", "running"]}}, **self._opciones_tiempo("conteo")),
                 "timestamp": datetime.now().isoformat()
             }
             
-            return stats
+            self._cache_estadisticas = (ahora, stats)
+            return dict(stats)
             
         except Exception as e:
-            return {"error": str(e)}
+            print(f"❌ Error obteniendo estadísticas: {e}")
+            return {}
+    
+    @staticmethod
+    def _conteo_estimado(coleccion) -> int:
+        """Conteo por metadatos; las vistas (p. ej. time series) no lo soportan y se cuentan exacto"""
+        try:
+            return coleccion.estimated_document_count()
+        except Exception:
+            return coleccion.count_documents({})
+    
+    def invalidar_cache_estadisticas(self):
+        """Descartar el snapshot de estadísticas para que la próxima lectura vaya a la base"""
+        self._cache_estadisticas = None
     
     def obtener_estado_conexion(self) -> Dict[str, Any]:
         """Obtener estado de la conexión"""
@@ -730,6 +1828,14 @@ class ServicioMongoDBOptimizado:
             "conectado": self.conectado,
             "database": self.database_name,
             "arquitectura": "optimizada",
+            "opciones_cliente": dict(self.opciones_cliente),
+            "max_time_ms": dict(self.max_time_ms),
+            "lectura_analitica": dict(self.lectura_analitica),
+            "timeseries_mediciones": self._timeseries_mediciones,
+            "politica_retencion": dict(self.politica_retencion),
+            "evaluador_tiempo_real": self.evaluador.estado() if self.evaluador else None,
+            "ejecutor_procesos": self.ejecutor.estado() if self.ejecutor else None,
+            "planificador_procesos": self.planificador.estado() if self.planificador else None,
             "timestamp": datetime.now().isoformat()
         }
     
@@ -787,8 +1893,14 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error creando proceso: {e}")
             return False
     
-    def obtener_procesos(self, user_id: str = None, status: str = None) -> List[Dict[str, Any]]:
-        """Obtener procesos"""
+    @staticmethod
+    def _proyeccion(campos: Optional[List[str]]) -> Optional[Dict[str, int]]:
+        """Proyección de MongoDB para los campos pedidos (None devuelve el documento completo)"""
+        return {campo: 1 for campo in campos} if campos else None
+    
+    def obtener_procesos(self, user_id: str = None, status: str = None,
+                         campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Obtener procesos (`campos` limita los campos devueltos)"""
         if not self.conectado:
             return []
         
@@ -799,7 +1911,8 @@ class ServicioMongoDBOptimizado:
             if status:
                 query["status"] = status
             
-            procesos = list(self.db.processes.find(query).sort("created_at", -1))
+            procesos = list(self.db.processes.find(query, self._proyeccion(campos)).sort("created_at", -1)
+                            .max_time_ms(self._limite_tiempo("lectura")))
             
             # Convertir ObjectId a string
             for proceso in procesos:
@@ -832,13 +1945,12 @@ class ServicioMongoDBOptimizado:
             if error is not None:
                 update_data["error"] = error
             
+            update = {"$set": update_data}
             if status == "running":
-                update_data["started_at"] = datetime.now()
+                # $min conserva el started_at de la primera transición a running
+                update["$min"] = {"started_at": datetime.now()}
             
-            result = self.db.processes.update_one(
-                {"process_id": process_id},
-                {"$set": update_data}
-            )
+            result = self.db.processes.update_one({"process_id": process_id}, update)
             
             return result.modified_count > 0
         except Exception as e:
@@ -858,8 +1970,8 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error creando factura: {e}")
             return False
     
-    def obtener_facturas(self, user_id: str = None) -> List[Dict[str, Any]]:
-        """Obtener facturas"""
+    def obtener_facturas(self, user_id: str = None, campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Obtener facturas (`campos` limita los campos devueltos)"""
         if not self.conectado:
             return []
         
@@ -868,7 +1980,8 @@ class ServicioMongoDBOptimizado:
             if user_id:
                 query["user_id"] = user_id
             
-            facturas = list(self.db.invoices.find(query).sort("created_at", -1))
+            facturas = list(self.db.invoices.find(query, self._proyeccion(campos)).sort("created_at", -1)
+                            .max_time_ms(self._limite_tiempo("lectura")))
             
             # Convertir ObjectId a string
             for factura in facturas:
@@ -1102,10 +2215,14 @@ class ServicioMongoDBOptimizado:
             return False
         
         try:
+            sensor_data.update(self._claves_ubicacion(sensor_data.get("location")))
+            
             # Insertar sensor en la colección sensors
             result = self.db.sensors.insert_one(sensor_data)
             
             if result.inserted_id:
+                self._registrar_coleccion('sensors')
+                self.umbrales.invalidar()
                 print(f"✅ Sensor creado exitosamente: {sensor_data.get('name', 'Sin nombre')}")
                 print(f"📊 Sensor ID: {result.inserted_id}")
                 print(f"📊 Datos del sensor: {sensor_data}")
@@ -1126,30 +2243,99 @@ class ServicioMongoDBOptimizado:
             return False
         
         try:
+            if "location" in sensor_data:
+                sensor_data = dict(sensor_data, **self._claves_ubicacion(sensor_data["location"]))
+            self._cache_meta_sensores.pop(sensor_id, None)
+            
             result = self.db.sensors.update_one(
                 {"sensor_id": sensor_id},
                 {"$set": sensor_data}
             )
+            if "location" in sensor_data:
+                self.umbrales.invalidar()
             return result.modified_count > 0
         except Exception as e:
             print(f"❌ Error actualizando sensor: {e}")
             return False
     
-    def obtener_sensores(self) -> List[Dict[str, Any]]:
-        """Obtener todos los sensores"""
+    # --- Claves de ubicación normalizadas ---
+    @staticmethod
+    def _claves_ubicacion(location) -> Dict[str, str]:
+        """Derivar city_key/country_key/zone_key de un location string u objeto"""
+        ciudad, pais, zona = normalize_location(location)
+        return {"city_key": ciudad, "country_key": pais, "zone_key": zona}
+    
+    def backfill_claves_ubicacion_sensores(self, batch_size: int = 500) -> int:
+        """Completar las claves de ubicación de sensores creados antes de que existieran"""
+        if not self.conectado:
+            return 0
+        
+        try:
+            cursor = self.db.sensors.find(
+                {"city_key": {"$exists": False}}, {"location": 1}
+            ).batch_size(batch_size)
+            
+            actualizados = 0
+            for lote in iter(lambda: list(islice(cursor, batch_size)), []):
+                operaciones = [
+                    UpdateOne({"_id": sensor["_id"]}, {"$set": self._claves_ubicacion(sensor.get("location"))})
+                    for sensor in lote
+                ]
+                actualizados += self.db.sensors.bulk_write(operaciones, ordered=False).modified_count
+            
+            if actualizados:
+                print(f"   ✅ Claves de ubicación completadas en {actualizados} sensores")
+            return actualizados
+            
+        except Exception as e:
+            print(f"❌ Error completando claves de ubicación: {e}")
+            return 0
+    
+    @staticmethod
+    def _query_claves_ubicacion(ciudad: str = "", pais: str = "", zona: str = "") -> Dict[str, str]:
+        """Armar el filtro exacto sobre city_key/country_key/zone_key para los valores indicados"""
+        query = {}
+        for campo, valor in (("city_key", ciudad), ("country_key", pais), ("zone_key", zona)):
+            if valor and str(valor).strip():
+                query[campo] = str(valor).strip().lower()
+        return query
+    
+    def buscar_sensor_ids_por_ubicacion(self, ciudad: str = "", pais: str = "", zona: str = "") -> List[str]:
+        """Obtener los sensor_id que coinciden exactamente (sin distinguir mayúsculas) con la ubicación"""
+        return [
+            sensor["sensor_id"]
+            for sensor in self.db.sensors.find(self._query_claves_ubicacion(ciudad, pais, zona),
+                                               {"sensor_id": 1, "_id": 0})
+            if sensor.get("sensor_id")
+        ]
+    
+    def obtener_sensor_por_id(self, sensor_id: str, campos: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Obtener un sensor por su sensor_id (índice único)"""
+        if not self.conectado:
+            return None
+        
+        try:
+            sensor = self.db.sensors.find_one({"sensor_id": sensor_id}, self._proyeccion(campos))
+            if sensor:
+                sensor["_id"] = str(sensor["_id"])
+            return sensor
+        except Exception as e:
+            print(f"❌ Error obteniendo sensor {sensor_id}: {e}")
+            return None
+    
+    def obtener_sensores(self, campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Obtener todos los sensores (`campos` limita los campos devueltos)"""
         if not self.conectado:
             print("❌ MongoDB no conectado para obtener sensores")
             return []
         
         try:
-            # Verificar que la colección existe
-            collections = self.db.list_collection_names()
-            
-            if 'sensors' not in collections:
+            # Verificar que la colección existe (registro en memoria, sin round trip)
+            if not self._coleccion_existe('sensors'):
                 return []
             
             # Realizar la consulta
-            sensores = list(self.db.sensors.find())
+            sensores = list(self.db.sensors.find({}, self._proyeccion(campos)).max_time_ms(self._limite_tiempo("lectura")))
             
             # Convertir ObjectId a string
             for sensor in sensores:
@@ -1181,6 +2367,7 @@ class ServicioMongoDBOptimizado:
             result = self.db.sensors.delete_one({"sensor_id": sensor_id})
             
             if result.deleted_count > 0:
+                self.umbrales.invalidar()
                 print(f"✅ Sensor eliminado exitosamente: {sensor_id}")
                 print(f"📊 Sensor eliminado: {sensor.get('name', 'Sin nombre')}")
                 return True
@@ -1203,10 +2390,14 @@ class ServicioMongoDBOptimizado:
         try:
             print(f"📊 Creando medición para sensor: {medicion_data.get('sensor_id', 'N/A')}")
             
+            self._normalizar_timestamp_medicion(medicion_data)
+            self._agregar_meta_mediciones([medicion_data])
+            
             # Insertar medición en la colección measurements
             result = self.db.measurements.insert_one(medicion_data)
             
             if result.inserted_id:
+                self.actualizar_rollups([medicion_data])
                 print(f"✅ Medición creada exitosamente: {medicion_data.get('sensor_id', 'Sin ID')}")
                 print(f"📊 Valor: {medicion_data.get('value', 'N/A')}")
                 print(f"📊 Timestamp: {medicion_data.get('timestamp', 'N/A')}")
@@ -1221,48 +2412,962 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Detalles del error: {traceback.format_exc()}")
             return False
     
-    def obtener_usuarios(self) -> List[Dict[str, Any]]:
-        """Obtener todos los usuarios"""
+    def insertar_mediciones_lote(self, mediciones: Iterable[Dict[str, Any]], batch_size: int = 1000,
+                                 pausa_entre_lotes: float = 0.0,
+                                 callback_lote: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Insertar mediciones en lotes usando escrituras bulk no ordenadas.
+        
+        El iterable se consume de a un lote: el siguiente lote no se lee hasta que
+        el anterior fue confirmado por el servidor, por lo que un feed grande nunca
+        se acumula completo en memoria. `pausa_entre_lotes` permite frenar la
+        ingesta si el cluster está saturado.
+        
+        Returns:
+            dict: {"lotes": [{"lote", "aceptadas", "rechazadas", "errores"}], "aceptadas", "rechazadas"}
+        """
+        resumen = {"lotes": [], "aceptadas": 0, "rechazadas": 0}
         if not self.conectado:
-            return []
+            print("❌ MongoDB no conectado para insertar mediciones")
+            return resumen
         
+        batch_size = max(1, int(batch_size))
+        iterador = iter(mediciones)
+        numero_lote = 0
+        
+        while True:
+            lote = list(islice(iterador, batch_size))
+            if not lote:
+                break
+            numero_lote += 1
+            
+            for medicion in lote:
+                self._normalizar_timestamp_medicion(medicion)
+            self._agregar_meta_mediciones(lote)
+            aceptadas, rechazadas, errores, fallidas = self._escribir_lote_mediciones(lote)
+            if aceptadas:
+                self.actualizar_rollups(m for i, m in enumerate(lote) if i not in fallidas)
+            estado_lote = {
+                "lote": numero_lote,
+                "aceptadas": aceptadas,
+                "rechazadas": rechazadas,
+                "errores": errores
+            }
+            resumen["lotes"].append(estado_lote)
+            resumen["aceptadas"] += aceptadas
+            resumen["rechazadas"] += rechazadas
+            
+            if callback_lote:
+                callback_lote(estado_lote)
+            if pausa_entre_lotes > 0:
+                time.sleep(pausa_entre_lotes)
+        
+        print(f"✅ Ingesta por lotes: {resumen['aceptadas']} aceptadas, "
+              f"{resumen['rechazadas']} rechazadas en {numero_lote} lotes")
+        return resumen
+    
+    def _normalizar_timestamp_medicion(self, medicion: Dict[str, Any]) -> Dict[str, Any]:
+        """Guardar siempre el timestamp como fecha BSON (convierte strings ISO in-place)"""
+        timestamp = medicion.get("timestamp")
+        if isinstance(timestamp, str):
+            convertido = self._timestamp_a_datetime(timestamp)
+            if convertido is not None:
+                medicion["timestamp"] = convertido
+        return medicion
+    
+    def _meta_sensores(self, sensor_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Documento meta por sensor (sensor_id, claves de ubicación, tipo), cacheado por sensor_id"""
+        faltantes = [s for s in set(sensor_ids) if s and s not in self._cache_meta_sensores]
+        if faltantes:
+            for sensor in self.db.sensors.find({"sensor_id": {"$in": faltantes}},
+                                               {"sensor_id": 1, "location": 1, "type": 1, "_id": 0}):
+                self._cache_meta_sensores[sensor["sensor_id"]] = self._meta_medicion(
+                    sensor["sensor_id"], sensor.get("location"), sensor.get("type"))
+        return self._cache_meta_sensores
+    
+    def _meta_medicion(self, sensor_id: str, location=None, tipo=None) -> Dict[str, Any]:
+        """metaField de una medición: lo que se repite en todas las mediciones de un sensor"""
+        meta = {"sensor_id": sensor_id}
+        meta.update(self._claves_ubicacion(location))
+        meta["type"] = tipo or ""
+        return meta
+    
+    def _agregar_meta_mediciones(self, mediciones: List[Dict[str, Any]]):
+        """Completar el metaField de las mediciones cuando measurements es time series con meta"""
+        if (self._timeseries_mediciones or {}).get("metaField") != self.META_FIELD_MEDICIONES:
+            return
         try:
-            usuarios = list(self.db.users.find())
-            
-            # Convertir ObjectId a string
-            for usuario in usuarios:
-                usuario["_id"] = str(usuario["_id"])
-            
-            return usuarios
+            metas = self._meta_sensores(m.get("sensor_id") for m in mediciones if "meta" not in m)
         except Exception as e:
-            print(f"❌ Error obteniendo usuarios: {e}")
-            return []
+            print(f"⚠️ No se pudo leer la meta de sensores: {e}")
+            metas = {}
+        for medicion in mediciones:
+            if self.META_FIELD_MEDICIONES in medicion:
+                continue
+            sensor_id = medicion.get("sensor_id")
+            # location y sensor_type pasan al meta; sensor_id queda también arriba para las consultas
+            location = medicion.pop("location", None)
+            tipo = medicion.pop("sensor_type", None)
+            medicion[self.META_FIELD_MEDICIONES] = metas.get(sensor_id) or self._meta_medicion(sensor_id, location, tipo)
     
-    def obtener_usuario_por_id(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Obtener un usuario por su ID"""
-        if not self.conectado:
-            return None
+    def _escribir_lote_mediciones(self, lote: List[Dict[str, Any]]):
+        """Escribir un lote con bulk_write no ordenado.
         
+        Devuelve (aceptadas, rechazadas, errores, índices fallidos dentro del lote).
+        """
         try:
-            usuario = self.db.users.find_one({"user_id": user_id})
-            
-            if usuario:
-                # Convertir ObjectId a string
-                usuario["_id"] = str(usuario["_id"])
-                return usuario
-            else:
-                return None
+            result = self.db.measurements.bulk_write(
+                [InsertOne(medicion) for medicion in lote],
+                ordered=False
+            )
+            return result.inserted_count, len(lote) - result.inserted_count, [], set()
+        except BulkWriteError as e:
+            detalles = e.details or {}
+            aceptadas = detalles.get("nInserted", 0)
+            write_errors = detalles.get("writeErrors", [])
+            errores = [err.get("errmsg", "") for err in write_errors[:5]]
+            fallidas = {err.get("index") for err in write_errors}
+            return aceptadas, len(lote) - aceptadas, errores, fallidas
         except Exception as e:
-            print(f"❌ Error obteniendo usuario {user_id}: {e}")
+            print(f"❌ Error escribiendo lote de mediciones: {e}")
+            return 0, len(lote), [str(e)], set(range(len(lote)))
+    
+    # --- Rollups de mediciones ---
+    @staticmethod
+    def _timestamp_a_datetime(timestamp) -> Optional[datetime]:
+        """Convertir un timestamp (datetime o string ISO) a datetime naive en UTC"""
+        if isinstance(timestamp, str):
+            try:
+                timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+            except ValueError:
+                return None
+        if not isinstance(timestamp, datetime):
             return None
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
     
-    def obtener_alertas(self) -> List[Dict[str, Any]]:
-        """Obtener todas las alertas"""
-        if not self.conectado:
+    @staticmethod
+    def _inicio_bucket(timestamp: datetime, granularidad: str) -> datetime:
+        """Truncar un timestamp al inicio de su bucket (hora, día o mes)"""
+        if granularidad == "hora":
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        if granularidad == "dia":
+            return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    
+    def actualizar_rollups(self, mediciones: Iterable[Dict[str, Any]]) -> int:
+        """
+        Incorporar mediciones recién insertadas a measurement_rollups.
+        
+        Las mediciones se combinan primero en memoria por (sensor, parámetro, granularidad,
+        bucket) y luego se aplican con un único bulk_write de upserts ($inc/$min/$max).
+        Devuelve la cantidad de buckets actualizados.
+        """
+        if not self.conectado:
+            return 0
+        
+        deltas = {}
+        for medicion in mediciones:
+            sensor_id = medicion.get("sensor_id")
+            timestamp = self._timestamp_a_datetime(medicion.get("timestamp"))
+            if not sensor_id or timestamp is None:
+                continue
+            
+            for parametro in self.PARAMETROS_ROLLUP:
+                valor = medicion.get(parametro)
+                if not isinstance(valor, (int, float)) or isinstance(valor, bool):
+                    continue
+                for granularidad in self.GRANULARIDADES_ROLLUP:
+                    clave = (sensor_id, parametro, granularidad, self._inicio_bucket(timestamp, granularidad))
+                    delta = deltas.get(clave)
+                    if delta is None:
+                        deltas[clave] = {"count": 1, "sum": valor, "sum_sq": valor * valor, "min": valor, "max": valor}
+                    else:
+                        delta["count"] += 1
+                        delta["sum"] += valor
+                        delta["sum_sq"] += valor * valor
+                        delta["min"] = min(delta["min"], valor)
+                        delta["max"] = max(delta["max"], valor)
+        
+        if not deltas:
+            return 0
+        
+        operaciones = []
+        for (sensor_id, parametro, granularidad, bucket), delta in deltas.items():
+            operaciones.append(UpdateOne(
+                {"_id": {"sensor_id": sensor_id, "parametro": parametro,
+                         "granularidad": granularidad, "bucket": bucket}},
+                {
+                    "$inc": {"count": delta["count"], "sum": delta["sum"], "sum_sq": delta["sum_sq"]},
+                    "$min": {"min": delta["min"]},
+                    "$max": {"max": delta["max"]},
+                    "$setOnInsert": {"sensor_id": sensor_id, "parametro": parametro,
+                                     "granularidad": granularidad, "bucket": bucket}
+                },
+                upsert=True
+            ))
+        
+        try:
+            self.db.measurement_rollups.bulk_write(operaciones, ordered=False)
+            return len(operaciones)
+        except Exception as e:
+            print(f"❌ Error actualizando rollups de mediciones: {e}")
+            return 0
+    
+    def reconstruir_rollups(self, sensor_id: Optional[str] = None) -> Dict[str, int]:
+        """
+        Reconstruir measurement_rollups desde las mediciones crudas (datos históricos).
+        
+        Por cada granularidad se ejecuta una agregación que agrupa por sensor, parámetro y
+        bucket ($dateTrunc) y escribe el resultado con $merge sobre los buckets existentes
+        (sin borrarlos antes, así los lectores nunca ven un hueco). Después se borran los
+        buckets viejos que la reconstrucción no tocó. Mientras dura, los sensores quedan
+        marcados "en_reconstruccion" en migrations y los reportes leen las mediciones crudas;
+        al terminar se marca la cobertura (ver sensores_con_rollups). Conviene ejecutarlo sin
+        ingesta concurrente para los sensores reconstruidos.
+        """
+        resumen = {granularidad: 0 for granularidad in self.GRANULARIDADES_ROLLUP}
+        if not self.conectado:
+            return resumen
+        
+        marca = datetime.now()
+        clave = sensor_id or "*"
+        try:
+            filtro = {"sensor_id": sensor_id} if sensor_id else {}
+            self.db.migrations.update_one({"_id": "measurement_rollups"},
+                                          {"$addToSet": {"en_reconstruccion": clave}}, upsert=True)
+            
+            for granularidad, unidad in self.GRANULARIDADES_ROLLUP.items():
+                match = filtro or {"sensor_id": {"$ne": None}}
+                pipeline = [
+                    {"$match": match},
+                    *self._union_archivo(match, self._filtro_buckets(filtro)),
+                    {"$project": {
+                        "sensor_id": 1,
+                        "ts": {"$toDate": "$timestamp"},
+                        "valores": [{"p": parametro, "v": f"${parametro}"} for parametro in self.PARAMETROS_ROLLUP]
+                    }},
+                    {"$unwind": "$valores"},
+                    {"$match": {"ts": {"$ne": None}, "valores.v": {"$type": "number"}}},
+                    {"$group": {
+                        "_id": {
+                            "sensor_id": "$sensor_id",
+                            "parametro": "$valores.p",
+                            "granularidad": granularidad,
+                            "bucket": {"$dateTrunc": {"date": "$ts", "unit": unidad}}
+                        },
+                        "count": {"$sum": 1},
+                        "sum": {"$sum": "$valores.v"},
+                        "sum_sq": {"$sum": {"$multiply": ["$valores.v", "$valores.v"]}},
+                        "min": {"$min": "$valores.v"},
+                        "max": {"$max": "$valores.v"}
+                    }},
+                    {"$addFields": {
+                        "sensor_id": "$_id.sensor_id",
+                        "parametro": "$_id.parametro",
+                        "granularidad": "$_id.granularidad",
+                        "bucket": "$_id.bucket",
+                        "reconstruido_en": marca
+                    }},
+                    {"$merge": {"into": "measurement_rollups", "on": "_id",
+                                "whenMatched": "replace", "whenNotMatched": "insert"}}
+                ]
+                self.db.measurements.aggregate(pipeline, allowDiskUse=True)
+                
+                # Buckets sin mediciones que los respalden; los del bucket en curso los mantiene la ingesta
+                self.db.measurement_rollups.delete_many(dict(
+                    filtro, granularidad=granularidad, reconstruido_en={"$ne": marca},
+                    bucket={"$lt": self._inicio_bucket(marca, granularidad)}
+                ))
+                resumen[granularidad] = self.db.measurement_rollups.count_documents(
+                    dict(filtro, granularidad=granularidad)
+                )
+            
+            if sensor_id:
+                cobertura = {"$addToSet": {"sensores": sensor_id}, "$pull": {"en_reconstruccion": clave}}
+            else:
+                cobertura = {"$set": {"completo": marca}, "$unset": {"sensores": ""},
+                             "$pull": {"en_reconstruccion": clave}}
+            self.db.migrations.update_one({"_id": "measurement_rollups"}, cobertura, upsert=True)
+            
+            print(f"✅ Rollups reconstruidos: {resumen}")
+            return resumen
+            
+        except Exception as e:
+            # La marca "en_reconstruccion" queda puesta: los reportes siguen leyendo crudo hasta reintentar
+            print(f"❌ Error reconstruyendo rollups: {e}")
+            return resumen
+    
+    def sensores_con_rollups(self, sensor_ids: List[str]) -> set:
+        """
+        Subconjunto de sensor_ids cuyos rollups cubren todo su historial.
+        
+        Los rollups se mantienen en la ingesta, pero las mediciones anteriores solo quedan
+        cubiertas después de reconstruir_rollups (global o de ese sensor). Un sensor con una
+        reconstrucción en curso o fallida no cuenta como cubierto.
+        """
+        if not self.conectado or not sensor_ids:
+            return set()
+        
+        try:
+            estado = self.db.migrations.find_one({"_id": "measurement_rollups"}) or {}
+            en_reconstruccion = set(estado.get("en_reconstruccion", []))
+            if "*" in en_reconstruccion:
+                return set()
+            cubiertos = set(sensor_ids) if estado.get("completo") else set(sensor_ids) & set(estado.get("sensores", []))
+            return cubiertos - en_reconstruccion
+        except Exception as e:
+            print(f"❌ Error leyendo cobertura de rollups: {e}")
+            return set()
+    
+    def obtener_rollups(self, sensor_ids: List[str], granularidad: str, fecha_inicio=None, fecha_fin=None,
+                        parametros: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Obtener buckets pre-agregados combinando los sensores indicados.
+        
+        Returns:
+            list: [{"bucket", "parametro", "count", "sum", "sum_sq", "min", "max", "sensores"}]
+            ordenados por bucket.
+        """
+        if not self.conectado or not sensor_ids:
+            return []
+        
+        try:
+            match = {
+                "sensor_id": {"$in": sensor_ids},
+                "granularidad": granularidad,
+                "parametro": {"$in": list(parametros or self.PARAMETROS_ROLLUP)}
+            }
+            rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
+            if rango:
+                match["bucket"] = rango
+            
+            pipeline = [
+                {"$match": match},
+                {"$group": {
+                    "_id": {"bucket": "$bucket", "parametro": "$parametro"},
+                    "count": {"$sum": "$count"},
+                    "sum": {"$sum": "$sum"},
+                    "sum_sq": {"$sum": "$sum_sq"},
+                    "min": {"$min": "$min"},
+                    "max": {"$max": "$max"},
+                    "sensores": {"$addToSet": "$sensor_id"}
+                }},
+                {"$sort": {"_id.bucket": 1}},
+                {"$project": {
+                    "_id": 0, "bucket": "$_id.bucket", "parametro": "$_id.parametro",
+                    "count": 1, "sum": 1, "sum_sq": 1, "min": 1, "max": 1, "sensores": 1
+                }}
+            ]
+            return list(self.db_analitica.measurement_rollups.aggregate(pipeline, **self._opciones_tiempo("agregacion")))
+            
+        except Exception as e:
+            print(f"❌ Error obteniendo rollups: {e}")
+            return []
+    
+    # --- Migración a Time Series ---
+    @staticmethod
+    def _crear_indices_mediciones(coleccion, timeseries: bool = False):
+        """Índices de measurements (en time series también sobre los campos del meta)"""
+        coleccion.create_index([("sensor_id", 1), ("timestamp", -1)])
+        if timeseries:
+            coleccion.create_index([("meta.sensor_id", 1), ("timestamp", -1)])
+            coleccion.create_index([("meta.country_key", 1), ("meta.city_key", 1), ("timestamp", -1)])
+        else:
+            coleccion.create_index("timestamp")
+            coleccion.create_index("sensor_id")
+    
+    def migrar_mediciones_a_timeseries(self, granularidad: Optional[str] = None,
+                                       bucket_span_s: Optional[int] = None, batch_size: int = 1000,
+                                       reiniciar: bool = False, reemplazar: bool = False,
+                                       callback_lote: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Copiar una colección measurements normal a una Time Series configurada (measurements_ts).
+        
+        Cada medición se copia con meta = {sensor_id, city_key, country_key, zone_key, type}
+        tomado del sensor (location y sensor_type dejan de repetirse en cada documento).
+        Se recorre por _id ascendente con checkpoint en migrations después de cada lote para
+        poder retomar. Con reemplazar=True, si los conteos coinciden, measurements se renombra
+        a measurements_plain_<fecha> (respaldo) y se crea en su lugar una Time Series vacía a la
+        que se copian measurements_ts y lo insertado mientras tanto (el servidor no permite
+        renombrar Time Series). Ese reemplazo también se retoma desde su checkpoint.
+        
+        Returns:
+            dict: {"copiadas", "lotes", "completada", "reemplazada", "verificacion"}
+        """
+        resumen = {"copiadas": 0, "lotes": 0, "completada": False, "reemplazada": False, "verificacion": None}
+        if not self.conectado:
+            return resumen
+        
+        migracion_id = "measurements_timeseries"
+        destino = "measurements_ts"
+        batch_size = max(1, int(batch_size))
+        
+        try:
+            if (self.db.migrations.find_one({"_id": migracion_id}) or {}).get("fase") == "reemplazo":
+                # Un reemplazo cortado a mitad de la copia: se retoma
+                resumen["reemplazada"] = self._reemplazar_mediciones_por_timeseries(
+                    destino, migracion_id, None, granularidad, bucket_span_s, batch_size)
+                resumen["completada"] = resumen["reemplazada"]
+                return resumen
+            
+            if self._leer_opciones_timeseries("measurements"):
+                print("ℹ️ 'measurements' ya es una Time Series Collection, no hay nada que migrar")
+                resumen["completada"] = True
+                return resumen
+            
+            if reiniciar:
+                self.db.migrations.delete_one({"_id": migracion_id})
+                self.db.drop_collection(destino)
+            
+            checkpoint = self.db.migrations.find_one({"_id": migracion_id}) or {}
+            if destino not in self.db.list_collection_names():
+                especificacion = self._especificacion_timeseries(granularidad, bucket_span_s)
+                self.db.create_collection(destino, timeseries=especificacion)
+                self._crear_indices_mediciones(self.db[destino], timeseries=True)
+                checkpoint = {}
+                print(f"✅ Colección '{destino}' creada: {especificacion}")
+            
+            ultimo_id = checkpoint.get("ultimo_id")
+            resumen["copiadas"] = checkpoint.get("copiadas", 0)
+            
+            while True:
+                query = {"_id": {"$gt": ultimo_id}} if ultimo_id is not None else {}
+                lote = list(self.db.measurements.find(query).sort("_id", 1).limit(batch_size))
+                if not lote:
+                    break
+                
+                documentos = self._mediciones_a_timeseries(lote)
+                if documentos:
+                    result = self.db[destino].insert_many(documentos, ordered=False)
+                    resumen["copiadas"] += len(result.inserted_ids)
+                
+                # Si se corta entre la escritura y el checkpoint, el último lote puede duplicarse:
+                # la verificación compara conteos antes de reemplazar
+                ultimo_id = lote[-1]["_id"]
+                resumen["lotes"] += 1
+                self.db.migrations.update_one(
+                    {"_id": migracion_id},
+                    {"$set": {"ultimo_id": ultimo_id, "copiadas": resumen["copiadas"],
+                              "completada": False, "updated_at": datetime.now()}},
+                    upsert=True
+                )
+                
+                if callback_lote:
+                    callback_lote(dict(resumen))
+            
+            self.db.migrations.update_one(
+                {"_id": migracion_id},
+                {"$set": {"completada": True, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            resumen["completada"] = True
+            resumen["verificacion"] = self.verificar_migracion_timeseries("measurements", destino)
+            
+            if reemplazar:
+                if resumen["verificacion"].get("conteos_coinciden"):
+                    resumen["reemplazada"] = self._reemplazar_mediciones_por_timeseries(
+                        destino, migracion_id, ultimo_id, granularidad, bucket_span_s, batch_size)
+                else:
+                    print("⚠️ Los conteos no coinciden, no se reemplaza 'measurements'")
+            
+            print(f"✅ Migración a Time Series completada: {resumen['copiadas']} mediciones copiadas")
+            return resumen
+            
+        except Exception as e:
+            print(f"❌ Error migrando measurements a Time Series (se puede retomar): {e}")
+            return resumen
+    
+    def _mediciones_a_timeseries(self, lote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Mediciones de la colección normal con el meta de la Time Series (sin location/sensor_type)"""
+        metas = self._meta_sensores(m.get("sensor_id") for m in lote)
+        documentos = []
+        for medicion in lote:
+            self._normalizar_timestamp_medicion(medicion)
+            if not isinstance(medicion.get("timestamp"), datetime):
+                # Sin timeField válido el servidor rechaza el documento
+                continue
+            sensor_id = medicion.get("sensor_id")
+            location = medicion.pop("location", None)
+            tipo = medicion.pop("sensor_type", None)
+            medicion[self.META_FIELD_MEDICIONES] = metas.get(sensor_id) or self._meta_medicion(sensor_id, location, tipo)
+            documentos.append(medicion)
+        return documentos
+    
+    def _reemplazar_mediciones_por_timeseries(self, destino: str, migracion_id: str, ultimo_origen,
+                                              granularidad: Optional[str], bucket_span_s: Optional[int],
+                                              batch_size: int) -> bool:
+        """
+        Poner una Time Series bajo el nombre measurements: el original pasa a respaldo, se crea la
+        Time Series directamente como measurements y se copian measurements_ts y el delta del
+        respaldo (lo insertado después del último lote migrado). Si no se puede crear, se revierte.
+        """
+        estado = self.db.migrations.find_one({"_id": migracion_id}) or {}
+        if estado.get("fase") != "reemplazo":
+            respaldo = f"measurements_plain_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            self.db.measurements.rename(respaldo)
+            self.db.migrations.update_one(
+                {"_id": migracion_id},
+                {"$set": {"fase": "reemplazo", "respaldo": respaldo, "ultimo_origen": ultimo_origen,
+                          "copiado_destino": None, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            try:
+                self.db.create_collection("measurements",
+                                          timeseries=self._especificacion_timeseries(granularidad, bucket_span_s))
+            except Exception as e:
+                # Un insert pudo crear measurements como colección normal en el intervalo: se
+                # pasa al respaldo y el original vuelve a su nombre
+                if "measurements" in self.db.list_collection_names():
+                    intermedias = list(self.db.measurements.find())
+                    if intermedias:
+                        self.db[respaldo].insert_many(intermedias, ordered=False)
+                    self.db.drop_collection("measurements")
+                self.db[respaldo].rename("measurements")
+                self.db.migrations.update_one({"_id": migracion_id},
+                                              {"$unset": {"fase": "", "respaldo": "", "ultimo_origen": "",
+                                                          "copiado_destino": ""}})
+                print(f"❌ No se pudo crear 'measurements' como Time Series, se restauró el original: {e}")
+                return False
+            self._crear_indices_mediciones(self.db.measurements, timeseries=True)
+            self.actualizar_registro_colecciones()
+            estado = self.db.migrations.find_one({"_id": migracion_id})
+        
+        respaldo = estado["respaldo"]
+        # Lo ya migrado (measurements_ts) y después lo que entró al original durante la migración
+        for origen, campo, transformar in ((destino, "copiado_destino", False), (respaldo, "ultimo_origen", True)):
+            ultimo = estado.get(campo)
+            while True:
+                query = {"_id": {"$gt": ultimo}} if ultimo is not None else {}
+                lote = list(self.db[origen].find(query).sort("_id", 1).limit(batch_size).allow_disk_use(True))
+                if not lote:
+                    break
+                documentos = self._mediciones_a_timeseries(lote) if transformar else lote
+                if documentos:
+                    self.db.measurements.insert_many(documentos, ordered=False)
+                ultimo = lote[-1]["_id"]
+                self.db.migrations.update_one({"_id": migracion_id},
+                                              {"$set": {campo: ultimo, "updated_at": datetime.now()}})
+        
+        self.db.drop_collection(destino)
+        self.db.migrations.delete_one({"_id": migracion_id})
+        self.actualizar_registro_colecciones()
+        print(f"✅ 'measurements' reemplazada por la Time Series (respaldo en '{respaldo}')")
+        return True
+    
+    def _stats_coleccion(self, nombre: str) -> Dict[str, Any]:
+        """Conteo y tamaños en disco de una colección (vale para normales y time series)"""
+        stats = next(self.db[nombre].aggregate([{"$collStats": {"storageStats": {}}}]), {})
+        storage = stats.get("storageStats", {})
+        return {
+            "documentos": self.db[nombre].count_documents({}, **self._opciones_tiempo("conteo")),
+            "storage_bytes": storage.get("storageSize", 0),
+            "indices_bytes": storage.get("totalIndexSize", 0)
+        }
+    
+    def _latencia_consultas(self, nombre: str, sensor_ids: List[str], campo_sensor: str,
+                            repeticiones: int = 3) -> Dict[str, float]:
+        """Latencia media (ms) de las consultas típicas de reportes sobre una colección"""
+        desde = datetime.now() - timedelta(days=30)
+        coleccion = self.db[nombre]
+        consultas = {
+            "rango_sensor": lambda sid: list(coleccion.find(
+                {campo_sensor: sid, "timestamp": {"$gte": desde}}).sort("timestamp", -1)),
+            "promedio_diario": lambda sid: list(coleccion.aggregate([
+                {"$match": {campo_sensor: sid, "timestamp": {"$gte": desde}}},
+                {"$group": {"_id": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}},
+                            "temperatura": {"$avg": "$temperature"}}}
+            ]))
+        }
+        
+        latencias = {}
+        for nombre_consulta, consulta in consultas.items():
+            tiempos = []
+            for _ in range(repeticiones):
+                for sensor_id in sensor_ids:
+                    inicio = time.perf_counter()
+                    consulta(sensor_id)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+            latencias[nombre_consulta] = round(sum(tiempos) / len(tiempos), 2) if tiempos else 0.0
+        return latencias
+    
+    def verificar_migracion_timeseries(self, origen: str = "measurements", destino: str = "measurements_ts",
+                                       muestra_sensores: int = 5) -> Dict[str, Any]:
+        """
+        Informe antes/después de la migración: conteos, tamaño en disco y latencia de consultas.
+        
+        Returns:
+            dict: {"origen": {...}, "destino": {...}, "conteos_coinciden", "reduccion_storage_pct"}
+        """
+        if not self.conectado:
+            return {}
+        
+        try:
+            sensor_ids = [s["sensor_id"] for s in self.db.sensors.find({}, {"sensor_id": 1, "_id": 0})
+                          .limit(max(1, int(muestra_sensores)))]
+            informe = {}
+            for clave, nombre in (("origen", origen), ("destino", destino)):
+                # En la time series el sensor se filtra por el meta (donde queda agrupado por bucket)
+                campo_sensor = "meta.sensor_id" if self._leer_opciones_timeseries(nombre) else "sensor_id"
+                informe[clave] = self._stats_coleccion(nombre)
+                informe[clave]["coleccion"] = nombre
+                informe[clave]["latencia_ms"] = self._latencia_consultas(nombre, sensor_ids, campo_sensor)
+            
+            storage_origen = informe["origen"]["storage_bytes"]
+            informe["conteos_coinciden"] = informe["origen"]["documentos"] == informe["destino"]["documentos"]
+            informe["reduccion_storage_pct"] = (
+                round(100 * (1 - informe["destino"]["storage_bytes"] / storage_origen), 1)
+                if storage_origen else 0.0
+            )
+            
+            print(f"📊 Verificación Time Series: {informe['origen']['documentos']} → "
+                  f"{informe['destino']['documentos']} documentos, "
+                  f"{informe['reduccion_storage_pct']}% menos almacenamiento")
+            return informe
+            
+        except Exception as e:
+            print(f"❌ Error verificando migración a Time Series: {e}")
+            return {}
+    
+    # --- Retención y archivo frío ---
+    def _dias_retencion(self, tipo_sensor: Optional[str]) -> int:
+        """Días de retención en caliente para un tipo de sensor"""
+        dias = self.politica_retencion.get("dias_por_tipo", {}).get(tipo_sensor)
+        return int(dias or self.politica_retencion.get("dias_por_defecto") or 365)
+    
+    def _asegurar_coleccion_archivo(self):
+        """Crear measurements_archive (zstd) con sus índices si no existe"""
+        if not self._coleccion_existe(self.COLECCION_ARCHIVO):
+            try:
+                self.db.create_collection(
+                    self.COLECCION_ARCHIVO,
+                    storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+                )
+            except Exception as e:
+                # Ya existe o el cluster no admite el compresor: se usa la configuración por defecto
+                print(f"⚠️ '{self.COLECCION_ARCHIVO}' sin compresor zstd propio: {e}")
+            self._registrar_coleccion(self.COLECCION_ARCHIVO)
+        archivo = self.db[self.COLECCION_ARCHIVO]
+        archivo.create_index([("sensor_id", 1), ("desde", 1), ("hasta", 1)])
+        archivo.create_index([("sensor_name", 1), ("desde", 1)])
+    
+    @staticmethod
+    def _filtro_buckets(filtro_sensor: Optional[Dict[str, Any]] = None, desde=None, hasta=None) -> Dict[str, Any]:
+        """Filtro sobre los buckets del archivo: sensor y solapamiento con el rango pedido"""
+        filtro = {}
+        for campo in ("sensor_id", "sensor_name"):
+            if filtro_sensor and campo in filtro_sensor:
+                filtro[campo] = filtro_sensor[campo]
+        if desde is not None:
+            filtro["hasta"] = {"$gte": desde}
+        if hasta is not None:
+            filtro["desde"] = {"$lte": hasta}
+        return filtro
+    
+    def _cruza_archivo(self, desde=None) -> bool:
+        """True si un rango que empieza en `desde` (None = todo el historial) alcanza el archivo"""
+        if time.monotonic() - self._archivado_leido >= self.TTL_CORTE_ARCHIVO:
+            # El corte se publica antes de borrar, así que releerlo alcanza para no perder mediciones
+            try:
+                estado = self.db.migrations.find_one({"_id": "measurements_archive"}, {"archivado_hasta": 1}) or {}
+                self._archivado_hasta = estado.get("archivado_hasta")
+                self._archivado_leido = time.monotonic()
+            except Exception as e:
+                print(f"⚠️ No se pudo releer el corte del archivo: {e}")
+        if self._archivado_hasta is None:
+            return False
+        return desde is None or desde < self._archivado_hasta
+    
+    def _union_archivo(self, match: Dict[str, Any], filtro_buckets: Dict[str, Any],
+                       desde=None) -> List[Dict[str, Any]]:
+        """Etapa $unionWith que desarma los buckets del archivo y aplica el mismo $match"""
+        if not self._cruza_archivo(desde):
             return []
+        return [{"$unionWith": {"coll": self.COLECCION_ARCHIVO, "pipeline": [
+            {"$match": filtro_buckets},
+            {"$unwind": "$puntos"},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": [
+                "$puntos", {"sensor_id": "$sensor_id", "sensor_name": "$sensor_name"}
+            ]}}},
+            {"$match": match}
+        ]}}]
+    
+    def _cursor_mediciones(self, query: Dict[str, Any], orden: int = -1, campos: Optional[List[str]] = None,
+                           incluir_archivo: bool = True, batch_size: Optional[int] = None,
+                           max_time_ms: Optional[int] = None):
+        """
+        Cursor de mediciones ordenado por timestamp que lee también el archivo cuando el rango
+        de la consulta empieza antes del último corte archivado.
+        """
+        rango = query.get("timestamp")
+        desde = rango.get("$gte") if isinstance(rango, dict) else None
+        hasta = (rango.get("$lte") or rango.get("$lt")) if isinstance(rango, dict) else None
+        
+        if not incluir_archivo or not self._cruza_archivo(desde):
+            cursor = self.db_analitica.measurements.find(query, self._proyeccion(campos)).sort("timestamp", orden)
+            if batch_size:
+                cursor = cursor.batch_size(batch_size)
+            return cursor.max_time_ms(max_time_ms)
+        
+        pipeline = [
+            {"$match": query},
+            *self._union_archivo(query, self._filtro_buckets(query, desde, hasta), desde),
+            {"$sort": {"timestamp": orden}}
+        ]
+        if campos:
+            pipeline.append({"$project": self._proyeccion(campos)})
+        opciones = {"allowDiskUse": True}
+        if batch_size:
+            opciones["batchSize"] = batch_size
+        if max_time_ms:
+            opciones["maxTimeMS"] = max_time_ms
+        return self.db_analitica.measurements.aggregate(pipeline, **opciones)
+    
+    def archivar_mediciones_antiguas(self, batch_size: int = 5000,
+                                     callback_lote: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Mover a measurements_archive las mediciones crudas más viejas que la retención de su tipo.
+        
+        Por sensor se leen lotes ordenados por timestamp anteriores al corte, se descartan los
+        puntos que ya están en el archivo (un lote interrumpido entre la escritura y el borrado)
+        y el resto se agrupa por mes en buckets de a lo sumo PUNTOS_POR_BUCKET_ARCHIVO puntos,
+        escritos con ReplaceOne upsert (_id según su primer punto) antes de borrar los
+        originales. Los rollups no se tocan: los reportes agregados siguen cubriendo todo el
+        historial. Sobre una Time Series el borrado por _id requiere MongoDB 7.0+.
+        
+        Returns:
+            dict: {"archivadas", "buckets", "sensores", "completada"}
+        """
+        resumen = {"archivadas": 0, "buckets": 0, "sensores": 0, "completada": False}
+        if not self.conectado:
+            return resumen
+        
+        batch_size = max(1, int(batch_size))
+        ahora = datetime.now()
+        
+        try:
+            self._asegurar_coleccion_archivo()
+            sensores = list(self.db.sensors.find({}, {"sensor_id": 1, "type": 1, "_id": 0}))
+            
+            for sensor in sensores:
+                sensor_id = sensor.get("sensor_id")
+                if not sensor_id:
+                    continue
+                corte = ahora - timedelta(days=self._dias_retencion(sensor.get("type")))
+                archivadas_sensor = 0
+                
+                while True:
+                    lote = list(self.db.measurements.find({"sensor_id": sensor_id, "timestamp": {"$lt": corte}})
+                                .sort([("timestamp", 1), ("_id", 1)]).limit(batch_size))
+                    if not lote:
+                        break
+                    
+                    if archivadas_sensor == 0:
+                        # El corte se publica antes de borrar: las lecturas ya pasan por el archivo
+                        self._registrar_corte_archivo(corte)
+                    
+                    # Puntos ya archivados por una corrida interrumpida: solo se borran
+                    archivados = set()
+                    for bucket in self.db[self.COLECCION_ARCHIVO].find(
+                        {"sensor_id": sensor_id, "desde": {"$lte": lote[-1]["timestamp"]},
+                         "hasta": {"$gte": lote[0]["timestamp"]}},
+                        {"puntos._id": 1}
+                    ):
+                        archivados.update(punto.get("_id") for punto in bucket.get("puntos", []))
+                    
+                    buckets = {}
+                    for medicion in lote:
+                        if medicion["_id"] in archivados:
+                            continue
+                        mes = medicion["timestamp"].replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                        buckets.setdefault(mes, []).append(medicion)
+                    
+                    operaciones = []
+                    for mes, puntos_mes in buckets.items():
+                        for inicio in range(0, len(puntos_mes), self.PUNTOS_POR_BUCKET_ARCHIVO):
+                            puntos = puntos_mes[inicio:inicio + self.PUNTOS_POR_BUCKET_ARCHIVO]
+                            operaciones.append(ReplaceOne(
+                                {"_id": f"{sensor_id}:{mes:%Y-%m}:{puntos[0]['_id']}"},
+                                {
+                                    "sensor_id": sensor_id,
+                                    "sensor_name": puntos[0].get("sensor_name"),
+                                    "mes": mes,
+                                    "desde": puntos[0]["timestamp"],
+                                    "hasta": puntos[-1]["timestamp"],
+                                    "count": len(puntos),
+                                    # Lo que se repite por sensor no se guarda en cada punto
+                                    "puntos": [
+                                        {k: v for k, v in punto.items()
+                                         if k not in ("sensor_id", "sensor_name", "location", "sensor_type",
+                                                      self.META_FIELD_MEDICIONES)}
+                                        for punto in puntos
+                                    ],
+                                    "archived_at": ahora
+                                },
+                                upsert=True
+                            ))
+                    
+                    if operaciones:
+                        self.db[self.COLECCION_ARCHIVO].bulk_write(operaciones, ordered=False)
+                    self.db.measurements.delete_many({"_id": {"$in": [m["_id"] for m in lote]}})
+                    
+                    archivadas_sensor += len(lote)
+                    resumen["archivadas"] += len(lote)
+                    resumen["buckets"] += len(operaciones)
+                    if callback_lote:
+                        callback_lote(dict(resumen, sensor_id=sensor_id))
+                
+                if archivadas_sensor:
+                    resumen["sensores"] += 1
+            
+            resumen["completada"] = True
+            self.invalidar_cache_estadisticas()
+            print(f"✅ Archivo de mediciones: {resumen['archivadas']} mediciones en "
+                  f"{resumen['buckets']} buckets ({resumen['sensores']} sensores)")
+            return resumen
+            
+        except Exception as e:
+            print(f"❌ Error archivando mediciones (se puede reintentar): {e}")
+            return resumen
+    
+    def _registrar_corte_archivo(self, corte: datetime):
+        """Guardar el corte archivado más reciente (solo avanza)"""
+        self.db.migrations.update_one(
+            {"_id": "measurements_archive"},
+            {"$max": {"archivado_hasta": corte}, "$set": {"updated_at": datetime.now()}},
+            upsert=True
+        )
+        if self._archivado_hasta is None or corte > self._archivado_hasta:
+            self._archivado_hasta = corte
+    
+    # --- Migración de timestamps ---
+    def migrar_timestamps_mediciones(self, batch_size: int = 1000, reiniciar: bool = False,
+                                     callback_lote: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Convertir in-place los timestamps string (ISO) de measurements a fechas BSON.
+        
+        Recorre las mediciones por _id ascendente en lotes y guarda un checkpoint en la
+        colección migrations después de cada lote, de modo que si se interrumpe se retoma
+        desde el último lote confirmado. Los timestamps que no se pueden parsear se cuentan
+        y se dejan sin cambios.
+        
+        Returns:
+            dict: {"convertidas", "invalidas", "lotes", "completada"}
+        """
+        resumen = {"convertidas": 0, "invalidas": 0, "lotes": 0, "completada": False}
+        if not self.conectado:
+            return resumen
+        
+        migracion_id = "measurements_timestamp_bson"
+        batch_size = max(1, int(batch_size))
         
         try:
-            alertas = list(self.db.alerts.find())
+            if reiniciar:
+                self.db.migrations.delete_one({"_id": migracion_id})
+            
+            checkpoint = self.db.migrations.find_one({"_id": migracion_id}) or {}
+            if checkpoint.get("completada") and not reiniciar:
+                # Puede haber strings nuevos escritos por clientes viejos: se vuelve a recorrer
+                checkpoint = {}
+            ultimo_id = checkpoint.get("ultimo_id")
+            resumen["convertidas"] = checkpoint.get("convertidas", 0)
+            resumen["invalidas"] = checkpoint.get("invalidas", 0)
+            
+            while True:
+                query = {"timestamp": {"$type": "string"}}
+                if ultimo_id is not None:
+                    query["_id"] = {"$gt": ultimo_id}
+                
+                lote = list(self.db.measurements.find(query, {"timestamp": 1})
+                            .sort("_id", 1).limit(batch_size))
+                if not lote:
+                    break
+                
+                operaciones = []
+                for medicion in lote:
+                    timestamp = self._timestamp_a_datetime(medicion["timestamp"])
+                    if timestamp is None:
+                        resumen["invalidas"] += 1
+                        continue
+                    # El filtro por tipo evita pisar un valor actualizado entre la lectura y la escritura
+                    operaciones.append(UpdateOne(
+                        {"_id": medicion["_id"], "timestamp": medicion["timestamp"]},
+                        {"$set": {"timestamp": timestamp}}
+                    ))
+                
+                if operaciones:
+                    result = self.db.measurements.bulk_write(operaciones, ordered=False)
+                    resumen["convertidas"] += result.modified_count
+                
+                ultimo_id = lote[-1]["_id"]
+                resumen["lotes"] += 1
+                self.db.migrations.update_one(
+                    {"_id": migracion_id},
+                    {"$set": {"ultimo_id": ultimo_id, "convertidas": resumen["convertidas"],
+                              "invalidas": resumen["invalidas"], "completada": False,
+                              "updated_at": datetime.now()}},
+                    upsert=True
+                )
+                
+                if callback_lote:
+                    callback_lote(dict(resumen))
+            
+            self.db.migrations.update_one(
+                {"_id": migracion_id},
+                {"$set": {"completada": True, "ultimo_id": None, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            resumen["completada"] = True
+            print(f"✅ Migración de timestamps completada: {resumen['convertidas']} convertidas, "
+                  f"{resumen['invalidas']} inválidas")
+            return resumen
+            
+        except Exception as e:
+            print(f"❌ Error migrando timestamps de mediciones (se puede retomar): {e}")
+            return resumen
+    
+    def obtener_usuarios(self, campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Obtener todos los usuarios (`campos` limita los campos devueltos)"""
+        if not self.conectado:
+            return []
+        
+        try:
+            usuarios = list(self.db.users.find({}, self._proyeccion(campos)).max_time_ms(self._limite_tiempo("lectura")))
+            
+            # Convertir ObjectId a string
+            for usuario in usuarios:
+                usuario["_id"] = str(usuario["_id"])
+            
+            return usuarios
+        except Exception as e:
+            print(f"❌ Error obteniendo usuarios: {e}")
+            return []
+    
+    def obtener_usuario_por_id(self, user_id: str, campos: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Obtener un usuario por su ID"""
+        if not self.conectado:
+            return None
+        
+        try:
+            usuario = self.db.users.find_one({"user_id": user_id}, self._proyeccion(campos))
+            
+            if usuario:
+                # Convertir ObjectId a string
+                usuario["_id"] = str(usuario["_id"])
+                return usuario
+            else:
+                return None
+        except Exception as e:
+            print(f"❌ Error obteniendo usuario {user_id}: {e}")
+            return None
+    
+    def obtener_alertas(self, campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Obtener todas las alertas (`campos` limita los campos devueltos)"""
+        if not self.conectado:
+            return []
+        
+        try:
+            alertas = list(self.db.alerts.find({}, self._proyeccion(campos)).max_time_ms(self._limite_tiempo("lectura")))
             
             # Convertir ObjectId a string
             for alerta in alertas:
@@ -1273,26 +3378,671 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error obteniendo alertas: {e}")
             return []
     
-    def crear_alerta(self, alerta_data: Dict[str, Any]) -> bool:
-        """Crear nueva alerta"""
+    def _query_alertas(self, categoria: Optional[str] = None, status: Optional[str] = None,
+                       severity: Optional[str] = None, desde=None, hasta=None) -> Dict[str, Any]:
+        """Armar el filtro de alertas; None en un criterio significa 'todas'"""
+        query = {}
+        if categoria:
+            # Las alertas sin categoría se muestran como alertas de sensor
+            query["categoria"] = {"$in": ["Sensor", None]} if categoria == "Sensor" else categoria
+        if status:
+            query["status"] = status
+        if severity:
+            query["severity"] = severity
+        
+        if desde is not None or hasta is not None:
+            if isinstance(desde, str):
+                desde = datetime.strptime(desde, "%Y-%m-%d")
+            if isinstance(hasta, str):
+                hasta = datetime.strptime(hasta, "%Y-%m-%d") + timedelta(days=1, microseconds=-1)
+            
+            # created_at se guarda como string ISO o como fecha según el origen de la alerta
+            rango_fecha, rango_iso = {}, {}
+            if desde is not None:
+                rango_fecha["$gte"], rango_iso["$gte"] = desde, desde.isoformat()
+            if hasta is not None:
+                rango_fecha["$lte"], rango_iso["$lte"] = hasta, hasta.isoformat()
+            query["$or"] = [{"created_at": rango_fecha}, {"created_at": rango_iso}]
+        
+        return query
+    
+    def obtener_alertas_filtradas(self, categoria: Optional[str] = None, status: Optional[str] = None,
+                                  severity: Optional[str] = None, desde=None, hasta=None,
+                                  skip: int = 0, limit: int = 100, orden: int = -1,
+                                  campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Obtener una página de alertas filtrada en el servidor.
+        
+        Args:
+            categoria, status, severity: Valores exactos a filtrar (None = todos).
+            desde, hasta: 'YYYY-MM-DD' o datetime sobre created_at (hasta incluye el día completo).
+            skip, limit: Paginación (limit=0 devuelve todas las alertas filtradas).
+            orden: -1 más recientes primero, 1 más antiguas primero.
+            campos: Campos a devolver (None = documento completo).
+        """
+        if not self.conectado:
+            return []
+        
+        try:
+            cursor = self.db.alerts.find(
+                self._query_alertas(categoria, status, severity, desde, hasta), self._proyeccion(campos)
+            ).sort("created_at", orden).skip(max(0, int(skip))).limit(max(0, int(limit))).max_time_ms(
+                self._limite_tiempo("lectura")
+            )
+            
+            alertas = list(cursor)
+            for alerta in alertas:
+                alerta["_id"] = str(alerta["_id"])
+            return alertas
+        except Exception as e:
+            print(f"❌ Error obteniendo alertas filtradas: {e}")
+            return []
+    
+    def contar_alertas_filtradas(self, categoria: Optional[str] = None, status: Optional[str] = None,
+                                 severity: Optional[str] = None, desde=None, hasta=None) -> int:
+        """Total de alertas que cumplen los filtros de obtener_alertas_filtradas"""
+        if not self.conectado:
+            return 0
+        
+        try:
+            return self.db.alerts.count_documents(self._query_alertas(categoria, status, severity, desde, hasta),
+                                                  **self._opciones_tiempo("conteo"))
+        except Exception as e:
+            print(f"❌ Error contando alertas filtradas: {e}")
+            return 0
+    
+    def obtener_estadisticas_alertas(self, recientes: int = 10, top_ubicaciones: int = 10,
+                                     campos_recientes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Estadísticas del dashboard de alertas en una sola agregación ($facet).
+        
+        Returns:
+            dict: {"total", "activas", "resueltas", "climaticas", "sensor",
+                   "por_severidad": {severidad: cantidad},
+                   "por_ubicacion": [(ubicación, cantidad)] (las `top_ubicaciones` con más alertas),
+                   "recientes": [alertas] (las `recientes` más nuevas)}
+        """
+        estadisticas = {"total": 0, "activas": 0, "resueltas": 0, "climaticas": 0, "sensor": 0,
+                        "por_severidad": {}, "por_ubicacion": [], "recientes": []}
+        if not self.conectado:
+            return estadisticas
+        
+        def contar_si(campo, valor):
+            return {"$sum": {"$cond": [{"$eq": [f"${campo}", valor]}, 1, 0]}}
+        
+        # Alertas climáticas se agrupan por ciudad/país; las de sensor por sensor_id
+        ubicacion = {"$cond": [
+            {"$eq": [{"$type": "$location"}, "object"]},
+            {"$concat": [{"$toString": {"$ifNull": ["$location.city", "N/A"]}}, ", ",
+                         {"$toString": {"$ifNull": ["$location.country", "N/A"]}}]},
+            {"$toString": {"$ifNull": ["$sensor_id", "N/A"]}}
+        ]}
+        
+        recientes_pipeline = [{"$sort": {"created_at": -1}}, {"$limit": max(0, int(recientes))}]
+        if campos_recientes:
+            recientes_pipeline.append({"$project": self._proyeccion(campos_recientes)})
+        
+        pipeline = [{"$facet": {
+            "totales": [{"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "activas": contar_si("status", "active"),
+                "resueltas": contar_si("status", "resolved"),
+                "climaticas": contar_si("categoria", "Climática"),
+                "sensor": contar_si("categoria", "Sensor")
+            }}],
+            "por_severidad": [
+                {"$group": {"_id": {"$ifNull": ["$severity", "N/A"]}, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}}
+            ],
+            "por_ubicacion": [
+                {"$group": {"_id": ubicacion, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": max(0, int(top_ubicaciones))}
+            ],
+            "recientes": recientes_pipeline
+        }}]
+        
+        try:
+            resultado = next(self.db.alerts.aggregate(pipeline, **self._opciones_tiempo("agregacion")), None) or {}
+            
+            totales = (resultado.get("totales") or [{}])[0]
+            for clave in ("total", "activas", "resueltas", "climaticas", "sensor"):
+                estadisticas[clave] = totales.get(clave, 0)
+            
+            estadisticas["por_severidad"] = {str(g["_id"]): g["count"] for g in resultado.get("por_severidad", [])}
+            estadisticas["por_ubicacion"] = [(g["_id"], g["count"]) for g in resultado.get("por_ubicacion", [])]
+            
+            for alerta in resultado.get("recientes", []):
+                alerta["_id"] = str(alerta["_id"])
+                estadisticas["recientes"].append(alerta)
+            
+            return estadisticas
+        except Exception as e:
+            print(f"❌ Error obteniendo estadísticas de alertas: {e}")
+            return estadisticas
+    
+    def crear_alerta(self, alerta_data: Dict[str, Any]) -> bool:
+        """Crear nueva alerta"""
+        if not self.conectado:
+            return False
+        
+        try:
+            # Asegurar campos de resolución presentes
+            alerta_data.setdefault("resolved_at", None)
+            alerta_data.setdefault("resolved_by", None)
+            result = self.db.alerts.insert_one(alerta_data)
+            if result.inserted_id:
+                print(f"✅ Alerta '{alerta_data['alert_id']}' creada correctamente")
+                return True
+            else:
+                print(f"❌ Error creando alerta '{alerta_data['alert_id']}'")
+                return False
+                
+        except Exception as e:
+            print(f"❌ Error creando alerta: {e}")
+            return False
+    
+    def _colapsar_alertas_duplicadas(self) -> int:
+        """
+        Dejar una sola alerta automática (la más antigua) por clave de deduplicación.
+        
+        Si la que queda sigue activa y alguna duplicada ya fue resuelta, se le copia la
+        resolución más reciente (status/resolved_at/resolved_by) para no perderla.
+        """
+        pipeline = [
+            {"$match": {"automatic": True, "measurement_ts": {"$type": "date"}}},
+            {"$sort": {"created_at": 1, "_id": 1}},
+            {"$group": {"_id": {campo: f"${campo}" for campo, _ in self.CLAVE_DEDUP_ALERTAS},
+                        "alertas": {"$push": {"_id": "$_id", "status": "$status",
+                                              "resolved_at": "$resolved_at", "resolved_by": "$resolved_by"}},
+                        "total": {"$sum": 1}}},
+            {"$match": {"total": {"$gt": 1}}}
+        ]
+        eliminadas = 0
+        for grupo in self.db.alerts.aggregate(pipeline, allowDiskUse=True):
+            conservada, *duplicadas = grupo["alertas"]
+            resueltas = [a for a in duplicadas if a.get("status") not in (None, "active")]
+            if conservada.get("status") in (None, "active") and resueltas:
+                resolucion = max(resueltas, key=lambda a: str(a.get("resolved_at") or ""))
+                self.db.alerts.update_one({"_id": conservada["_id"]}, {"$set": {
+                    campo: resolucion.get(campo) for campo in ("status", "resolved_at", "resolved_by")
+                }})
+            eliminadas += self.db.alerts.delete_many({"_id": {"$in": [a["_id"] for a in duplicadas]}}).deleted_count
+        return eliminadas
+    
+    def crear_alertas_idempotentes(self, alertas: Iterable[Dict[str, Any]], batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Crear alertas automáticas con upserts: una alerta que ya existe para la misma
+        (sensor_id, measurement_ts, parameter, direction) no se duplica ni se modifica.
+        
+        Re-ejecutar la detección cuesta un bulk_write por lote en lugar de una consulta
+        de existencia por medición. Sin el índice único (ver error_indice_dedup_alertas)
+        dos upserts concurrentes de la misma clave pueden duplicar.
+        
+        Returns:
+            dict: {"creadas", "existentes", "errores"}
+        """
+        resumen = {"creadas": 0, "existentes": 0, "errores": 0}
+        if not self.conectado:
+            return resumen
+        
+        batch_size = max(1, int(batch_size))
+        iterador = iter(alertas)
+        
+        while True:
+            lote = list(islice(iterador, batch_size))
+            if not lote:
+                break
+            
+            operaciones = []
+            for alerta in lote:
+                alerta["automatic"] = True
+                alerta.setdefault("resolved_at", None)
+                alerta.setdefault("resolved_by", None)
+                filtro = {campo: alerta.get(campo) for campo, _ in self.CLAVE_DEDUP_ALERTAS}
+                filtro["automatic"] = True
+                operaciones.append(UpdateOne(filtro, {"$setOnInsert": alerta}, upsert=True))
+            
+            try:
+                result = self.db.alerts.bulk_write(operaciones, ordered=False)
+                resumen["creadas"] += result.upserted_count
+                resumen["existentes"] += result.matched_count
+            except BulkWriteError as e:
+                detalles = e.details
+                resumen["creadas"] += detalles.get("nUpserted", 0)
+                resumen["existentes"] += detalles.get("nMatched", 0)
+                for error in detalles.get("writeErrors", []):
+                    # Dos upserts concurrentes de la misma clave: la alerta ya quedó creada por el otro
+                    if error.get("code") == 11000:
+                        resumen["existentes"] += 1
+                    else:
+                        resumen["errores"] += 1
+            except Exception as e:
+                print(f"❌ Error creando alertas idempotentes: {e}")
+                resumen["errores"] += len(operaciones)
+        
+        if resumen["creadas"]:
+            self.invalidar_cache_estadisticas()
+        print(f"✅ Alertas automáticas: {resumen['creadas']} creadas, {resumen['existentes']} ya existían")
+        return resumen
+    
+    # --- Motor de detección de alertas climáticas ---
+    @staticmethod
+    def _valor_umbral(valor) -> Optional[float]:
+        """Umbral almacenado (número, Decimal128 o string con coma) como float"""
+        try:
+            if isinstance(valor, Decimal128):
+                return float(valor.to_decimal())
+            if isinstance(valor, str):
+                valor = valor.replace(',', '.').strip()
+            return float(valor) if valor not in (None, "") else None
+        except (TypeError, ValueError):
+            return None
+    
+    @staticmethod
+    def construir_alerta_climatica(sensor_id: str, sensor_display: str, ciudad: str, pais: str, tipo_alerta: str,
+                                   valor_actual, umbral, parametro: str, timestamp=None) -> Dict[str, Any]:
+        """Documento de una alerta climática automática (sin guardarlo)"""
+        if timestamp:
+            # Con medición, el alert_id sale de la clave de deduplicación: repetir la detección da el mismo id
+            marca = "".join(c for c in str(timestamp) if c.isalnum())
+            alert_id = f"ALERT_CLIMATIC_{sensor_id}_{marca}_{tipo_alerta.replace(' ', '_')}"
+        else:
+            alert_id = f"ALERT_CLIMATIC_{int(time.time() * 1000)}_{sensor_id}_{random.randint(1000, 9999)}"
+        
+        # Severidad según qué tan lejos está del umbral
+        diferencia = abs(valor_actual - umbral)
+        if diferencia > 10:
+            severity = "crítica"
+        elif diferencia > 5:
+            severity = "alta"
+        elif diferencia > 2:
+            severity = "media"
+        else:
+            severity = "baja"
+        
+        unidad = "°C" if parametro == "Temperatura" else "%"
+        mensaje = f"{tipo_alerta} en {ciudad}, {pais}: {valor_actual}{unidad} (umbral: {umbral}{unidad})"
+        
+        alerta = {
+            "alert_id": alert_id,
+            "sensor_id": sensor_id,
+            "sensor_display": sensor_display,
+            "categoria": "Climática",
+            "type": tipo_alerta,
+            "severity": severity,
+            "status": "active",
+            "threshold": umbral,
+            "current_value": valor_actual,
+            "parameter": parametro,
+            "location": {"city": ciudad, "country": pais},
+            "message": mensaje,
+            # Se usa el timestamp de la medición si está disponible
+            "created_at": timestamp if timestamp else datetime.now().isoformat(),
+            "created_by": "SYSTEM",
+            "automatic": True
+        }
+        if timestamp:
+            alerta["measurement_ts"] = timestamp
+            alerta["direction"] = "alta" if tipo_alerta.endswith("Alta") else "baja"
+        return alerta
+    
+    @staticmethod
+    def _pipeline_violaciones(sensor_ids: List[str], perfil: tuple, rango: Optional[Dict[str, Any]] = None,
+                              desde_parametro: Optional[Dict[str, datetime]] = None) -> List[Dict[str, Any]]:
+        """
+        Agregación que devuelve solo las violaciones de un perfil de umbrales
+        (temp_min, temp_max, hum_min, hum_max): una fila por medición, parámetro y dirección.
+        
+        `desde_parametro` acota cada parámetro a timestamps posteriores a su watermark.
+        """
+        desde_parametro = desde_parametro or {}
+        candidatos = []
+        for parametro, campo, minimo, maximo in (("Temperatura", "temperature", perfil[0], perfil[1]),
+                                                 ("Humedad", "humidity", perfil[2], perfil[3])):
+            desde = desde_parametro.get(parametro)
+            if minimo is not None:
+                candidatos.append((parametro, campo, "baja", "$lt", minimo, desde))
+            if maximo is not None:
+                candidatos.append((parametro, campo, "alta", "$gt", maximo, desde))
+        
+        ramas = []
+        for _, campo, _, operador, umbral, desde in candidatos:
+            # Comparaciones de consulta: null/strings no entran porque no son del mismo tipo
+            rama = {campo: {operador: umbral}}
+            if desde is not None:
+                rama["timestamp"] = {"$gt": desde}
+            ramas.append(rama)
+        
+        match = {"sensor_id": {"$in": sensor_ids}, "$or": ramas}
+        if rango:
+            match["timestamp"] = rango
+        
+        return [
+            {"$match": match},
+            {"$project": {
+                "_id": 0,
+                "sensor_id": 1,
+                "timestamp": 1,
+                "violaciones": {"$filter": {
+                    "input": [
+                        {
+                            "parameter": {"$literal": parametro},
+                            "direction": {"$literal": direccion},
+                            "valor": f"${campo}",
+                            "umbral": {"$literal": umbral},
+                            # En expresiones null < número es true: se exige un número
+                            "viola": {"$and": [
+                                {"$isNumber": f"${campo}"},
+                                {operador: [f"${campo}", umbral]},
+                                {"$gt": ["$timestamp", desde]} if desde is not None else True
+                            ]}
+                        }
+                        for parametro, campo, direccion, operador, umbral, desde in candidatos
+                    ],
+                    "cond": "$$this.viola"
+                }}
+            }},
+            {"$unwind": "$violaciones"}
+        ]
+    
+    def _cargar_watermarks_alertas(self, sensor_ids: List[str]) -> Dict[tuple, datetime]:
+        """Último timestamp evaluado por (sensor_id, parámetro)"""
+        return {
+            (doc["sensor_id"], doc["parameter"]): doc.get("ultimo_timestamp")
+            for doc in self.db.alert_watermarks.find({"sensor_id": {"$in": sensor_ids}},
+                                                     {"sensor_id": 1, "parameter": 1, "ultimo_timestamp": 1})
+        }
+    
+    def iniciar_evaluador_tiempo_real(self, **opciones) -> bool:
+        """Arrancar el evaluador de umbrales sobre las mediciones nuevas (ver EvaluadorAlertasTiempoReal)"""
+        if not self.conectado:
+            return False
+        self.detener_evaluador_tiempo_real()
+        self.evaluador = EvaluadorAlertasTiempoReal(self, **opciones)
+        return self.evaluador.iniciar()
+    
+    def detener_evaluador_tiempo_real(self):
+        if self.evaluador:
+            self.evaluador.detener()
+            self.evaluador = None
+    
+    def iniciar_ejecutor_procesos(self, handlers: Dict[str, Callable], **opciones) -> bool:
+        """Arrancar el pool acotado de procesos en segundo plano (ver EjecutorProcesos)"""
+        if not self.conectado:
+            return False
+        self.detener_ejecutor_procesos()
+        self.intervalo_progreso = float(opciones.pop("intervalo_progreso", self.intervalo_progreso))
+        self.ejecutor = EjecutorProcesos(self, **opciones)
+        for tipo, handler in handlers.items():
+            self.ejecutor.registrar(tipo, handler)
+        return self.ejecutor.iniciar()
+    
+    def detener_ejecutor_procesos(self):
+        if self.ejecutor:
+            self.ejecutor.detener()
+            self.ejecutor = None
+    
+    def iniciar_planificador_procesos(self, lease=None, **opciones) -> bool:
+        """Arrancar el planificador de procesos periódicos (requiere el ejecutor; ver PlanificadorProcesos)"""
+        if not self.conectado or not self.ejecutor:
+            return False
+        self.detener_planificador_procesos()
+        self.planificador = PlanificadorProcesos(self, lease=lease, **opciones)
+        return self.planificador.iniciar()
+    
+    def detener_planificador_procesos(self):
+        if self.planificador:
+            self.planificador.detener()
+            self.planificador = None
+    
+    def encolar_proceso(self, process_id: str, tipo: str, payload: Optional[Dict[str, Any]] = None,
+                        prioridad: int = 0, datos: Optional[Dict[str, Any]] = None, local: bool = False) -> bool:
+        """Encolar un trabajo en el ejecutor de procesos (`local`: solo lo corre esta instancia)"""
+        if not self.conectado or not self.ejecutor:
+            return False
+        try:
+            return self.ejecutor.encolar(process_id, tipo, payload, prioridad, datos, local)
+        except Exception as e:
+            print(f"❌ Error encolando proceso {process_id}: {e}")
+            return False
+    
+    def crear_reportador_progreso(self, process_id: str) -> ReportadorProgreso:
+        """Reportador con escrituras coalescidas; queda registrado para obtener_progreso_proceso"""
+        reportador = ReportadorProgreso(self, process_id, self.intervalo_progreso, self.cache_progreso)
+        self._reportadores_progreso[process_id] = reportador
+        return reportador
+    
+    def liberar_reportador_progreso(self, process_id: str):
+        """Olvidar el progreso en memoria y en cache: las lecturas siguientes van a processes"""
+        self._reportadores_progreso.pop(process_id, None)
+        if self.cache_progreso is not None:
+            self.cache_progreso.delete(f"progress:process:{process_id}")
+    
+    def obtener_progreso_proceso(self, process_id: str) -> Optional[Dict[str, Any]]:
+        """Estado y progreso de un proceso: memoria, luego cache y por último solo esos campos de processes"""
+        reportador = self._reportadores_progreso.get(process_id)
+        if reportador and reportador.actual["status"]:
+            return dict(reportador.actual)
+        if self.cache_progreso is not None:
+            cacheado = self.cache_progreso.hgetall(f"progress:process:{process_id}")
+            if cacheado:
+                progreso = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                            for k, v in cacheado.items()}
+                if progreso.get("progress") is not None:
+                    progreso["progress"] = int(float(progreso["progress"]))
+                return progreso
+        if not self.conectado:
+            return None
+        try:
+            return self.db.processes.find_one(
+                {"process_id": process_id}, {"_id": 0, "process_id": 1, "status": 1, "progress": 1, "updated_at": 1},
+                max_time_ms=self._limite_tiempo("lectura")
+            )
+        except Exception as e:
+            print(f"❌ Error obteniendo progreso del proceso {process_id}: {e}")
+            return None
+    
+    def cancelar_proceso(self, process_id: str) -> Optional[str]:
+        """Cancelar un proceso en cola o en ejecución ("cancelled", "cancelando" o None)"""
+        if not self.conectado or not self.ejecutor:
+            return None
+        try:
+            return self.ejecutor.cancelar(process_id)
+        except Exception as e:
+            print(f"❌ Error cancelando proceso {process_id}: {e}")
+            return None
+    
+    def obtener_metricas_procesos(self) -> Dict[str, Any]:
+        """Profundidad de cola y tiempos de ejecución del ejecutor de procesos"""
+        if not self.conectado or not self.ejecutor:
+            return {}
+        try:
+            return self.ejecutor.metricas()
+        except Exception as e:
+            print(f"❌ Error obteniendo métricas de procesos: {e}")
+            return {}
+    
+    @staticmethod
+    def _pipeline_ultimos_evaluados(sensor_ids: List[str], parametros: Iterable[str],
+                                    rango: Optional[Dict[str, Any]] = None,
+                                    desde_parametro: Optional[Dict[str, datetime]] = None) -> List[Dict[str, Any]]:
+        """Agregación con el mayor timestamp (con valor numérico) posterior al watermark, por sensor y parámetro"""
+        desde_parametro = desde_parametro or {}
+        campos = {"Temperatura": "temperature", "Humedad": "humidity"}
+        ramas, maximos = [], {}
+        for parametro in parametros:
+            campo, desde = campos[parametro], desde_parametro.get(parametro)
+            rama = {campo: {"$type": "number"}}
+            if desde is not None:
+                rama["timestamp"] = {"$gt": desde}
+            ramas.append(rama)
+            maximos[parametro] = {"$max": {"$cond": [
+                {"$and": [{"$isNumber": f"${campo}"},
+                          {"$gt": ["$timestamp", desde]} if desde is not None else True]},
+                "$timestamp", None
+            ]}}
+        
+        match = {"sensor_id": {"$in": sensor_ids}, "$or": ramas}
+        if rango:
+            match["timestamp"] = rango
+        return [{"$match": match}, {"$group": {"_id": "$sensor_id", **maximos}}]
+    
+    def _avanzar_watermarks_alertas(self, evaluados: Dict[tuple, datetime]):
+        """Marcar cada (sensor_id, parámetro) como evaluado hasta su timestamp ($max: nunca retrocede)"""
+        operaciones = [
+            UpdateOne(
+                {"_id": f"{sensor_id}:{parametro}"},
+                {"$max": {"ultimo_timestamp": hasta},
+                 "$set": {"sensor_id": sensor_id, "parameter": parametro, "updated_at": datetime.now()}},
+                upsert=True
+            )
+            for (sensor_id, parametro), hasta in evaluados.items()
+        ]
+        if operaciones:
+            self.db.alert_watermarks.bulk_write(operaciones, ordered=False)
+    
+    def detectar_alertas_climaticas(self, sensor_ids: Optional[List[str]] = None,
+                                    parametros: Optional[List[str]] = None,
+                                    reevaluar_desde=None, reevaluar_hasta=None,
+                                    formatear_sensor: Optional[Callable[[Dict[str, Any]], str]] = None,
+                                    batch_size: int = 1000,
+                                    callback_progreso: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Detectar alertas climáticas de las mediciones contra los umbrales por ubicación.
+        
+        Los sensores se agrupan por perfil de umbrales (mismos min/max) y se corre una sola
+        agregación por perfil que devuelve únicamente las violaciones; las alertas se escriben
+        con crear_alertas_idempotentes de a `batch_size`, así que re-ejecutar no duplica.
+        
+        Modo incremental (por defecto): por sensor y parámetro solo se leen las mediciones
+        posteriores al watermark guardado en alert_watermarks y, si el perfil se escribió sin
+        errores, el watermark avanza hasta el último timestamp efectivamente evaluado (sin pasar
+        del inicio de la corrida menos MARGEN_INGESTA_ALERTAS_S). Ese máximo se calcula antes de
+        buscar violaciones, así que todo lo que cuenta también fue evaluado. Este modo lee del
+        primario (no de db_analitica): un secundario atrasado haría avanzar el watermark sobre
+        mediciones que todavía no veía. Lo que queda después del watermark se vuelve a leer en
+        la próxima corrida (las alertas son idempotentes). Mediciones que lleguen con
+        timestamps anteriores al watermark requieren re-evaluar ese rango.
+        
+        Modo re-evaluación (reevaluar_desde y/o reevaluar_hasta): se ignoran los watermarks y
+        se evalúa el rango indicado (por ejemplo después de cambiar umbrales), sin moverlos.
+        
+        Args:
+            sensor_ids (list): Sensores a evaluar (None = todos).
+            parametros (list): 'Temperatura' y/o 'Humedad' (None = ambos).
+            reevaluar_desde, reevaluar_hasta: 'YYYY-MM-DD', datetime o None.
+            formatear_sensor (callable): Texto de sensor_display a partir del documento del sensor.
+        
+        Returns:
+            dict: {"sensores", "perfiles", "violaciones", "creadas", "existentes", "errores", "modo"}
+        """
+        reevaluar = reevaluar_desde is not None or reevaluar_hasta is not None
+        resumen = {"sensores": 0, "perfiles": 0, "violaciones": 0, "creadas": 0, "existentes": 0, "errores": 0,
+                   "modo": "reevaluacion" if reevaluar else "incremental"}
         if not self.conectado:
-            return False
+            return resumen
+        
+        batch_size = max(1, int(batch_size))
+        parametros = [p for p in ("Temperatura", "Humedad") if not parametros or p in parametros]
         
         try:
-            # Asegurar campos de resolución presentes
-            alerta_data.setdefault("resolved_at", None)
-            alerta_data.setdefault("resolved_by", None)
-            result = self.db.alerts.insert_one(alerta_data)
-            if result.inserted_id:
-                print(f"✅ Alerta '{alerta_data['alert_id']}' creada correctamente")
-                return True
+            filtro = {"sensor_id": {"$in": list(sensor_ids)}} if sensor_ids else {}
+            umbrales_sensor = {}
+            datos_sensor = {}
+            for sensor in self.db.sensors.find(filtro, {"sensor_id": 1, "name": 1, "location": 1, "_id": 0}):
+                sensor_id = sensor.get("sensor_id")
+                umbrales = self.umbrales.por_ubicacion(sensor_id) if sensor_id else {}
+                if not umbrales:
+                    continue
+                perfil = tuple(
+                    self._valor_umbral(umbrales.get(parametro, {}).get(limite)) if parametro in parametros else None
+                    for parametro in ("Temperatura", "Humedad") for limite in ("min", "max")
+                )
+                if all(valor is None for valor in perfil):
+                    continue
+                ciudad, pais = ResolvedorUmbrales.ciudad_pais(sensor.get("location"))
+                display = formatear_sensor(sensor) if formatear_sensor else sensor.get("name", sensor_id)
+                datos_sensor[sensor_id] = (ciudad, pais, display)
+                umbrales_sensor[sensor_id] = perfil
+            
+            resumen["sensores"] = len(datos_sensor)
+            
+            if reevaluar:
+                rango = self._normalizar_rango_fechas(reevaluar_desde, reevaluar_hasta)
+                watermarks = {}
+                base = self.db_analitica
             else:
-                print(f"❌ Error creando alerta '{alerta_data['alert_id']}'")
-                return False
+                # Se evalúa hasta el inicio de la corrida, pero el watermark queda `margen` atrás
+                inicio = datetime.now()
+                corte = inicio - timedelta(seconds=self.MARGEN_INGESTA_ALERTAS_S)
+                rango = {"$lte": inicio}
+                watermarks = self._cargar_watermarks_alertas(list(datos_sensor))
+                base = self.db
+            
+            # Grupo = mismo perfil de umbrales y mismos watermarks: una agregación por grupo
+            grupos = {}
+            for sensor_id, perfil in umbrales_sensor.items():
+                desde = tuple(watermarks.get((sensor_id, parametro)) for parametro in ("Temperatura", "Humedad"))
+                grupos.setdefault((perfil, desde), []).append(sensor_id)
+            
+            def escribir(lote):
+                resultado = self.crear_alertas_idempotentes(lote, batch_size)
+                for clave in ("creadas", "existentes", "errores"):
+                    resumen[clave] += resultado[clave]
+                return resultado["errores"]
+            
+            for (perfil, desde), ids in grupos.items():
+                desde_parametro = dict(zip(("Temperatura", "Humedad"), desde))
+                evaluados = {}
+                if not reevaluar:
+                    for fila in base.measurements.aggregate(
+                        self._pipeline_ultimos_evaluados(ids, parametros, rango, desde_parametro),
+                        allowDiskUse=True, **self._opciones_tiempo("agregacion")
+                    ):
+                        for parametro in parametros:
+                            if isinstance(fila.get(parametro), datetime):
+                                evaluados[(fila["_id"], parametro)] = min(fila[parametro], corte)
+                cursor = base.measurements.aggregate(
+                    self._pipeline_violaciones(ids, perfil, rango, desde_parametro),
+                    allowDiskUse=True, batchSize=batch_size, **self._opciones_tiempo("agregacion")
+                )
+                lote = []
+                errores = 0
+                try:
+                    for fila in cursor:
+                        violacion = fila["violaciones"]
+                        ciudad, pais, display = datos_sensor[fila["sensor_id"]]
+                        tipo_alerta = f"{violacion['parameter']} {'Alta' if violacion['direction'] == 'alta' else 'Baja'}"
+                        lote.append(self.construir_alerta_climatica(
+                            fila["sensor_id"], display, ciudad, pais, tipo_alerta,
+                            violacion["valor"], violacion["umbral"], violacion["parameter"], fila.get("timestamp")
+                        ))
+                        if len(lote) >= batch_size:
+                            resumen["violaciones"] += len(lote)
+                            errores += escribir(lote)
+                            lote = []
+                finally:
+                    cursor.close()
+                if lote:
+                    resumen["violaciones"] += len(lote)
+                    errores += escribir(lote)
+                
+                if not reevaluar and not errores:
+                    self._avanzar_watermarks_alertas(evaluados)
                 
+                resumen["perfiles"] += 1
+                if callback_progreso:
+                    callback_progreso(dict(resumen, total_perfiles=len(grupos)))
+            
+            print(f"✅ Detección de alertas ({resumen['modo']}): {resumen['violaciones']} violaciones en "
+                  f"{resumen['sensores']} sensores ({resumen['perfiles']} grupos), {resumen['creadas']} alertas nuevas")
+            return resumen
+            
         except Exception as e:
-            print(f"❌ Error creando alerta: {e}")
-            return False
+            print(f"❌ Error detectando alertas climáticas: {e}")
+            return resumen
     
     def resolver_alerta(self, alert_id: str, resolved_by: Optional[str] = None) -> bool:
         """Resolver alerta cambiando su estado, guardando resolved_at/resolved_by"""
@@ -1530,6 +4280,7 @@ class ServicioMongoDBOptimizado:
             )
             
             if result.acknowledged:
+                self.umbrales.invalidar()
                 print(f"✅ Umbrales guardados para sensor {sensor_id}")
                 return True
             return False
@@ -1598,6 +4349,7 @@ class ServicioMongoDBOptimizado:
             )
             
             if result.acknowledged:
+                self.umbrales.invalidar()
                 print("✅ Umbrales globales guardados")
                 return True
             return False
@@ -1669,23 +4421,8 @@ class ServicioMongoDBOptimizado:
             if not self.conectado:
                 return {}
             
-            # Primero intentar obtener umbrales específicos del sensor
-            umbrales_sensor = self.obtener_umbrales_sensor(sensor_id)
-            
-            if umbrales_sensor and umbrales_sensor.get("thresholds"):
-                return umbrales_sensor["thresholds"]
-            
-            # Si no hay umbrales específicos, usar los globales
-            umbrales_globales = self.obtener_umbrales_globales()
-            
-            if umbrales_globales and umbrales_globales.get("thresholds"):
-                return umbrales_globales["thresholds"]
-            
-            # Si no hay ninguno, usar valores por defecto
-            return {
-                "Temperatura": {"min": 15, "max": 35},
-                "Humedad": {"min": 30, "max": 80}
-            }
+            # Específicos del sensor, si no globales, si no por defecto (desde memoria)
+            return self.umbrales.efectivos(sensor_id)
             
         except Exception as e:
             print(f"❌ Error obteniendo umbrales efectivos para sensor {sensor_id}: {e}")
@@ -1715,6 +4452,7 @@ class ServicioMongoDBOptimizado:
             )
             
             if result.acknowledged:
+                self.umbrales.invalidar()
                 print(f"✅ Umbrales guardados para {ciudad}, {pais}")
                 return True
             else:
@@ -1753,86 +4491,13 @@ class ServicioMongoDBOptimizado:
             if not self.conectado:
                 return {}
             
-            # Obtener información del sensor para conocer su ubicación
-            sensor = self.db.sensors.find_one({"sensor_id": sensor_id})
-            if not sensor:
-                return {}
-            
-            location = sensor.get("location", {})
-            if isinstance(location, dict):
-                ciudad = location.get("city", "")
-                pais = location.get("country", "")
-            elif isinstance(location, str):
-                # Parsear string de ubicación formato "Ciudad, Zona - País" o "Ciudad - País"
-                if ' - ' in location:
-                    # Extraer país (después del guión)
-                    partes = location.split(' - ')
-                    pais = partes[-1].strip()
-                    
-                    # Extraer ciudad (antes del guión, puede tener zona)
-                    ciudad_zona = partes[0].strip()
-                    if ', ' in ciudad_zona:
-                        ciudad, _ = ciudad_zona.split(', ', 1)
-                        ciudad = ciudad.strip()
-                    else:
-                        ciudad = ciudad_zona
-                else:
-                    return {}
-            else:
-                return {}
-            
-            if not ciudad or not pais:
-                return {}
-            
-            # Intentar obtener umbrales específicos de la ubicación
-            umbrales_ubicacion = self.obtener_umbrales_ubicacion(ciudad, pais)
-            
-            if umbrales_ubicacion:
-                return umbrales_ubicacion
-            
-            # Si no hay umbrales específicos de ubicación, usar globales
-            umbrales_globales = self.obtener_umbrales_globales()
-            if umbrales_globales:
-                thresholds_globales = umbrales_globales.get("thresholds", {})
-                if thresholds_globales:
-                    # Persistir los umbrales globales como configuración inicial de la ubicación
-                    self.guardar_umbrales_ubicacion(ciudad, pais, thresholds_globales)
-                    return thresholds_globales
-            
-            # Valores por defecto si no hay configuración
-            thresholds_default = {
-                "Temperatura": {"min": 5, "max": 35},
-                "Humedad": {"min": 30, "max": 80}
-            }
-            self.guardar_umbrales_ubicacion(ciudad, pais, thresholds_default)
-            return thresholds_default
+            # Umbrales de la ubicación, si no globales, si no por defecto (desde memoria, sin escribir)
+            return self.umbrales.por_ubicacion(sensor_id)
             
         except Exception as e:
             print(f"❌ Error obteniendo umbrales efectivos por ubicación para {sensor_id}: {e}")
             return {}
 
-    def obtener_estadisticas(self) -> Dict[str, Any]:
-        """Obtener estadísticas del sistema"""
-        if not self.conectado:
-            return {}
-        
-        try:
-            stats = {
-                "sensores": self.db.sensors.count_documents({}),
-                "usuarios": self.db.users.count_documents({}),
-                "alertas": self.db.alerts.count_documents({}),
-                "mediciones": self.db.measurements.count_documents({}),
-                "facturas": self.db.invoices.count_documents({}),
-                "pagos": self.db.payments.count_documents({}),
-                "procesos": self.db.processes.count_documents({}),
-                "notificaciones": self.db.notifications.count_documents({})
-            }
-            
-            return stats
-        except Exception as e:
-            print(f"❌ Error obteniendo estadísticas: {e}")
-            return {}
-    
     def crear_usuario(self, usuario_data: Dict[str, Any]) -> bool:
         """Crear nuevo usuario"""
         if not self.conectado:
@@ -2023,29 +4688,22 @@ class ServicioMongoDBOptimizado:
             print(f"Error obteniendo ejecuciones del usuario: {e}")
             return []
     
-    def obtener_mediciones_rango(self, sensor_name: str, fecha_inicio: str, fecha_fin: str) -> List[Dict[str, Any]]:
+    def obtener_mediciones_rango(self, sensor_name: str, fecha_inicio: str, fecha_fin: str,
+                                 campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Obtener mediciones de un sensor en un rango de fechas"""
         try:
             if not self.conectado:
                 return []
             
-            collection = self.db["measurements"]
+            collection = self.db_analitica["measurements"]
             
-            # Convertir fechas a datetime
-            from datetime import datetime
-            fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-            fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-            
-            # Consulta con filtros
+            # Consulta con filtros (timestamps almacenados como fechas BSON; el día final es completo)
             query = {
                 "sensor_name": sensor_name,
-                "timestamp": {
-                    "$gte": fecha_inicio_dt.isoformat(),
-                    "$lte": fecha_fin_dt.isoformat()
-                }
+                "timestamp": self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
             }
             
-            mediciones = list(collection.find(query))
+            mediciones = list(self._cursor_mediciones(query, 1, campos))
             return mediciones
             
         except Exception as e:
@@ -2171,9 +4829,14 @@ class ServicioMongoDBOptimizado:
             print(f"Error obteniendo ubicaciones disponibles: {e}")
             return []
     
-    def ejecutar_proceso_analisis(self, tipo_analisis, agrupacion, periodicidad, pais, ciudad, zona=""):
+    def ejecutar_proceso_analisis(self, tipo_analisis, agrupacion, periodicidad, pais, ciudad, zona="",
+                                  fecha_inicio=None, fecha_fin=None):
         """
         Ejecuta un proceso de análisis de datos de sensores utilizando el framework de agregación de MongoDB.
+        
+        La agregación parte de measurements: filtra por sensor_id y rango de fechas (índice
+        sensor_id + timestamp) y agrupa por sensor y período truncado, por lo que el costo es
+        proporcional a la ventana elegida. Los grupos por sensor se combinan luego por ubicación.
 
         Args:
             tipo_analisis (str): El tipo de datos a analizar ('Humedad', 'Temperatura' o 'Ambas').
@@ -2182,6 +4845,7 @@ class ServicioMongoDBOptimizado:
             pais (str): El país para filtrar los datos (opcional).
             ciudad (str): La ciudad para filtrar los datos (opcional).
             zona (str): La zona para filtrar los datos (opcional).
+            fecha_inicio, fecha_fin: 'YYYY-MM-DD', datetime o None para no acotar.
 
         Returns:
             list: Una lista de diccionarios con los resultados de la agregación.
@@ -2190,112 +4854,82 @@ class ServicioMongoDBOptimizado:
             return []
 
         try:
-            pipeline = []
-
-            # ETAPA 1: Primero obtener los sensor_ids que coinciden con la ubicación
-            # Usar método similar al módulo de servicios que sí funciona
-            sensor_ids = []
-            
-            if pais and ciudad:
-                # Buscar en formatos de string - probar variantes comunes
-                sensores_str = list(self.db.sensors.find({
-                    "$or": [
-                        {"location": ciudad},
-                        {"location": f"{ciudad}, {pais}"},
-                        {"location": f"{ciudad} - {pais}"},
-                        {"location": {"$regex": ciudad, "$options": "i"}},
-                        {"location": {"$regex": f"{ciudad}.*{pais}", "$options": "i"}}
-                    ]
-                }))
-                # Buscar en formato objeto
-                sensores_obj = list(self.db.sensors.find({
-                    "$and": [
-                        {"location.city": {"$regex": ciudad, "$options": "i"}},
-                        {"location.country": {"$regex": pais, "$options": "i"}}
-                    ]
-                }))
-                
-                sensor_ids = [s.get("sensor_id") for s in sensores_str + sensores_obj]
-            elif pais:
-                sensores = list(self.db.sensors.find({"location": pais}))
-                sensores_obj = list(self.db.sensors.find({"location.country": pais}))
-                sensor_ids = [s.get("sensor_id") for s in sensores + sensores_obj]
-            elif ciudad:
-                sensores = list(self.db.sensors.find({"location": ciudad}))
-                sensores_obj = list(self.db.sensors.find({"location.city": ciudad}))
-                sensor_ids = [s.get("sensor_id") for s in sensores + sensores_obj]
-            elif zona:
-                sensores = list(self.db.sensors.find({"location": zona}))
-                sensores_obj = list(self.db.sensors.find({"location.zone": zona}))
-                sensor_ids = [s.get("sensor_id") for s in sensores + sensores_obj]
-            else:
-                # Si no hay filtros, obtener todos los sensores
-                sensor_ids = [s.get("sensor_id") for s in list(self.db.sensors.find({}))]
+            # ETAPA 1: Sensores de la ubicación por las claves normalizadas (índice) y su etiqueta
+            campo_ubicacion = {"Ciudad": ("ciudad", "city"), "País": ("pais", "country"),
+                               "Zona": ("zona", "zone")}.get(agrupacion)
+            etiquetas = {}
+            for sensor in self.db_analitica.sensors.find(self._query_claves_ubicacion(ciudad, pais, zona),
+                                               {"sensor_id": 1, "location": 1, "_id": 0}):
+                if not sensor.get("sensor_id"):
+                    continue
+                etiqueta = None
+                if campo_ubicacion:
+                    location = sensor.get("location")
+                    if isinstance(location, dict):
+                        etiqueta = location.get(campo_ubicacion[1], "")
+                    else:
+                        etiqueta = self._claves_ubicacion(location)[f"{campo_ubicacion[1]}_key"].title()
+                etiquetas[sensor["sensor_id"]] = etiqueta
             
-            if not sensor_ids:
+            if not etiquetas:
                 return []
             
-            # ETAPA 2: Filtrar por sensor_id en lugar de por location
-            pipeline.append({"$match": {"sensor_id": {"$in": sensor_ids}}})
-
-            # Etapa de lookup para unir con la colección de mediciones
-            pipeline.append({
-                "$lookup": {
-                    "from": "measurements",
-                    "localField": "sensor_id",
-                    "foreignField": "sensor_id",
-                    "as": "measurements"
-                }
-            })
-
-            # Etapa de desenrollado (unwind) para las mediciones
-            pipeline.append({"$unwind": "$measurements"})
-
-            # Etapa de agrupación (group)
-            group_stage = {
-                "_id": {},
-                "avg_temp": {"$avg": "$measurements.temperature"},
-                "avg_humidity": {"$avg": "$measurements.humidity"}
-            }
-
-            # Agrupación por ubicación
-            if agrupacion == 'Ciudad':
-                group_stage["_id"]["ciudad"] = "$location"
-            elif agrupacion == 'País':
-                group_stage["_id"]["pais"] = "$location"
-            elif agrupacion == 'Zona':
-                group_stage["_id"]["zona"] = "$location"
-
-            # Agrupación por periodicidad
-            if periodicidad == 'Anual':
-                group_stage["_id"]["año"] = {"$year": "$measurements.timestamp"}
-            elif periodicidad == 'Mensual':
-                group_stage["_id"]["año"] = {"$year": "$measurements.timestamp"}
-                group_stage["_id"]["mes"] = {"$month": "$measurements.timestamp"}
-            elif periodicidad == 'Diario':
-                group_stage["_id"]["año"] = {"$year": "$measurements.timestamp"}
-                group_stage["_id"]["mes"] = {"$month": "$measurements.timestamp"}
-                group_stage["_id"]["dia"] = {"$dayOfMonth": "$measurements.timestamp"}
-
-            pipeline.append({"$group": group_stage})
-
-            # Etapa de proyección (project) para dar formato a la salida
-            project_stage = {
-                "_id": 0,
-                "agrupacion": "$_id"
-            }
-            if tipo_analisis == 'Temperatura':
-                project_stage["temperatura_promedio"] = "$avg_temp"
-            elif tipo_analisis == 'Humedad':
-                project_stage["humedad_promedio"] = "$avg_humidity"
-            else: # 'Ambos'
-                project_stage["temperatura_promedio"] = "$avg_temp"
-                project_stage["humedad_promedio"] = "$avg_humidity"
-            
-            pipeline.append({"$project": project_stage})
-
-            # Ejecutar el pipeline de agregación
-            resultados = list(self.db.sensors.aggregate(pipeline))
+            # ETAPA 2: $match sobre measurements por sensor y ventana temporal
+            match = {"sensor_id": {"$in": list(etiquetas)}}
+            rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
+            if rango:
+                match["timestamp"] = rango
+            
+            # ETAPA 3: $group por sensor y período truncado, acumulando suma y cantidad
+            unidad = {"Anual": "year", "Mensual": "month", "Diario": "day"}.get(periodicidad)
+            grupo_id = {"sensor_id": "$sensor_id"}
+            if unidad:
+                grupo_id["periodo"] = {"$dateTrunc": {"date": {"$toDate": "$timestamp"}, "unit": unidad}}
+            
+            desde = (rango or {}).get("$gte")
+            pipeline = [
+                {"$match": match},
+                # Rangos anteriores al corte de retención también leen el archivo frío
+                *self._union_archivo(match, self._filtro_buckets(match, desde, (rango or {}).get("$lte")), desde),
+                {"$group": {
+                    "_id": grupo_id,
+                    "temp_sum": {"$sum": "$temperature"},
+                    "temp_count": {"$sum": {"$cond": [{"$isNumber": "$temperature"}, 1, 0]}},
+                    "hum_sum": {"$sum": "$humidity"},
+                    "hum_count": {"$sum": {"$cond": [{"$isNumber": "$humidity"}, 1, 0]}}
+                }}
+            ]
+            
+            # ETAPA 4: Combinar los grupos por sensor en grupos por ubicación (promedio ponderado)
+            combinados = {}
+            for fila in self.db_analitica.measurements.aggregate(pipeline, allowDiskUse=True, **self._opciones_tiempo("agregacion")):
+                periodo = fila["_id"].get("periodo")
+                clave = (etiquetas.get(fila["_id"]["sensor_id"]), periodo)
+                acumulado = combinados.setdefault(clave, {"temp_sum": 0, "temp_count": 0, "hum_sum": 0, "hum_count": 0})
+                for campo in acumulado:
+                    acumulado[campo] += fila[campo]
+            
+            resultados = []
+            for (etiqueta, periodo), acumulado in sorted(combinados.items(), key=lambda item: (str(item[0][0]), item[0][1] or datetime.min)):
+                grupo = {}
+                if campo_ubicacion:
+                    grupo[campo_ubicacion[0]] = etiqueta
+                if periodo is not None:
+                    grupo["año"] = periodo.year
+                    if periodicidad in ("Mensual", "Diario"):
+                        grupo["mes"] = periodo.month
+                    if periodicidad == "Diario":
+                        grupo["dia"] = periodo.day
+                
+                temperatura = acumulado["temp_sum"] / acumulado["temp_count"] if acumulado["temp_count"] else None
+                humedad = acumulado["hum_sum"] / acumulado["hum_count"] if acumulado["hum_count"] else None
+                
+                resultado = {"agrupacion": grupo}
+                if tipo_analisis != 'Humedad':
+                    resultado["temperatura_promedio"] = temperatura
+                if tipo_analisis != 'Temperatura':
+                    resultado["humedad_promedio"] = humedad
+                resultados.append(resultado)
 
             return resultados
 
@@ -2303,115 +4937,301 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error ejecutando proceso de análisis: {e}")
             return []
 
-    def obtener_datos_temperatura_por_ubicacion(self, ubicacion, fecha_inicio, fecha_fin):
-        """Obtener datos de temperatura para una ubicación específica"""
+    def _resolver_sensor_ids_por_ubicacion(self, ubicacion) -> List[str]:
+        """Resolver los sensor_id de una ubicación (ciudad, país o 'Ciudad, Zona - País')"""
+        ciudad, pais, zona = normalize_location(ubicacion)
+        if pais or zona:
+            return self.buscar_sensor_ids_por_ubicacion(ciudad, pais, zona)
+        
+        # Un único término puede ser una ciudad o un país
+        sensores = self.db_analitica.sensors.find(
+            {"$or": [{"city_key": ciudad}, {"country_key": ciudad}]},
+            {"sensor_id": 1, "_id": 0}
+        )
+        return list({sensor["sensor_id"] for sensor in sensores if sensor.get("sensor_id")})
+    
+    def _normalizar_rango_fechas(self, fecha_inicio, fecha_fin):
+        """
+        Aceptar fechas 'YYYY-MM-DD' o datetime y devolver un filtro de timestamp (o None).
+        Un fecha_fin 'YYYY-MM-DD' incluye el día completo; un datetime es el límite exacto.
+        """
+        if isinstance(fecha_inicio, str):
+            fecha_inicio = datetime.fromisoformat(fecha_inicio)
+        
+        rango = {}
+        if fecha_inicio is not None:
+            rango["$gte"] = fecha_inicio
+        if isinstance(fecha_fin, str) and len(fecha_fin) == 10:
+            rango["$lt"] = datetime.strptime(fecha_fin, "%Y-%m-%d") + timedelta(days=1)
+        elif isinstance(fecha_fin, str):
+            rango["$lte"] = datetime.fromisoformat(fecha_fin)
+        elif fecha_fin is not None:
+            rango["$lte"] = fecha_fin
+        return rango or None
+    
+    def iterar_datos_por_ubicacion(self, ubicacion, fecha_inicio, fecha_fin, parametro: str = "temperatura",
+                                   batch_size: int = 1000):
+        """
+        Recorrer las mediciones de todos los sensores de una ubicación con una única agregación.
+        
+        Las filas salen ya proyectadas (fecha/temperatura/humedad/sensor_id) y ordenadas por
+        timestamp, por lo que el costo es un round trip sin importar la cantidad de sensores.
+        
+        Args:
+            ubicacion (str): Ciudad o país.
+            fecha_inicio, fecha_fin: 'YYYY-MM-DD', datetime o None para no acotar.
+            parametro (str): 'temperatura' o 'humedad'.
+            batch_size (int): Tamaño de lote del cursor.
+        """
+        if not self.conectado:
+            return
+        
+        sensor_ids = self._resolver_sensor_ids_por_ubicacion(ubicacion)
+        print(f"🔍 Buscando sensores para ubicación: '{ubicacion}', encontrados: {len(sensor_ids)}")
+        
+        if not sensor_ids:
+            print(f"⚠️ No se encontraron sensores para la ubicación: {ubicacion}")
+            return
+        
+        match = {"sensor_id": {"$in": sensor_ids}}
+        rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
+        if rango:
+            match["timestamp"] = rango
+        
+        fecha = {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$timestamp"}}}
+        
+        if parametro == "humedad":
+            match["humidity"] = {"$exists": True, "$ne": None}
+            proyeccion = {
+                "_id": 0,
+                "fecha": fecha,
+                "humedad": "$humidity",
+                "ubicacion": {"$literal": ubicacion},
+                "sensor_id": 1,
+                "fuente": {"$literal": "mongodb"}
+            }
+            filtro_final = None
+        else:
+            match["$or"] = [
+                {"temperature": {"$exists": True, "$ne": None}},
+                {"temperature_max": {"$exists": True, "$ne": None}},
+                {"temperature_min": {"$exists": True, "$ne": None}}
+            ]
+            # Si no hay 'temperature' se usa el promedio de max/min ($avg ignora los faltantes)
+            temperatura = {"$ifNull": ["$temperature", {"$avg": ["$temperature_max", "$temperature_min"]}]}
+            proyeccion = {
+                "_id": 0,
+                "fecha": fecha,
+                "temp_max": {"$round": [{"$ifNull": ["$temperature_max", temperatura]}, 2]},
+                "temp_min": {"$round": [{"$ifNull": ["$temperature_min", temperatura]}, 2]},
+                "temperatura": {"$round": [temperatura, 2]},
+                "humedad": {"$ifNull": ["$humidity", 0]},
+                "ubicacion": {"$literal": ubicacion},
+                "sensor_id": 1,
+                "fuente": {"$literal": "mongodb"}
+            }
+            filtro_final = {"temperatura": {"$ne": None}}
+        
+        pipeline = [
+            {"$match": match},
+            *self._union_archivo(match, self._filtro_buckets(match, (rango or {}).get("$gte"),
+                                                             (rango or {}).get("$lte") or (rango or {}).get("$lt")),
+                                 (rango or {}).get("$gte")),
+            {"$sort": {"timestamp": 1}},
+            {"$project": proyeccion}
+        ]
+        if filtro_final:
+            pipeline.append({"$match": filtro_final})
+        
+        cursor = self.db_analitica.measurements.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size, **self._opciones_tiempo("agregacion"))
         try:
-            if not self.conectado:
-                return []
-            
-            # Verificar si las fechas ya son objetos datetime o strings
-            if isinstance(fecha_inicio, str):
-                fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d")
-            else:
-                fecha_inicio_dt = fecha_inicio
-                
-            if isinstance(fecha_fin, str):
-                fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d")
-            else:
-                fecha_fin_dt = fecha_fin
+            yield from cursor
+        finally:
+            cursor.close()
+    
+    def obtener_extremos_por_ubicacion(self, ubicacion, fecha_inicio=None, fecha_fin=None) -> Dict[str, Any]:
+        """
+        Máximo y mínimo de temperatura y humedad de una ubicación calculados con un $group.
+        
+        Por la red viaja un solo documento aunque el rango (None = todo el historial) sea grande.
+        
+        Returns:
+            dict: {"temp_max", "temp_min", "hum_max", "hum_min"} (sin las claves sin datos)
+        """
+        if not self.conectado:
+            return {}
+        
+        try:
+            sensor_ids = self._resolver_sensor_ids_por_ubicacion(ubicacion)
+            if not sensor_ids:
+                return {}
             
-            # Buscar sensores en la ubicación con búsqueda estricta
-            sensors_collection = self.db["sensors"]
+            match = {"sensor_id": {"$in": sensor_ids}}
+            rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin) or {}
+            if rango:
+                match["timestamp"] = rango
             
-            # Búsqueda flexible que encuentra ciudad en diferentes posiciones
-            sensores_encontrados = list(sensors_collection.find({
-                "$or": [
-                    # Coincidencia exacta como string
-                    {"location": ubicacion},
-                    # Coincidencia exacta case insensitive
-                    {"location": {"$regex": f"^{ubicacion}$", "$options": "i"}},
-                    # La ciudad al INICIO seguida de espacio, coma o guión
-                    {"location": {"$regex": f"^{ubicacion}[ ,-]", "$options": "i"}},
-                    # La ciudad en medio: ", Ciudad -"
-                    {"location": {"$regex": f", {ubicacion} -", "$options": "i"}},
-                    # País al final (ubicacion es el país)
-                    {"location": {"$regex": f".* - {ubicacion}$", "$options": "i"}}
-                ]
-            }))
+            # Mismo criterio que iterar_datos_por_ubicacion: sin max/min se usa la temperatura
+            temperatura = {"$ifNull": ["$temperature", {"$avg": ["$temperature_max", "$temperature_min"]}]}
+            pipeline = [
+                {"$match": match},
+                *self._union_archivo(match, self._filtro_buckets(match, rango.get("$gte"), rango.get("$lte") or rango.get("$lt")),
+                                     rango.get("$gte")),
+                {"$group": {
+                    "_id": None,
+                    "temp_max": {"$max": {"$ifNull": ["$temperature_max", temperatura]}},
+                    "temp_min": {"$min": {"$ifNull": ["$temperature_min", temperatura]}},
+                    "hum_max": {"$max": "$humidity"},
+                    "hum_min": {"$min": "$humidity"}
+                }},
+                {"$project": {"_id": 0, "temp_max": {"$round": ["$temp_max", 2]}, "temp_min": {"$round": ["$temp_min", 2]},
+                              "hum_max": 1, "hum_min": 1}}
+            ]
+            doc = next(self.db_analitica.measurements.aggregate(pipeline, allowDiskUse=True, **self._opciones_tiempo("agregacion")), None)
+            return {k: v for k, v in (doc or {}).items() if v is not None}
             
-            # También buscar en formato objeto
-            sensores_obj = list(sensors_collection.find({
-                "$or": [
-                    {"location.city": {"$regex": f"^{ubicacion}$", "$options": "i"}},
-                    {"location.country": {"$regex": f"^{ubicacion}$", "$options": "i"}}
+        except Exception as e:
+            print(f"❌ Error obteniendo extremos para {ubicacion}: {e}")
+            return {}
+    
+    @staticmethod
+    def _combinar_estadisticas(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+        """Unir dos filas de obtener_estadisticas_mediciones (promedios ponderados por su count)"""
+        combinada = {"count": a["count"] + b["count"]}
+        for prefijo in ("temp", "hum"):
+            n_a, n_b = a.get(f"{prefijo}_count", 0), b.get(f"{prefijo}_count", 0)
+            combinada[f"{prefijo}_count"] = n_a + n_b
+            combinada[f"{prefijo}_avg"] = (
+                ((a.get(f"{prefijo}_avg") or 0) * n_a + (b.get(f"{prefijo}_avg") or 0) * n_b) / (n_a + n_b)
+                if n_a + n_b else None
+            )
+            for campo, elegir in ((f"{prefijo}_min", min), (f"{prefijo}_max", max)):
+                valores = [v for v in (a.get(campo), b.get(campo)) if v is not None]
+                combinada[campo] = elegir(valores) if valores else None
+        for campo, elegir in (("desde", min), ("hasta", max)):
+            # El timestamp puede ser fecha BSON o string ISO: se comparan como texto
+            valores = [v for v in (a.get(campo), b.get(campo)) if v is not None]
+            combinada[campo] = elegir(valores, key=str) if valores else None
+        return combinada
+    
+    def obtener_estadisticas_mediciones(self, sensor_ids: List[str], fecha_inicio, fecha_fin,
+                                        tipo_sensor: str = "Todos los Sensores",
+                                        sensor_names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Calcular en el servidor count/promedio/mínimo/máximo/rango de fechas por sensor y en total.
+        
+        Se usa un $facet con dos $group sobre las mismas mediciones, de modo que por la red
+        viajan solo las cifras (un documento por sensor) y no las mediciones crudas.
+        
+        Args:
+            sensor_ids (list): Sensores a incluir.
+            fecha_inicio, fecha_fin: Fechas ISO ('YYYY-MM-DD') o datetime.
+            tipo_sensor (str): 'Todos los Sensores', 'Solo Temperatura' o 'Solo Humedad'.
+            sensor_names (list): Nombres alternativos para mediciones guardadas por sensor_name.
+        
+        Returns:
+            dict: {"por_sensor": {sensor_id: stats}, "total": stats}
+        """
+        vacio = {"por_sensor": {}, "total": {"count": 0}}
+        if not self.conectado or not sensor_ids:
+            return vacio
+        
+        try:
+            rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
+            fecha_inicio_dt = rango["$gte"]
+            fecha_fin_dt = rango.get("$lte") or rango["$lt"]
+            
+            filtro_sensor = [{"sensor_id": {"$in": sensor_ids}}]
+            if sensor_names:
+                filtro_sensor.append({"sensor_name": {"$in": sensor_names}})
+            
+            match = {
+                "$and": [
+                    {"$or": filtro_sensor},
+                    # Las mediciones pueden tener timestamp como fecha BSON o como string ISO
+                    {"$or": [
+                        {"timestamp": rango},
+                        {"timestamp": {operador: valor.isoformat() for operador, valor in rango.items()}}
+                    ]}
                 ]
-            }))
+            }
+            if tipo_sensor == "Solo Temperatura":
+                match["temperature"] = {"$ne": None}
+            elif tipo_sensor == "Solo Humedad":
+                match["humidity"] = {"$ne": None}
+            
+            def contar_presentes(campo):
+                return {"$sum": {"$cond": [{"$ne": [{"$ifNull": [campo, None]}, None]}, 1, 0]}}
+            
+            acumuladores = {
+                "count": {"$sum": 1},
+                "temp_count": contar_presentes("$temperature"),
+                "temp_avg": {"$avg": "$temperature"},
+                "temp_min": {"$min": "$temperature"},
+                "temp_max": {"$max": "$temperature"},
+                "hum_count": contar_presentes("$humidity"),
+                "hum_avg": {"$avg": "$humidity"},
+                "hum_min": {"$min": "$humidity"},
+                "hum_max": {"$max": "$humidity"},
+                "desde": {"$min": "$timestamp"},
+                "hasta": {"$max": "$timestamp"}
+            }
             
-            # Combinar resultados y obtener IDs únicos
-            todos_sensores = sensores_encontrados + sensores_obj
-            sensor_ids = list(set([sensor["sensor_id"] for sensor in todos_sensores if sensor.get("sensor_id")]))
+            filtro_buckets = self._filtro_buckets({"sensor_id": {"$in": sensor_ids}}, fecha_inicio_dt, fecha_fin_dt)
+            if sensor_names:
+                filtro_buckets = {"$and": [
+                    {"$or": [{"sensor_id": {"$in": sensor_ids}}, {"sensor_name": {"$in": sensor_names}}]},
+                    self._filtro_buckets(None, fecha_inicio_dt, fecha_fin_dt)
+                ]}
             
-            print(f"🔍 Buscando sensores para ubicación: '{ubicacion}', encontrados: {len(sensor_ids)}")
+            pipeline = [
+                {"$match": match},
+                *self._union_archivo(match, filtro_buckets, fecha_inicio_dt),
+                {"$facet": {
+                    # Mediciones guardadas solo por sensor_name se agrupan por nombre (no en una clave None)
+                    "por_sensor": [{"$group": {"_id": {"$ifNull": ["$sensor_id", "$sensor_name"]}, **acumuladores}}],
+                    "total": [{"$group": {"_id": None, **acumuladores}}]
+                }}
+            ]
             
-            if not sensor_ids:
-                print(f"⚠️ No se encontraron sensores para la ubicación: {ubicacion}")
-                return []
+            resultado = next(self.db_analitica.measurements.aggregate(pipeline, allowDiskUse=True, **self._opciones_tiempo("agregacion")), None)
+            if not resultado:
+                return vacio
+            
+            # Los grupos por nombre vuelven a su sensor_id; si el sensor también tiene mediciones
+            # por id, se combinan las dos filas
+            id_por_nombre = {}
+            if sensor_names:
+                id_por_nombre = {
+                    sensor["name"]: sensor["sensor_id"]
+                    for sensor in self.db.sensors.find({"sensor_id": {"$in": sensor_ids}, "name": {"$in": sensor_names}},
+                                                       {"sensor_id": 1, "name": 1, "_id": 0})
+                }
+            por_sensor = {}
+            for doc in resultado.get("por_sensor", []):
+                clave = doc.pop("_id")
+                sensor_id = clave if clave in sensor_ids else id_por_nombre.get(clave, clave)
+                por_sensor[sensor_id] = self._combinar_estadisticas(por_sensor[sensor_id], doc) \
+                    if sensor_id in por_sensor else doc
             
-            # Buscar mediciones de temperatura en el rango de fechas
-            measurements_collection = self.db["measurements"]
+            total = resultado.get("total") or [{"count": 0}]
+            total = total[0]
+            total.pop("_id", None)
             
-            datos_temperatura = []
-            mediciones_totales = 0
+            return {"por_sensor": por_sensor, "total": total}
             
-            for sensor_id in sensor_ids:
-                mediciones = measurements_collection.find({
-                    "sensor_id": sensor_id,
-                    "timestamp": {
-                        "$gte": fecha_inicio_dt,
-                        "$lte": fecha_fin_dt
-                    },
-                    "$or": [
-                        {"temperature": {"$exists": True, "$ne": None}},
-                        {"temperature_max": {"$exists": True, "$ne": None}},
-                        {"temperature_min": {"$exists": True, "$ne": None}}
-                    ]
-                }).sort("timestamp", 1)
-                
-                mediciones_lista = list(mediciones)
-                mediciones_totales += len(mediciones_lista)
-                
-                for medicion in mediciones_lista:
-                    temp = medicion.get("temperature")
-                    temp_max = medicion.get("temperature_max")
-                    temp_min = medicion.get("temperature_min")
-
-                    if temp is None:
-                        if temp_max is not None and temp_min is not None:
-                            temp = (temp_max + temp_min) / 2
-                        elif temp_max is not None:
-                            temp = temp_max
-                        elif temp_min is not None:
-                            temp = temp_min
-
-                    temp_max_val = temp_max if temp_max is not None else temp
-                    temp_min_val = temp_min if temp_min is not None else temp
-
-                    if temp is None:
-                        # Si no podemos determinar una temperatura representativa, omitir el registro
-                        continue
-
-                    datos_temperatura.append({
-                        "fecha": medicion["timestamp"].strftime("%Y-%m-%d"),
-                        "temp_max": round(float(temp_max_val), 2) if temp_max_val is not None else None,
-                        "temp_min": round(float(temp_min_val), 2) if temp_min_val is not None else None,
-                        "temperatura": round(float(temp), 2),
-                        "humedad": medicion.get("humidity", 0),
-                        "ubicacion": ubicacion,
-                        "sensor_id": sensor_id,
-                        "fuente": "mongodb"
-                    })
+        except Exception as e:
+            print(f"❌ Error calculando estadísticas de mediciones: {e}")
+            return vacio
+    
+    def obtener_datos_temperatura_por_ubicacion(self, ubicacion, fecha_inicio, fecha_fin):
+        """Obtener datos de temperatura para una ubicación específica"""
+        try:
+            if not self.conectado:
+                return []
             
-            print(f"📊 Total de mediciones encontradas: {mediciones_totales}")
+            datos_temperatura = list(self.iterar_datos_por_ubicacion(ubicacion, fecha_inicio, fecha_fin, "temperatura"))
+            print(f"📊 Total de mediciones encontradas: {len(datos_temperatura)}")
             return datos_temperatura
             
         except Exception as e:
@@ -2424,83 +5244,8 @@ class ServicioMongoDBOptimizado:
             if not self.conectado:
                 return []
             
-            # Verificar si las fechas ya son objetos datetime o strings
-            if isinstance(fecha_inicio, str):
-                fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d")
-            else:
-                fecha_inicio_dt = fecha_inicio
-                
-            if isinstance(fecha_fin, str):
-                fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d")
-            else:
-                fecha_fin_dt = fecha_fin
-            
-            # Buscar sensores en la ubicación con búsqueda estricta
-            sensors_collection = self.db["sensors"]
-            
-            # Búsqueda flexible que encuentra ciudad en diferentes posiciones
-            sensores_encontrados = list(sensors_collection.find({
-                "$or": [
-                    # Coincidencia exacta como string
-                    {"location": ubicacion},
-                    # Coincidencia exacta case insensitive
-                    {"location": {"$regex": f"^{ubicacion}$", "$options": "i"}},
-                    # La ciudad al INICIO seguida de espacio, coma o guión
-                    {"location": {"$regex": f"^{ubicacion}[ ,-]", "$options": "i"}},
-                    # La ciudad en medio: ", Ciudad -"
-                    {"location": {"$regex": f", {ubicacion} -", "$options": "i"}},
-                    # País al final (ubicacion es el país)
-                    {"location": {"$regex": f".* - {ubicacion}$", "$options": "i"}}
-                ]
-            }))
-            
-            # También buscar en formato objeto
-            sensores_obj = list(sensors_collection.find({
-                "$or": [
-                    {"location.city": {"$regex": f"^{ubicacion}$", "$options": "i"}},
-                    {"location.country": {"$regex": f"^{ubicacion}$", "$options": "i"}}
-                ]
-            }))
-            
-            # Combinar resultados y obtener IDs únicos
-            todos_sensores = sensores_encontrados + sensores_obj
-            sensor_ids = list(set([sensor["sensor_id"] for sensor in todos_sensores if sensor.get("sensor_id")]))
-            
-            print(f"🔍 Buscando sensores para ubicación: '{ubicacion}', encontrados: {len(sensor_ids)}")
-            
-            if not sensor_ids:
-                print(f"⚠️ No se encontraron sensores para la ubicación: {ubicacion}")
-                return []
-            
-            # Buscar mediciones de humedad en el rango de fechas
-            measurements_collection = self.db["measurements"]
-            
-            datos_humedad = []
-            mediciones_totales = 0
-            
-            for sensor_id in sensor_ids:
-                mediciones = measurements_collection.find({
-                    "sensor_id": sensor_id,
-                    "timestamp": {
-                        "$gte": fecha_inicio_dt,
-                        "$lte": fecha_fin_dt
-                    },
-                    "humidity": {"$exists": True, "$ne": None}
-                }).sort("timestamp", 1)
-                
-                mediciones_lista = list(mediciones)
-                mediciones_totales += len(mediciones_lista)
-                
-                for medicion in mediciones_lista:
-                    datos_humedad.append({
-                        "fecha": medicion["timestamp"].strftime("%Y-%m-%d"),
-                        "humedad": medicion["humidity"],
-                        "ubicacion": ubicacion,
-                        "sensor_id": sensor_id,
-                        "fuente": "mongodb"
-                    })
-            
-            print(f"📊 Total de mediciones encontradas: {mediciones_totales}")
+            datos_humedad = list(self.iterar_datos_por_ubicacion(ubicacion, fecha_inicio, fecha_fin, "humedad"))
+            print(f"📊 Total de mediciones encontradas: {len(datos_humedad)}")
             return datos_humedad
             
         except Exception as e:
@@ -2531,7 +5276,8 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error obteniendo última medición del sensor {sensor_id}: {e}")
             return None
     
-    def obtener_mediciones_sensor_rango(self, sensor_id: str, horas_atras: int = 24) -> List[Dict[str, Any]]:
+    def obtener_mediciones_sensor_rango(self, sensor_id: str, horas_atras: int = 24,
+                                        campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Obtener mediciones de un sensor en las últimas N horas"""
         try:
             if not self.conectado:
@@ -2541,10 +5287,10 @@ class ServicioMongoDBOptimizado:
             fecha_inicio = datetime.now() - timedelta(hours=horas_atras)
             
             # Buscar mediciones del sensor en el rango
-            mediciones = list(self.db.measurements.find({
+            mediciones = list(self._cursor_mediciones({
                 "sensor_id": sensor_id,
                 "timestamp": {"$gte": fecha_inicio}
-            }).sort("timestamp", -1))
+            }, -1, campos))
             
             # Convertir ObjectId a string
             for medicion in mediciones:
@@ -2557,7 +5303,8 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error obteniendo mediciones del sensor {sensor_id}: {e}")
             return []
     
-    def obtener_mediciones_sensor_por_fechas(self, sensor_id: str, fecha_inicio: str, fecha_fin: str) -> List[Dict[str, Any]]:
+    def obtener_mediciones_sensor_por_fechas(self, sensor_id: str, fecha_inicio: str, fecha_fin: str,
+                                             campos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Obtener mediciones de un sensor en un rango de fechas específicas"""
         try:
             if not self.conectado:
@@ -2568,36 +5315,26 @@ class ServicioMongoDBOptimizado:
             print(f"🔍 DEBUG: Fecha inicio: {fecha_inicio}")
             print(f"🔍 DEBUG: Fecha fin: {fecha_fin}")
             
-            # Convertir fechas a datetime
-            from datetime import datetime
-            fecha_inicio_dt = datetime.fromisoformat(fecha_inicio)
-            fecha_fin_dt = datetime.fromisoformat(fecha_fin)
-            
-            print(f"🔍 DEBUG: Fecha inicio DT: {fecha_inicio_dt}")
-            print(f"🔍 DEBUG: Fecha fin DT: {fecha_fin_dt}")
+            # Convertir fechas a un rango de timestamp (el día final es completo)
+            rango = self._normalizar_rango_fechas(fecha_inicio, fecha_fin)
+            print(f"🔍 DEBUG: Rango: {rango}")
             
             # Primero, verificar si hay mediciones para este sensor
-            total_mediciones = self.db.measurements.count_documents({"sensor_id": sensor_id})
+            total_mediciones = self.db_analitica.measurements.count_documents({"sensor_id": sensor_id})
             print(f"🔍 DEBUG: Total mediciones para sensor {sensor_id}: {total_mediciones}")
             
             if total_mediciones > 0:
                 # Obtener una muestra de mediciones para ver el formato
-                muestra = list(self.db.measurements.find({"sensor_id": sensor_id}).limit(3))
+                muestra = list(self.db_analitica.measurements.find({"sensor_id": sensor_id}).limit(3))
                 print(f"🔍 DEBUG: Muestra de mediciones:")
                 for i, med in enumerate(muestra):
                     print(f"  {i+1}. Timestamp: {med.get('timestamp')} (tipo: {type(med.get('timestamp'))})")
             
             # Buscar mediciones del sensor en el rango de fechas
-            query = {
-                "sensor_id": sensor_id,
-                "timestamp": {
-                    "$gte": fecha_inicio_dt,
-                    "$lte": fecha_fin_dt
-                }
-            }
+            query = {"sensor_id": sensor_id, "timestamp": rango}
             print(f"🔍 DEBUG: Query: {query}")
             
-            mediciones = list(self.db.measurements.find(query).sort("timestamp", -1))
+            mediciones = list(self._cursor_mediciones(query, -1, campos))
             print(f"🔍 DEBUG: Mediciones encontradas: {len(mediciones)}")
             
             # Convertir ObjectId a string
@@ -2611,16 +5348,65 @@ class ServicioMongoDBOptimizado:
             print(f"❌ Error obteniendo mediciones del sensor {sensor_id} por fechas: {e}")
             return []
     
-    def obtener_mediciones_sensor(self, sensor_id: str) -> List[Dict[str, Any]]:
-        """Obtener todas las mediciones de un sensor específico"""
+    def _iterar_lotes_mediciones(self, query: Dict[str, Any], orden: int = -1, batch_size: int = 1000,
+                                 campos: Optional[List[str]] = None, incluir_archivo: bool = True):
+        """Recorrer un cursor de mediciones devolviendo listas de a `batch_size` documentos"""
+        if not self.conectado:
+            return
+        
+        batch_size = max(1, int(batch_size))
+        cursor = self._cursor_mediciones(query, orden, campos, incluir_archivo, batch_size,
+                                         self._limite_tiempo("agregacion"))
+        
+        try:
+            while True:
+                lote = list(islice(cursor, batch_size))
+                if not lote:
+                    break
+                for medicion in lote:
+                    if "_id" in medicion:
+                        medicion["_id"] = str(medicion["_id"])
+                yield lote
+        finally:
+            cursor.close()
+    
+    def iterar_mediciones_sensor(self, sensor_id: str, batch_size: int = 1000,
+                                 campos: Optional[List[str]] = None, incluir_archivo: bool = False):
+        """Variante en streaming de obtener_mediciones_sensor: genera lotes de mediciones"""
+        try:
+            yield from self._iterar_lotes_mediciones({"sensor_id": sensor_id}, -1, batch_size, campos,
+                                                     incluir_archivo)
+        except Exception as e:
+            print(f"❌ Error iterando mediciones del sensor {sensor_id}: {e}")
+    
+    def iterar_mediciones_sensor_por_fechas(self, sensor_id: str, fecha_inicio, fecha_fin,
+                                            batch_size: int = 1000, campos: Optional[List[str]] = None):
+        """Variante en streaming de obtener_mediciones_sensor_por_fechas (orden cronológico)"""
+        try:
+            query = {"sensor_id": sensor_id, "timestamp": self._normalizar_rango_fechas(fecha_inicio, fecha_fin)}
+            yield from self._iterar_lotes_mediciones(query, 1, batch_size, campos)
+        except Exception as e:
+            print(f"❌ Error iterando mediciones del sensor {sensor_id} por fechas: {e}")
+    
+    def iterar_mediciones_sensor_rango(self, sensor_id: str, horas_atras: int = 24,
+                                       batch_size: int = 1000, campos: Optional[List[str]] = None):
+        """Variante en streaming de obtener_mediciones_sensor_rango"""
+        try:
+            fecha_inicio = datetime.now() - timedelta(hours=horas_atras)
+            query = {"sensor_id": sensor_id, "timestamp": {"$gte": fecha_inicio}}
+            yield from self._iterar_lotes_mediciones(query, -1, batch_size, campos)
+        except Exception as e:
+            print(f"❌ Error iterando mediciones del sensor {sensor_id}: {e}")
+    
+    def obtener_mediciones_sensor(self, sensor_id: str, campos: Optional[List[str]] = None,
+                                  incluir_archivo: bool = False) -> List[Dict[str, Any]]:
+        """Obtener las mediciones de un sensor (por defecto solo las que siguen en caliente)"""
         try:
             if not self.conectado:
                 return []
             
             # Buscar todas las mediciones del sensor
-            mediciones = list(self.db.measurements.find(
-                {"sensor_id": sensor_id}
-            ).sort("timestamp", -1))
+            mediciones = list(self._cursor_mediciones({"sensor_id": sensor_id}, -1, campos, incluir_archivo))
             
             # Convertir ObjectId a string si existe
             for medicion in mediciones:
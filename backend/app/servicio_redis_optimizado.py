@@ -43,6 +43,7 @@ class ServicioRedisOptimizado:
         self.prefijo_cache_usuarios = "cache:users:"
         self.prefijo_cache_alertas = "cache:alerts:"
         self.prefijo_cache_mediciones = "cache:measurements:"
+        self.prefijo_leases = "lease:"
     
     def conectar(self) -> bool:
         """Conectar a Redis"""
@@ -413,6 +414,29 @@ class ServicioRedisOptimizado:
             "timestamp": datetime.now().isoformat()
         }
     
+    def adquirir_lease(self, clave: str, propietario: str, ttl: int) -> Optional[bool]:
+        """Tomar un lease exclusivo (SET NX EX). None si Redis no responde."""
+        if not self.conectado:
+            return None
+        
+        try:
+            return bool(self.redis_client.set(f"{self.prefijo_leases}{clave}", propietario, nx=True, ex=int(ttl)))
+        except Exception as e:
+            print(f"❌ Error adquiriendo lease {clave}: {e}")
+            return None
+    
+    def liberar_lease(self, clave: str, propietario: str) -> bool:
+        """Liberar un lease solo si sigue siendo del mismo propietario"""
+        if not self.conectado:
+            return False
+        
+        try:
+            script = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+            return bool(self.redis_client.eval(script, 1, f"{self.prefijo_leases}{clave}", propietario))
+        except Exception as e:
+            print(f"❌ Error liberando lease {clave}: {e}")
+            return False
+    
     # Métodos genéricos para compatibilidad con la aplicación
     def set(self, key: str, value: str, ttl: int = None) -> bool:
         """Establecer valor con TTL opcional"""